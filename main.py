@@ -1,18 +1,144 @@
 import argparse
+import cProfile
+import pstats
+import sys
 
-from src.mass_transit_billing import MassTransitBilling
+from src.csv.file_format import FILE_FORMATS
+from src.mass_transit_billing import MassTransitBilling, ENGINE_JOURNEY, ENGINE_COLUMNAR
+from src.tariff import Tariff
+
+# Functions listed by --profile, by cumulative time
+PROFILE_TOP_FUNCTIONS = 25
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process mass transit billing.")
-    parser.add_argument("zone_path", type=str, help="Path to the zone map CSV file")
-    parser.add_argument("journey_path", type=str, help="Path to the journey data CSV file")
-    parser.add_argument("output_path", type=str, help="Path to the output data CSV file")
+    parser.add_argument("zone_path", type=str,
+                        help="Path to the zone map (CSV, Parquet or Arrow) or a compiled zone index")
+    parser.add_argument("journey_path", type=str, help="Path to the journey data file (CSV, Parquet or Arrow)")
+    parser.add_argument("output_path", type=str, help="Path to the output data file (CSV, Parquet or Arrow)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Bill journeys while reading the file instead of loading it into memory first")
+    parser.add_argument("--engine", choices=[ENGINE_JOURNEY, ENGINE_COLUMNAR], default=ENGINE_JOURNEY,
+                        help="Billing engine: per-event JourneyManager or the NumPy columnar engine")
+
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to parse the file and bill shards of users in parallel")
+
+    parser.add_argument("--state-in", type=str, default=None,
+                        help="Billing state file from a previous run to continue from")
+    parser.add_argument("--state-out", type=str, default=None,
+                        help="Where to save the billing state at the end of this run")
+
+    parser.add_argument("--sort-memory-rows", type=int, default=None,
+                        help="Sort the output externally, keeping at most this many rows in memory")
+
+    parser.add_argument("--quarantine", type=str, default=None,
+                        help="Write rejected rows to this CSV file with their reason code instead of printing them")
+    parser.add_argument("--count-rejects-only", action="store_true",
+                        help="Only count rejected rows by reason and print a summary at the end")
+
+    parser.add_argument("--reorder-window", type=int, default=None,
+                        help="Put taps arriving up to this many seconds out of order back in timestamp order; later "
+                             "taps are rejected")
+
+    parser.add_argument("--evict-idle-users", action="store_true",
+                        help="Drop users from memory once their billing month has closed, keeping only their bills")
+    parser.add_argument("--spill-dir", type=str, default=None,
+                        help="Directory for bills of evicted users spilled to disk (default: the system temp dir)")
+    parser.add_argument("--closed-bills-in-memory", type=int, default=1_000_000,
+                        help="Bills of evicted users kept in memory before they are spilled to disk")
+
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Cache parsed CSV inputs in this directory so reruns on the same files skip parsing")
+    parser.add_argument("--cache-max-mb", type=int, default=1024,
+                        help="Size of the parse cache; the least recently used entries are removed beyond it")
+
+    parser.add_argument("--rebill-index", type=str, default=None,
+                        help="Save an index of the run so a zone map change can be re-billed with "
+                             "'python -m src.zone_rebill' for the affected users only")
+
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="Record every charge in a SQLite ledger; 'python -m src.billing_ledger' prints the "
+                             "charges of a user")
+
+    parser.add_argument("--input-format", choices=FILE_FORMATS, default=None,
+                        help="Format of the journey file; by default taken from its extension (.parquet, .arrow)")
+    parser.add_argument("--output-format", choices=FILE_FORMATS, default=None,
+                        help="Format of the output file; by default taken from its extension (.parquet, .arrow)")
+
+    parser.add_argument("--tariffs", type=str, default=None,
+                        help="JSON list of tariffs to simulate in one pass; output_path gets a bill column per tariff")
+    parser.add_argument("--tariff-summary", type=str, default=None,
+                        help="Write the revenue of each simulated tariff as JSON to this file ('-' for stdout)")
+
+    parser.add_argument("--batch", action="store_true",
+                        help="Bill many journey files: journey_path is a directory or a glob pattern and output_path "
+                             "the directory the bills of each file are written to")
+    parser.add_argument("--batch-processes", type=int, default=None,
+                        help="Journey files billed at once in batch mode (default: one per CPU)")
+
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Write per-stage timings, memory and billing counters as JSON to this file ('-' for "
+                             "stdout)")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Run under cProfile, save the stats to this file and print the top functions")
 
     args = parser.parse_args()
 
-    billing_system = MassTransitBilling(args.journey_path, args.zone_path,args.output_path)
-    billing_system.run()
+    if args.batch:
+        # Options that write one file for the whole run or change how a single run is executed
+        single_run_options = {"--workers": args.workers > 1, "--state-in": args.state_in, "--state-out": args.state_out,
+                              "--quarantine": args.quarantine, "--metrics": args.metrics,
+                              "--rebill-index": args.rebill_index, "--ledger": args.ledger, "--tariffs": args.tariffs,
+                              "--tariff-summary": args.tariff_summary, "--profile": args.profile}
+        unsupported = [option for option, value in single_run_options.items() if value]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --batch")
+        try:
+            failures = MassTransitBilling.run_batch(
+                args.journey_path, args.zone_path, args.output_path, processes=args.batch_processes,
+                output_format=args.output_format, streaming=args.stream, engine=args.engine,
+                sort_memory_rows=args.sort_memory_rows, count_rejects_only=args.count_rejects_only,
+                reorder_window=args.reorder_window, input_format=args.input_format,
+                evict_idle_users=args.evict_idle_users, spill_dir=args.spill_dir,
+                closed_bills_in_memory=args.closed_bills_in_memory, cache_dir=args.cache_dir,
+                cache_max_bytes=args.cache_max_mb * 1024 * 1024)
+        except ValueError as ve:
+            print(ve)
+            sys.exit(1)
+        sys.exit(1 if failures else 0)
+
+    # Tariff simulation prices the journeys as columns
+    engine = ENGINE_COLUMNAR if args.tariffs else args.engine
+    billing_system = MassTransitBilling(args.journey_path, args.zone_path, args.output_path, engine=engine,
+                                        workers=args.workers, state_in=args.state_in, state_out=args.state_out,
+                                        sort_memory_rows=args.sort_memory_rows, quarantine_path=args.quarantine,
+                                        count_rejects_only=args.count_rejects_only, metrics_path=args.metrics,
+                                        reorder_window=args.reorder_window, input_format=args.input_format,
+                                        output_format=args.output_format, evict_idle_users=args.evict_idle_users,
+                                        spill_dir=args.spill_dir,
+                                        closed_bills_in_memory=args.closed_bills_in_memory,
+                                        cache_dir=args.cache_dir, cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+                                        rebill_index_path=args.rebill_index, ledger_path=args.ledger)
+    if args.tariffs:
+        try:
+            tariffs = Tariff.load(args.tariffs)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reading tariffs: {e}")
+            sys.exit(1)
+        run, run_args = billing_system.simulate, {"tariffs": tariffs, "summary_path": args.tariff_summary}
+    else:
+        run, run_args = billing_system.run, {"streaming": args.stream}
+
+    if not args.profile:
+        run(**run_args)
+        return
+
+    profiler = cProfile.Profile()
+    profiler.runcall(run, **run_args)
+    profiler.dump_stats(args.profile)
+    pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_FUNCTIONS)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from src.billing_manager import BillingManager
+from src.csv.bulk_csv_writer import BulkCSVWriter
+from src.csv.data_processor import DataProcessor
+from src.journey import JourneyManager
+from src.mass_transit_billing import MassTransitBilling
+from src.synthetic_data import JourneyGenerator
+from src.tariff import FareTable
+from src.util.memory_usage import peak_rss_mb, reset_peak_rss
+
+STAGES = ["zone_map", "parse", "calculate", "sort", "write"]
+DEFAULT_TOLERANCE = 0.10
+
+T = TypeVar("T")
+
+
+def current_version() -> str:
+    """Git description of the checked out tree, so results can be compared between versions"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class BenchmarkHarness:
+    """Times the stages of a billing run separately: zone map load, DataProcessor parse, JourneyManager.calculate,
+    sorting and BulkCSVWriter. Each stage records its best wall time over the repeats, its rows per second and its peak
+    RSS"""
+
+    def __init__(self, zone_path: str, journey_path: str, output_path: str, repeat: int = 3):
+        self.zone_path = zone_path
+        self.journey_path = journey_path
+        self.output_path = output_path
+        self.repeat = repeat
+
+    def run(self) -> dict:
+        timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        peaks: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self._per_stage_peaks = True
+
+        def timed(stage: str, step: Callable[[], T]) -> T:
+            self._per_stage_peaks = reset_peak_rss() and self._per_stage_peaks
+            start = time.perf_counter()
+            value = step()
+            timings[stage].append(time.perf_counter() - start)
+            peaks[stage] = max(peaks[stage], peak_rss_mb())
+            return value
+
+        billing = MassTransitBilling(self.journey_path, self.zone_path, self.output_path)
+        for _ in range(self.repeat):
+            zones = timed("zone_map", lambda: FareTable.from_zone_map_csv(self.zone_path))
+            journeys = timed("parse", lambda: DataProcessor.read_transaction_from_csv(self.journey_path, zones))
+            if isinstance(journeys, str):
+                raise ValueError(f"Error reading transaction data: {journeys}")
+            bills = timed("calculate", lambda: dict(JourneyManager(BillingManager(), zones).calculate(journeys)))
+            sorted_bills = timed("sort", lambda: billing.sorted_data(bills))
+            timed("write", lambda: BulkCSVWriter(self.output_path).write_csv(sorted_bills, self.output_path))
+
+        rows, users = len(journeys), len(bills)
+        stage_rows = {"zone_map": len(zones), "parse": rows, "calculate": rows, "sort": users,
+                      "write": users}
+        stages = {}
+        for stage in STAGES:
+            seconds = min(timings[stage])
+            stages[stage] = {
+                "seconds": seconds,
+                "rows": stage_rows[stage],
+                "rows_per_sec": stage_rows[stage] / seconds if seconds else None,
+                "peak_rss_mb": round(peaks[stage], 1),
+            }
+
+        return {
+            "version": current_version(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "repeat": self.repeat,
+            "dataset": {"journey_rows": rows, "users": users, "stations": len(zones),
+                        "journey_bytes": os.path.getsize(self.journey_path)},
+            # Without a per-stage reset the peak RSS is the process peak up to the end of the stage
+            "peak_rss_scope": "stage" if self._per_stage_peaks else "process",
+            "stages": stages,
+        }
+
+
+def save_result(result: dict, results_path: str):
+    """Append a result to the JSON lines history file"""
+    with open(results_path, 'a') as file:
+        file.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+def load_results(results_path: str) -> List[dict]:
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def find_baseline(results: List[dict], result: dict, version: str = None) -> Optional[dict]:
+    """Latest earlier result on the same dataset, optionally from a given version"""
+    for previous in reversed(results):
+        if previous["dataset"] == result["dataset"] and (version is None or previous["version"] == version):
+            return previous
+    return None
+
+
+def compare(result: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Stages that got slower than the baseline by more than the tolerance, as printable lines"""
+    regressions = []
+    for stage, timing in result["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before and before["seconds"] and timing["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(f"{stage}: {timing['seconds']:.4f}s vs {before['seconds']:.4f}s in "
+                               f"{baseline['version']} ({timing['seconds'] / before['seconds'] - 1:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of a billing run.")
+    parser.add_argument("--zone-path", type=str, default=None, help="Zone map to use instead of generating one")
+    parser.add_argument("--journey-path", type=str, default=None, help="Journey file to use instead of generating one")
+    parser.add_argument("--users", type=int, default=100_000, help="Users in the generated data")
+    parser.add_argument("--stations", type=int, default=1000, help="Stations in the generated data")
+    parser.add_argument("--days", type=int, default=7, help="Days of generated journeys")
+    parser.add_argument("--journeys-per-day", type=int, default=None, help="Journeys per day in the generated data")
+    parser.add_argument("--missing-tap-rate", type=float, default=0.02, help="Share of journeys missing a tap")
+    parser.add_argument("--cap-hit-rate", type=float, default=0.05, help="Share of riders hitting the daily cap")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated data")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the best time is kept")
+    parser.add_argument("--results", type=str, default="benchmark_results.jsonl",
+                        help="JSON lines file the result is appended to")
+    parser.add_argument("--baseline-version", type=str, default=None,
+                        help="Compare against this version instead of the latest result on the same data")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Slowdown per stage allowed before it is reported as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="transit-benchmark-") as work_dir:
+        zone_path, journey_path = args.zone_path, args.journey_path
+        if zone_path is None or journey_path is None:
+            generator = JourneyGenerator(args.users, args.stations, args.days,
+                                         journeys_per_day=args.journeys_per_day,
+                                         missing_tap_rate=args.missing_tap_rate, cap_hit_rate=args.cap_hit_rate,
+                                         seed=args.seed)
+            zone_path, journey_path = generator.generate(work_dir)
+
+        result = BenchmarkHarness(zone_path, journey_path, os.path.join(work_dir, "output.csv"), args.repeat).run()
+
+    for stage, timing in result["stages"].items():
+        print(f"{stage:<10} {timing['seconds']:9.4f}s {timing['rows_per_sec'] or 0:14,.0f} rows/s "
+              f"{timing['peak_rss_mb']:9.1f} MB peak RSS")
+
+    baseline = find_baseline(load_results(args.results), result, args.baseline_version)
+    save_result(result, args.results)
+    if baseline is None:
+        print("No earlier result on this dataset to compare with")
+        return
+
+    regressions = compare(result, baseline, args.tolerance)
+    for line in regressions:
+        print(f"Regression in {line}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against {baseline['version']}")
+
+
+if __name__ == "__main__":
+    main()
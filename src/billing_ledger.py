@@ -0,0 +1,266 @@
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+from datetime import date
+from itertools import chain, count, islice
+from typing import Dict, List, NamedTuple, Optional
+
+from src.util.timestamp_parser import as_datetime
+
+# Why a charge was made
+REASON_TRIP = "trip"
+REASON_MISSING_IN = "missing-IN"
+REASON_MISSING_OUT = "missing-OUT"
+REASON_CROSS_DAY = "cross-day"
+REASON_END_OF_DAY = "end-of-day"
+REASONS = (REASON_TRIP, REASON_MISSING_IN, REASON_MISSING_OUT, REASON_CROSS_DAY, REASON_END_OF_DAY)
+
+# Julian day number of day ordinal 0, to show day ordinals as dates in SQL
+JULIAN_DAY_OFFSET = 1721424.5
+
+# Charges refer to users, stations and reasons by integer id; the charge_history view shows them by name
+SCHEMA = f"""
+CREATE TABLE users (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL);
+CREATE TABLE stations (id INTEGER PRIMARY KEY, station TEXT NOT NULL);
+CREATE TABLE reasons (id INTEGER PRIMARY KEY, reason TEXT NOT NULL);
+CREATE TABLE charges (
+    user INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    in_station INTEGER,
+    in_time INTEGER,
+    out_station INTEGER,
+    out_time INTEGER,
+    base_cost REAL NOT NULL,
+    charged REAL NOT NULL,
+    reason INTEGER NOT NULL
+);
+CREATE VIEW charge_history AS
+SELECT users.user_id, date(charges.day + {JULIAN_DAY_OFFSET}) AS day, origin.station AS in_station,
+       datetime(charges.in_time, 'unixepoch') AS in_time, destination.station AS out_station,
+       datetime(charges.out_time, 'unixepoch') AS out_time, charges.base_cost, charges.charged, reasons.reason
+FROM charges
+JOIN users ON users.id = charges.user
+JOIN reasons ON reasons.id = charges.reason
+LEFT JOIN stations AS origin ON origin.id = charges.in_station
+LEFT JOIN stations AS destination ON destination.id = charges.out_station;
+"""
+INDEXES = """
+CREATE UNIQUE INDEX users_by_name ON users (user_id);
+CREATE INDEX charges_by_user_day ON charges (user, day);
+"""
+
+COLUMNS = ("user", "day", "in_station", "in_time", "out_station", "out_time", "base_cost", "charged", "reason")
+INSERT = f"INSERT INTO charges VALUES ({', '.join('?' for _ in COLUMNS)})"
+# Rows bound per INSERT statement; one statement for many rows costs less than a statement per row
+ROWS_PER_INSERT = 100
+INSERT_MANY = INSERT + f", ({', '.join('?' for _ in COLUMNS)})" * (ROWS_PER_INSERT - 1)
+
+HISTORY = """
+SELECT users.user_id, charges.day, origin.station, charges.in_time, destination.station, charges.out_time,
+       charges.base_cost, charges.charged, reasons.reason
+FROM users
+JOIN charges ON charges.user = users.id
+JOIN reasons ON reasons.id = charges.reason
+LEFT JOIN stations AS origin ON origin.id = charges.in_station
+LEFT JOIN stations AS destination ON destination.id = charges.out_station
+WHERE users.user_id = ? AND charges.day BETWEEN ? AND ?
+ORDER BY charges.day, charges.rowid
+"""
+
+
+class LedgerEntry(NamedTuple):
+    """One charge: the journey it was for, its cost before the caps and the amount added to the bill"""
+    user_id: str
+    day: date
+    in_station: Optional[str]
+    in_time: Optional[int]
+    out_station: Optional[str]
+    out_time: Optional[int]
+    base_cost: float
+    charged: float
+    reason: str
+
+
+class BillingLedger:
+    """Writes a record of every charge JourneyManager makes to a SQLite database.
+
+    record() only appends the charge to per-column lists. Every batch_rows charges the users, stations and reasons
+    of the batch are interned to integer ids, which keeps the rows small, and the batch is inserted in one
+    transaction with journaling and syncing off, ROWS_PER_INSERT rows per statement. Binding the values holds the
+    GIL and costs most of an insert; SQLite's own work runs without it, so on a machine with more than one core a
+    writer thread does the inserts and that part overlaps the billing loop. On a single core the thread would only
+    take turns with the loop, so batches are inserted in place. The indexes on user and day are built once all rows
+    are in, which is cheaper than keeping them up to date row by row. The database is written next to ledger_path
+    and moved into place by close(), so a failed run leaves the previous ledger untouched. The day of a charge is
+    the day whose cap it counted towards.
+    """
+
+    def __init__(self, ledger_path: str, batch_rows: int = 50_000, writer_thread: bool = None):
+        if batch_rows < 1:
+            raise ValueError(f"Batch size must be at least one row, got {batch_rows}")
+        self.ledger_path = ledger_path
+        self.batch_rows = batch_rows
+        self._temp_path = f"{ledger_path}.tmp"
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+        self._db = sqlite3.connect(self._temp_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.executescript(SCHEMA)
+        self._db.executemany("INSERT INTO reasons VALUES (?, ?)", enumerate(REASONS))
+
+        # Names are interned once per batch by setdefault with ids drawn from one counter, so ids are unique but not
+        # consecutive. None, a missing station, stays None
+        self._ids = count()
+        self._users: Dict[str, int] = {}
+        self._stations: Dict[Optional[str], Optional[int]] = {None: None}
+        self._reasons = {reason: reason_id for reason_id, reason in enumerate(REASONS)}
+        # Charges not yet handed over, one list per column of the charges table
+        self._new_columns()
+        self._error: Optional[BaseException] = None
+        self._writer = None
+        if writer_thread if writer_thread is not None else (os.cpu_count() or 1) > 1:
+            # At most two batches wait for the writer, bounding the memory held by records not yet inserted
+            self._batches: queue.Queue = queue.Queue(2)
+            self._writer = threading.Thread(target=self._write_batches, name="ledger writer", daemon=True)
+            self._writer.start()
+        # Charges recorded so far
+        self.rows = 0
+
+    def record(self, user_id: str, day: int, in_station: Optional[str], in_time: Optional[int],
+               out_station: Optional[str], out_time: Optional[int], base_cost: float, charged: float, reason: str):
+        self._user_column.append(user_id)
+        self._day_column.append(day)
+        self._in_station_column.append(in_station)
+        self._in_time_column.append(in_time)
+        self._out_station_column.append(out_station)
+        self._out_time_column.append(out_time)
+        self._base_cost_column.append(base_cost)
+        self._charged_column.append(charged)
+        self._reason_column.append(reason)
+        if len(self._reason_column) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """Hand the records collected so far to the writer"""
+        if self._error is not None:
+            raise self._error
+        recorded = len(self._reason_column)
+        if not recorded:
+            return
+        user, day, in_station, in_time, out_station, out_time, base_cost, charged, reason = self._columns
+        users, stations, ids = self._users.setdefault, self._stations.setdefault, self._ids
+        batch = (list(map(users, user, ids)), day, list(map(stations, in_station, ids)), in_time,
+                 list(map(stations, out_station, ids)), out_time, base_cost, charged,
+                 list(map(self._reasons.__getitem__, reason)))
+        self._new_columns()
+        if self._writer is None:
+            self._insert(batch)
+        else:
+            self._batches.put(batch)
+        self.rows += recorded
+
+    def close(self):
+        """Write the remaining records, index them and move the database into place"""
+        self.flush()
+        if self._writer is not None:
+            self._batches.put(None)
+            self._writer.join()
+            if self._error is not None:
+                raise self._error
+
+        with self._db:
+            self._db.executemany("INSERT INTO users VALUES (?, ?)",
+                                 ((user, user_id) for user_id, user in self._users.items()))
+            self._db.executemany("INSERT INTO stations VALUES (?, ?)",
+                                 ((station_id, station) for station, station_id in self._stations.items()
+                                  if station is not None))
+        self._db.executescript(INDEXES)
+        self._db.close()
+        os.replace(self._temp_path, self.ledger_path)
+
+    def discard(self):
+        """Drop the database of a run that did not complete; a closed ledger is left in place"""
+        if self._writer is not None and self._writer.is_alive():
+            self._new_columns()
+            self._batches.put(None)
+            self._writer.join()
+        self._db.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def _new_columns(self):
+        self._columns = [[] for _ in COLUMNS]
+        (self._user_column, self._day_column, self._in_station_column, self._in_time_column,
+         self._out_station_column, self._out_time_column, self._base_cost_column, self._charged_column,
+         self._reason_column) = self._columns
+
+    def _insert(self, batch: tuple):
+        """Insert a batch of columns in one transaction, ROWS_PER_INSERT rows per statement"""
+        rows = zip(*batch)
+        with self._db:
+            while True:
+                chunk = list(islice(rows, ROWS_PER_INSERT))
+                if len(chunk) < ROWS_PER_INSERT:
+                    self._db.executemany(INSERT, chunk)
+                    return
+                self._db.execute(INSERT_MANY, list(chain.from_iterable(chunk)))
+
+    def _write_batches(self):
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                return
+            if self._error is not None:
+                # Keep draining so the billing loop never blocks on a writer that failed
+                continue
+            try:
+                self._insert(batch)
+            except Exception as e:
+                self._error = e
+
+
+class LedgerReader:
+    """Looks up the charges of single users in a ledger, keeping the database open between lookups"""
+
+    def __init__(self, ledger_path: str):
+        self._db = sqlite3.connect(f"file:{ledger_path}?mode=ro", uri=True)
+
+    def history(self, user_id: str, first_day: date = None, last_day: date = None) -> List[LedgerEntry]:
+        """Charges of one user by day, in the order they were made, optionally limited to first_day to last_day
+        inclusive. The index on user and day serves the lookup and the order"""
+        rows = self._db.execute(HISTORY, (user_id, first_day.toordinal() if first_day else 0,
+                                          last_day.toordinal() if last_day else date.max.toordinal())).fetchall()
+        return [LedgerEntry(row[0], date.fromordinal(row[1]), *row[2:]) for row in rows]
+
+    def close(self):
+        self._db.close()
+
+
+def _format_time(epoch: Optional[int]) -> str:
+    return "-" if epoch is None else as_datetime(epoch).isoformat()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the charges of one user from a billing ledger.")
+    parser.add_argument("ledger_path", type=str, help="Ledger written by main.py --ledger")
+    parser.add_argument("user_id", type=str)
+    parser.add_argument("--from", dest="first_day", type=date.fromisoformat, default=None,
+                        help="First day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="last_day", type=date.fromisoformat, default=None, help="Last day (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    reader = LedgerReader(args.ledger_path)
+    entries = reader.history(args.user_id, args.first_day, args.last_day)
+    reader.close()
+    for entry in entries:
+        print(f"{entry.day} {entry.reason:<11} {entry.in_station or '-'} {_format_time(entry.in_time)} -> "
+              f"{entry.out_station or '-'} {_format_time(entry.out_time)}: {entry.base_cost:.2f}, charged "
+              f"{entry.charged:.2f}")
+    print(f"{len(entries)} charges, {sum(entry.charged for entry in entries):.2f} in total")
+
+
+if __name__ == "__main__":
+    main()
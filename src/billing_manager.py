@@ -1,114 +1,182 @@
 from datetime import datetime
-from typing import Dict
+from typing import Iterator, MutableMapping, Optional, Tuple, Union
 
-from src.model.track_prev_tap import TimeCap, TrackPrevInTap
+from src.closed_bills import ClosedBills
+from src.model.billing_stats import BillingStats
+from src.model.track_prev_tap import TrackPrevInTap
+from src.model.user_state import UserState
+from src.user_state_store import UserStateStore, BillView, CapView, CapRecord, ActiveJourneyView
 from src.util.constans import PENALTY_CHARGES, DAILY_CAP, MONTHLY_CAP
+from src.util.reject_sink import current_sink, UNKNOWN_USER, INTERNAL_ERROR
+from src.util.timestamp_parser import day_key, month_key
 
 
 class BillingManager:
 
     def __init__(self):
-        """Initializes the BillingManager with dictionaries to track user bills and caps"""
+        """Initializes the BillingManager with a compact store of per-user records and dictionary views over it"""
+
+        # One record per user holding the bill, both caps and the active journey
+        self.users = UserStateStore()
 
         # Tracks the total bill for each user
-        self.user_bill: Dict[str, float] = {}
+        self.user_bill: MutableMapping[str, float] = BillView(self.users)
         # Stores the current active journey
-        self.track_active_journey: Dict[str, TrackPrevInTap] = {}
+        self.track_active_journey: MutableMapping[str, TrackPrevInTap] = ActiveJourneyView(self.users)
         # Tracks the 24-hour caps for each user
-        self.user_24hour_cap: Dict[str, TimeCap] = {}
+        self.user_24hour_cap: MutableMapping[str, CapRecord] = CapView(self.users, daily=True)
         # Tracks the 30-day caps for each user
-        self.user_30days_cap: Dict[str, TimeCap] = {}
-
-    def initialize_user(self, user_id: str, event_time: datetime):
+        self.user_30days_cap: MutableMapping[str, CapRecord] = CapView(self.users, daily=False)
+
+        # Penalty, cap clamp and cap reset counters
+        self.stats = BillingStats()
+
+        # Bills of users evicted after their billing month closed; None keeps every user in memory
+        self.closed_bills: Optional[ClosedBills] = None
+
+    def enable_eviction(self, closed_bills: ClosedBills = None):
+        """Evict idle users once their billing month has closed, keeping their bills in closed_bills"""
+        self.closed_bills = closed_bills if closed_bills is not None else ClosedBills()
+
+    def evict_closed_periods(self, month: int) -> int:
+        """Evict users without an open journey whose last tap was before month, the month of the event-time
+        watermark. Taps arrive in timestamp order, so such a user's next tap starts a new month and a new day, which
+        resets both caps: the record holds nothing but the bill. Returns the number of users evicted"""
+        users = self.users
+        idle = [record for record in users.records() if record.month_key < month and record.in_station is None]
+        for record in idle:
+            self.closed_bills.add(record.user_id, record.bill)
+            users.remove(record.user_id)
+        return len(idle)
+
+    def all_bills(self) -> Iterator[Tuple[str, float]]:
+        """(user_id, bill) of every user billed, including evicted ones"""
+        if self.closed_bills is None:
+            return iter(self.user_bill.items())
+        return self.closed_bills.totals(self.user_bill.items())
+
+    def initialize_user(self, user_id: str, event_time: Union[int, datetime], day: int = None,
+                        month: int = None) -> UserState:
         """Initialize user with default billing and cap tracking values"""
 
         try:
-            self.user_bill[user_id] = 0.0
-            self.user_24hour_cap[user_id] = TimeCap(event_time, 0.0)
-            self.user_30days_cap[user_id] = TimeCap(event_time, 0.0)
+            record = self.users.add(user_id, event_time, day, month)
+            if self.closed_bills is not None:
+                # A returning user carries on with the bill kept when they were evicted
+                record.bill = self.closed_bills.take(user_id)
+            return record
         except Exception as e:
-            print(f"Error initializing user {user_id} at {event_time}: {e}")
+            current_sink().reject(INTERNAL_ERROR, message=f"Error initializing user {user_id} at {event_time}: {e}")
 
-    def reset_daily_cap(self, user_id: str, event_time: datetime):
+    def reset_daily_cap(self, user_id: str, event_time: Union[int, datetime]):
         """Reset the 24-hour cap for a new day"""
         try:
-            if user_id in self.user_24hour_cap:
-                self.user_24hour_cap[user_id].active_time = event_time
-                self.user_24hour_cap[user_id].bill_cost = 0.0
+            record = self.users.get(user_id)
+            if record is not None:
+                self.reset_record_daily_cap(record, event_time, day_key(event_time))
             else:
-                raise KeyError(f"User {user_id} not found in daily cap tracking.")
+                raise KeyError(user_id, "not found in daily cap tracking.")
         except KeyError as ke:
-            print(ke)
+            current_sink().reject(UNKNOWN_USER, fields=(ke.args[0],), user=ke.args[0], problem=ke.args[1])
         except Exception as e:
-            print(f"Error resetting daily cap for user {user_id} at {event_time}: {e}")
+            current_sink().reject(INTERNAL_ERROR,
+                                  message=f"Error resetting daily cap for user {user_id} at {event_time}: {e}")
 
 
-    def reset_monthly_cap(self, user_id: str, event_time: datetime):
+    def reset_monthly_cap(self, user_id: str, event_time: Union[int, datetime]):
         """Reset the 30-day cap for a new month"""
         try:
-            if user_id in self.user_30days_cap:
-                self.user_30days_cap[user_id].active_time = event_time
-                self.user_30days_cap[user_id].bill_cost = 0.0
+            record = self.users.get(user_id)
+            if record is not None:
+                self.reset_record_monthly_cap(record, event_time, month_key(event_time))
             else:
-                raise KeyError(f"User {user_id} not found in monthly cap tracking.")
+                raise KeyError(user_id, "not found in monthly cap tracking.")
         except KeyError as ke:
-            print(ke)
+            current_sink().reject(UNKNOWN_USER, fields=(ke.args[0],), user=ke.args[0], problem=ke.args[1])
         except Exception as e:
-            print(f"Error resetting monthly cap for user {user_id} at {event_time}: {e}")
+            current_sink().reject(INTERNAL_ERROR,
+                                  message=f"Error resetting monthly cap for user {user_id} at {event_time}: {e}")
 
+    def reset_record_daily_cap(self, record: UserState, event_time: Union[int, datetime], day: int):
+        """Reset the daily cap of a user record whose day key is already known"""
+        record.day_time = event_time
+        record.day_key = day
+        record.day_cost = 0.0
+        self.stats.daily_cap_resets += 1
 
-    def add_penalty(self, user_id: str):
-        """Add penalty for incomplete or invalid journeys"""
-        try:
-            if user_id not in self.user_bill:
-                raise KeyError(f"User {user_id} not initialized.")
-            penalty = PENALTY_CHARGES
+    def reset_record_monthly_cap(self, record: UserState, event_time: Union[int, datetime], month: int):
+        """Reset the monthly cap of a user record whose month key is already known"""
+        record.month_time = event_time
+        record.month_key = month
+        record.month_cost = 0.0
+        self.stats.monthly_cap_resets += 1
 
-            # calculate max amount to be added to stay within the daily and monthly limit
-            amount_to_add = self.calculate_max_addable_amount(user_id, penalty)
 
-            # Add the amount to the user's bill and caps
-            self.user_bill[user_id] += amount_to_add
-            self.user_24hour_cap[user_id].bill_cost += amount_to_add
-            self.user_30days_cap[user_id].bill_cost += amount_to_add
+    def add_penalty(self, user_id: str) -> float:
+        """Add penalty for incomplete or invalid journeys"""
+        try:
+            record = self.users.get(user_id)
+            if record is None:
+                raise KeyError(user_id, "not initialized.")
+            return self.charge_penalty(record)
         except KeyError as ke:
-            print(ke)
+            current_sink().reject(UNKNOWN_USER, fields=(ke.args[0],), user=ke.args[0], problem=ke.args[1])
         except Exception as e:
-            print(f"Error adding penalty for user {user_id}: {e}")
+            current_sink().reject(INTERNAL_ERROR, message=f"Error adding penalty for user {user_id}: {e}")
+        return 0.0
 
-    def add_journey_cost(self, user_id: str, journey_cost: float):
+    def add_journey_cost(self, user_id: str, journey_cost: float) -> float:
         """Add the cost of a complete journey if it doesn't exceed daily or monthly caps"""
         try:
-            if user_id not in self.user_bill:
-                raise KeyError(f"User {user_id} not initialized.")
-            amount_to_add = self.calculate_max_addable_amount(user_id, journey_cost)
-
-            # Add the amount to the user's bill and caps
-            self.user_bill[user_id] += amount_to_add
-            self.user_24hour_cap[user_id].bill_cost += amount_to_add
-            self.user_30days_cap[user_id].bill_cost += amount_to_add
+            record = self.users.get(user_id)
+            if record is None:
+                raise KeyError(user_id, "not initialized.")
+            return self.charge(record, journey_cost)
         except KeyError as ke:
-            print(ke)
+            current_sink().reject(UNKNOWN_USER, fields=(ke.args[0],), user=ke.args[0], problem=ke.args[1])
         except Exception as e:
-            print(f"Error adding journey cost for user {user_id}: {e}")
+            current_sink().reject(INTERNAL_ERROR, message=f"Error adding journey cost for user {user_id}: {e}")
+        return 0.0
+
+    def charge(self, record: UserState, amount: float) -> float:
+        """Add an amount to a user record, clamped to stay within the daily and monthly limit. Returns the amount
+        actually added"""
+
+        # calculate max amount to be added to stay within the daily and monthly limit
+        amount_to_add = min(amount, DAILY_CAP - record.day_cost, MONTHLY_CAP - record.month_cost)
+
+        if amount_to_add != amount:
+            self.stats.cap_clamps += 1
+
+        # Add the amount to the user's bill and caps
+        record.bill += amount_to_add
+        record.day_cost += amount_to_add
+        record.month_cost += amount_to_add
+        return amount_to_add
+
+    def charge_penalty(self, record: UserState) -> float:
+        """Charge the penalty for an incomplete or invalid journey, within the caps"""
+        self.stats.penalties += 1
+        return self.charge(record, PENALTY_CHARGES)
 
 
     def calculate_max_addable_amount(self, user_id: str, amount: float) -> float:
         """Calculates the maximum amount that can be added to the user's bill without exceeding the daily and monthly
         caps"""
         try:
-            if user_id not in self.user_24hour_cap or user_id not in self.user_30days_cap:
-                raise KeyError(f"User {user_id} not initialized.")
+            record = self.users.get(user_id)
+            if record is None:
+                raise KeyError(user_id, "not initialized.")
 
-            max_daily_charge = DAILY_CAP - self.user_24hour_cap[user_id].bill_cost
-            max_monthly_charge = MONTHLY_CAP - self.user_30days_cap[user_id].bill_cost
+            max_daily_charge = DAILY_CAP - record.day_cost
+            max_monthly_charge = MONTHLY_CAP - record.month_cost
             return min(amount, max_daily_charge, max_monthly_charge)
 
         except KeyError as ke:
-            print(ke)
+            current_sink().reject(UNKNOWN_USER, fields=(ke.args[0],), user=ke.args[0], problem=ke.args[1])
             return 0.0
         except Exception as e:
-            print(f"Error calculating maximum addable amount for user {user_id}: {e}")
+            current_sink().reject(INTERNAL_ERROR,
+                                  message=f"Error calculating maximum addable amount for user {user_id}: {e}")
             return 0.0
 
-
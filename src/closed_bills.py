@@ -0,0 +1,88 @@
+import heapq
+import tempfile
+from itertools import groupby
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+from src.csv.external_sort_writer import RUN_RECORD
+
+
+def _user_id(item: Tuple[str, float]) -> str:
+    return item[0]
+
+
+class ClosedBills:
+    """Bills of users evicted from BillingManager once their billing month has closed.
+
+    Evicted bills are kept in a dictionary of at most max_in_memory users; beyond that they are spilled to a
+    temporary file as a run sorted by user id, in the layout ExternalSortWriter uses for its runs. A user who taps
+    again while their bill is still in memory takes it back, so their running bill continues exactly. A user whose
+    bill was spilled starts a new one, and the parts are added up when the bills are written: every charge is a
+    whole number of pence, so the sum rounds to the same amount in the output.
+    """
+
+    def __init__(self, spill_dir: str = None, max_in_memory: int = 1_000_000):
+        if max_in_memory < 1:
+            raise ValueError(f"Memory budget must be at least one bill, got {max_in_memory}")
+        self.spill_dir = spill_dir
+        self.max_in_memory = max_in_memory
+        self._bills: Dict[str, float] = {}
+        self._runs: List[BinaryIO] = []
+        # Users evicted and bills written to disk so far
+        self.evicted = 0
+        self.spilled = 0
+
+    def add(self, user_id: str, bill: float):
+        """Keep the bill of an evicted user, spilling the bills held in memory when over budget"""
+        self._bills[user_id] = bill
+        self.evicted += 1
+        if len(self._bills) > self.max_in_memory:
+            self.spill()
+
+    def take(self, user_id: str) -> float:
+        """Bill of a returning user held in memory, or 0.0 when it was spilled or the user is new"""
+        return self._bills.pop(user_id, 0.0)
+
+    def spill(self):
+        """Write the bills held in memory to a run on disk sorted by user id"""
+        if not self._bills:
+            return
+        run = tempfile.TemporaryFile(dir=self.spill_dir)
+        buffer = bytearray()
+        for user_id, bill in sorted(self._bills.items()):
+            encoded = user_id.encode()
+            buffer += RUN_RECORD.pack(len(encoded), bill)
+            buffer += encoded
+        run.write(buffer)
+        self.spilled += len(self._bills)
+        self._runs.append(run)
+        self._bills = {}
+
+    def totals(self, live_bills: Iterable[Tuple[str, float]]) -> Iterator[Tuple[str, float]]:
+        """Total bill of every user, spilled, evicted or still live, in user id order. A user's parts are added
+        oldest first: spilled runs in the order they were written, then evicted bills in memory, then the live bill"""
+        sources = [self._read_run(run) for run in self._runs]
+        sources.append(iter(sorted(self._bills.items())))
+        sources.append(iter(sorted(live_bills)))
+        # heapq.merge prefers earlier sources on ties, which keeps each user's parts in that order
+        for user_id, parts in groupby(heapq.merge(*sources, key=_user_id), key=_user_id):
+            _, total = next(parts)
+            for _, bill in parts:
+                total += bill
+            yield user_id, total
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+
+    def __len__(self) -> int:
+        return len(self._bills)
+
+    def _read_run(self, run: BinaryIO) -> Iterator[Tuple[str, float]]:
+        run.seek(0)
+        while True:
+            header = run.read(RUN_RECORD.size)
+            if not header:
+                return
+            length, bill = RUN_RECORD.unpack(header)
+            yield run.read(length).decode(), bill
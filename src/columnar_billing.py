@@ -0,0 +1,168 @@
+from typing import Dict, Mapping
+
+import numpy as np
+
+from src.model.journey_columns import JourneyColumns, DIRECTION_IN
+from src.tariff import FareTable
+from src.util.constans import TRIP_CHARGES, PENALTY_CHARGES, DAILY_CAP, MONTHLY_CAP
+from src.util.reject_sink import current_sink, JOURNEY_COST
+
+
+class ColumnarBillingEngine:
+    """Bills a whole journey file in batched NumPy form. Produces the same user_bill as JourneyManager"""
+
+    def __init__(self, zone_cost: Mapping[str, float]):
+        self.zone_cost = zone_cost
+
+    def calculate(self, columns: JourneyColumns) -> Dict[str, float]:
+        """Pair taps, price journeys and clamp them to the daily and monthly caps for every user at once"""
+        bills = np.zeros(len(columns.users), dtype=np.float64)
+        if len(columns):
+            users, amounts, day_bucket, month_bucket = self._charges(columns)
+            self._apply_caps(bills, users, amounts, day_bucket, month_bucket)
+
+        return dict(zip(columns.users, bills.tolist()))
+
+    def _charges(self, columns: JourneyColumns):
+        """Returns the charges of the run in billing order as (user, amount, day bucket, month bucket) arrays"""
+        users, trip, start, end, day_bucket, month_bucket = self.charge_plan(columns)
+        amounts = np.full(len(users), PENALTY_CHARGES, dtype=np.float64)
+        amounts[trip] = self._trip_costs(columns, start[trip], end[trip])
+        return users, amounts, day_bucket, month_bucket
+
+    def charge_plan(self, columns: JourneyColumns):
+        """Pairs the taps without pricing them. Returns the charges in billing order as (user, is trip, start
+        station, end station, day bucket, month bucket) arrays; charges that are not trips are penalties and their
+        stations are 0. The plan is the same whatever the fares, so it can be priced under several tariffs"""
+
+        # Group events by user; the stable sort keeps the file (timestamp) order within each user
+        order = np.argsort(columns.user_idx, kind="stable")
+        user = columns.user_idx[order]
+        n = len(user)
+
+        first = np.ones(n, dtype=bool)
+        first[1:] = user[1:] != user[:-1]
+
+        # A cap bucket starts whenever the day or month differs from the user's previous event, as in JourneyManager
+        day = columns.day[order]
+        month = columns.month[order]
+        new_day = first.copy()
+        new_day[1:] |= day[1:] != day[:-1]
+        new_month = first.copy()
+        new_month[1:] |= month[1:] != month[:-1]
+        day_bucket = np.cumsum(new_day)
+        month_bucket = np.cumsum(new_month)
+
+        # Taps with an invalid direction open a user and move the caps but never take part in pairing
+        valid = np.flatnonzero(columns.direction[order] >= 0)
+        v_user = user[valid]
+        v_station = columns.station_idx[order][valid]
+        v_day = day[valid]
+        is_in = columns.direction[order][valid] == DIRECTION_IN
+
+        v_first = np.ones(len(valid), dtype=bool)
+        v_first[1:] = v_user[1:] != v_user[:-1]
+        prev_in = np.zeros(len(valid), dtype=bool)
+        prev_in[1:] = is_in[:-1] & ~v_first[1:]
+        prev_station = np.empty_like(v_station)
+        prev_station[1:] = v_station[:-1]
+        prev_station[:1] = 0
+        prev_day = np.empty_like(v_day)
+        prev_day[1:] = v_day[:-1]
+        prev_day[:1] = 0
+
+        paired = ~is_in & prev_in
+        trip = paired & (prev_day == v_day)
+        # IN after IN, OUT without IN and OUT on a different day than its IN are penalised
+        penalty = (is_in & prev_in) | (~is_in & ~prev_in) | (paired & ~trip)
+
+        charged = np.flatnonzero(penalty | trip)
+        event_pos = valid[charged]
+
+        # A user whose last valid tap is IN gets a penalty after all their events, in their final cap buckets
+        v_last = np.ones(len(valid), dtype=bool)
+        v_last[:-1] = v_user[:-1] != v_user[1:]
+        open_users = v_user[v_last & is_in]
+        last_pos = np.flatnonzero(np.append(user[:-1] != user[1:], True))
+        last_of_user = np.empty(len(columns.users), dtype=np.int64)
+        last_of_user[user[last_pos]] = last_pos
+        trailing_pos = last_of_user[open_users]
+
+        # Interleave both kinds of charge in billing order: each user's events, then their trailing penalty
+        key = np.concatenate((event_pos * 2, trailing_pos * 2 + 1))
+        positions = np.concatenate((event_pos, trailing_pos))
+        no_trip = np.zeros(len(trailing_pos), dtype=bool)
+        no_station = np.zeros(len(trailing_pos), dtype=v_station.dtype)
+        is_trip = np.concatenate((trip[charged], no_trip))
+        start = np.concatenate((np.where(trip, prev_station, 0)[charged], no_station))
+        end = np.concatenate((np.where(trip, v_station, 0)[charged], no_station))
+        billing_order = np.argsort(key, kind="stable")
+        positions = positions[billing_order]
+
+        return (user[positions], is_trip[billing_order], start[billing_order], end[billing_order],
+                day_bucket[positions], month_bucket[positions])
+
+    def _trip_costs(self, columns: JourneyColumns, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        """Vectorised JourneyManager._calculate_journey_cost; journeys touching an unknown station cost 0.0"""
+        fare_table = self.zone_cost
+        if isinstance(fare_table, FareTable) and all(station in fare_table for station in columns.stations):
+            zone_ids = fare_table.zone_ids(columns.stations)
+            return fare_table.batch_costs(zone_ids[start], zone_ids[end])
+
+        fees = np.array([self.zone_cost.get(station, np.nan) for station in columns.stations], dtype=np.float64)
+        costs = (TRIP_CHARGES + fees[start]) + fees[end]
+
+        unknown = np.isnan(costs)
+        for start_station, end_station in zip(start[unknown], end[unknown]):
+            start_name, end_name = columns.stations[start_station], columns.stations[end_station]
+            current_sink().reject(JOURNEY_COST, fields=(start_name, end_name), start=start_name, end=end_name,
+                                  error="unknown station")
+        costs[unknown] = 0.0
+        return costs
+
+    def _apply_caps(self, bills: np.ndarray, users: np.ndarray, amounts: np.ndarray, day_bucket: np.ndarray,
+                    month_bucket: np.ndarray, daily_cap=DAILY_CAP, monthly_cap=MONTHLY_CAP,
+                    clamps: np.ndarray = None, charged: np.ndarray = None):
+        """Clamps each charge to the remaining daily and monthly allowance and adds it to the bill.
+
+        Clamping depends on the charges before it, so the k-th charge of every user is processed together, for
+        k = 0, 1, ... . The float operations happen in the same order as BillingManager, so totals match exactly.
+        Bills and amounts may have a column per tariff, with the caps given per column; clamps, when given, counts
+        the charges reduced by a cap in each column, and charged receives the amount actually added by each charge.
+        """
+        n_users = len(bills)
+        day_cost = np.zeros(bills.shape, dtype=np.float64)
+        month_cost = np.zeros(bills.shape, dtype=np.float64)
+        current_day = np.full(n_users, -1, dtype=np.int64)
+        current_month = np.full(n_users, -1, dtype=np.int64)
+
+        # Rank of each charge within its user's charges (charges are already grouped by user)
+        starts = np.flatnonzero(np.append(True, users[1:] != users[:-1]))
+        counts = np.diff(np.append(starts, len(users)))
+        rank = np.arange(len(users)) - np.repeat(starts, counts)
+        by_rank = np.argsort(rank, kind="stable")
+        rank_bounds = np.cumsum(np.bincount(rank))
+
+        lower = 0
+        for upper in rank_bounds:
+            charge = by_rank[lower:upper]
+            lower = upper
+            user = users[charge]
+
+            # Reset the caps for users whose charge falls in a new day or month bucket
+            new_day = current_day[user] != day_bucket[charge]
+            day_cost[user[new_day]] = 0.0
+            current_day[user] = day_bucket[charge]
+            new_month = current_month[user] != month_bucket[charge]
+            month_cost[user[new_month]] = 0.0
+            current_month[user] = month_bucket[charge]
+
+            amount = amounts[charge]
+            add = np.minimum(np.minimum(amount, daily_cap - day_cost[user]), monthly_cap - month_cost[user])
+            if clamps is not None:
+                clamps += np.count_nonzero(add != amount, axis=0)
+            if charged is not None:
+                charged[charge] = add
+            bills[user] += add
+            day_cost[user] += add
+            month_cost[user] += add
@@ -0,0 +1,129 @@
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from src.csv.file_format import FORMAT_PARQUET, detect_format
+from src.model.journey_columns import JourneyColumns, DIRECTION_IN, DIRECTION_OUT, DIRECTION_INVALID, day_keys, \
+    month_keys
+from src.util.timestamp_parser import parse_timestamp
+
+JOURNEY_COLUMNS = ["user_id", "station", "direction", "time"]
+ZONE_COLUMNS = ["station", "zone"]
+# Timestamps in string columns, as in the CSV export; hours may have one digit
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class ArrowReader:
+    """Class to handle reading Parquet and Arrow IPC files as record batches"""
+
+    def iter_batches(file_path: str, columns: List[str], file_format: str = None,
+                     batch_size: int = 65536) -> Iterator[pa.RecordBatch]:
+        """Streams record batches holding only the given columns. Parquet files read just those columns from disk"""
+        if detect_format(file_path, file_format) == FORMAT_PARQUET:
+            yield from pq.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=columns)
+            return
+
+        with open(file_path, 'rb') as file:
+            try:
+                reader = ipc.open_file(file)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                # Not the random access file layout; read it as an IPC stream
+                file.seek(0)
+                batches = ipc.open_stream(file)
+            for batch in batches:
+                yield pa.RecordBatch.from_arrays([batch.column(name) for name in columns], names=columns)
+
+
+def zone_rows(batch: pa.RecordBatch) -> List[List[str]]:
+    """[station, zone] rows of a batch of a zone map, as text like the rows of a CSV zone map. A numeric zone column
+    is cast to integers by Arrow first, so whole numbers stored as floats read as zones and a fractional zone fails
+    the cast instead of being truncated"""
+    station, zone = (batch.column(name) for name in ZONE_COLUMNS)
+    if not (pa.types.is_string(zone.type) or pa.types.is_large_string(zone.type) or pa.types.is_dictionary(zone.type)):
+        zone = pc.cast(zone, pa.int64())
+    return [[str(name), str(number)] for name, number in zip(station.to_pylist(), zone.to_pylist())]
+
+
+def journey_columns_from_batch(batch: pa.RecordBatch, offset: int, stations=None,
+                               report: Callable[[int, List[str]], None] = None) -> Optional[JourneyColumns]:
+    """Converts a batch of taps to JourneyColumns without building a Python object per row.
+
+    Rows that are incomplete, have a malformed timestamp or, when stations is given, an unknown station are passed
+    to report with their index in the file (offset is the index of the batch's first row) and are left out.
+    """
+    user, station, direction, time = (batch.column(name) for name in JOURNEY_COLUMNS)
+    complete = _mask(pc.and_(pc.and_(user.is_valid(), station.is_valid()),
+                             pc.and_(direction.is_valid(), time.is_valid())))
+
+    epoch, parsed = _epochs(time)
+    valid = complete & parsed
+    if stations is not None and len(batch):
+        encoded = station.dictionary_encode()
+        known = np.array([name in stations for name in encoded.dictionary.to_pylist()] or [False], dtype=bool)
+        valid &= known[pc.fill_null(encoded.indices, 0).to_numpy(zero_copy_only=False)]
+
+    if report is not None:
+        for index in np.flatnonzero(~valid).tolist():
+            # Missing values are left out, so an incomplete row is reported like a CSV row with fewer fields
+            fields = (_text(column[index]) for column in (user, station, direction, time))
+            report(offset + index, [field for field in fields if field is not None])
+
+    rows = np.flatnonzero(valid)
+    if not len(rows):
+        return None
+    take = pa.array(rows)
+    users = pc.take(user, take).dictionary_encode()
+    station_names = pc.take(station, take).dictionary_encode()
+    directions = pc.take(direction, take)
+    direction_codes = np.where(_mask(pc.equal(directions, "IN")), DIRECTION_IN,
+                               np.where(_mask(pc.equal(directions, "OUT")), DIRECTION_OUT, DIRECTION_INVALID))
+
+    epoch = epoch[rows]
+    return JourneyColumns(
+        users=[str(name) for name in users.dictionary.to_pylist()],
+        stations=[str(name) for name in station_names.dictionary.to_pylist()],
+        user_idx=users.indices.to_numpy(zero_copy_only=False).astype(np.int32),
+        station_idx=station_names.indices.to_numpy(zero_copy_only=False).astype(np.int32),
+        direction=direction_codes.astype(np.int8),
+        epoch=epoch,
+        day=day_keys(epoch),
+        month=month_keys(epoch),
+    )
+
+
+def _mask(values: pa.Array) -> np.ndarray:
+    return pc.fill_null(values, False).to_numpy(zero_copy_only=False)
+
+
+def _epochs(time: pa.Array) -> Tuple[np.ndarray, np.ndarray]:
+    """Epoch seconds of a timestamp or string column, with a mask of the values that could be read"""
+    if pa.types.is_timestamp(time.type):
+        # Naive timestamps are taken as UTC wall clock time, as in the CSV path
+        seconds = pc.cast(time, pa.timestamp("s", tz=time.type.tz), safe=False).cast(pa.int64())
+        return pc.fill_null(seconds, 0).to_numpy(zero_copy_only=False), _mask(seconds.is_valid())
+
+    text = time.cast(pa.string())
+    parsed = pc.strptime(text, format=TIME_FORMAT, unit="s", error_is_null=True)
+    epoch = pc.fill_null(parsed.cast(pa.int64()), 0).to_numpy(zero_copy_only=False).copy()
+    ok = _mask(parsed.is_valid())
+
+    # The Python parser has the final say on what Arrow could not read, so both paths accept the same timestamps
+    for index in np.flatnonzero(~ok & _mask(text.is_valid())).tolist():
+        try:
+            epoch[index] = parse_timestamp(text[index].as_py())[0]
+            ok[index] = True
+        except ValueError:
+            pass
+    return epoch, ok
+
+
+def _text(value: pa.Scalar) -> Optional[str]:
+    value = value.as_py()
+    if value is None:
+        return None
+    return value.strftime(TIME_FORMAT) if hasattr(value, "strftime") else str(value)
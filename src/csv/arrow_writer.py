@@ -0,0 +1,60 @@
+import os
+from itertools import islice
+from typing import Iterable, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from src.csv.bulk_csv_writer import round_to_pence, write_error
+from src.csv.file_format import FORMAT_PARQUET, FORMAT_ARROW, detect_format
+
+BILL_SCHEMA = pa.schema([("user_id", pa.string()), ("billing_amount", pa.float64())])
+
+
+class ArrowWriter:
+    """Counterpart of CSVWriter for Parquet and Arrow IPC bill files. Amounts are stored as numbers instead of being
+    formatted as text, each rounded to the pence CSVWriter writes for it"""
+
+    def __init__(self, filepath: str, file_format: str = None, batch_size: int = 65536):
+        """Initialize the ArrowWriter with the output file path; the format defaults to the one of its extension"""
+        self.filepath = filepath
+        self.file_format = detect_format(filepath, file_format)
+        if self.file_format not in (FORMAT_PARQUET, FORMAT_ARROW):
+            raise ValueError(f"ArrowWriter writes Parquet or Arrow files, not {self.file_format}")
+        self.batch_size = batch_size
+
+    def write_table(self, data: Iterable[Tuple[str, float]], filepath: str):
+        """Writes (user_id, billing_amount) rows in record batches. Accepts a list or any iterator. Raises OSError if
+        the file cannot be written"""
+        rows = iter(data)
+        first = list(islice(rows, self.batch_size))
+        if not first:
+            raise ValueError("Data to write is empty")
+
+        # Ensure the directory exists, if not create it
+        directory = os.path.dirname(self.filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        try:
+            with self._open() as writer:
+                batch = first
+                while batch:
+                    writer.write_batch(self._batch(batch))
+                    batch = list(islice(rows, self.batch_size))
+
+        except Exception as e:
+            raise OSError(write_error(e, filepath)) from e
+
+    def _open(self):
+        if self.file_format == FORMAT_PARQUET:
+            return pq.ParquetWriter(self.filepath, BILL_SCHEMA)
+        return ipc.new_file(self.filepath, BILL_SCHEMA)
+
+    def _batch(self, rows) -> pa.RecordBatch:
+        user_ids, amounts = zip(*rows)
+        # Rounded to the pence the CSV output writes for the same bills
+        amounts = round_to_pence(np.fromiter(amounts, dtype=np.float64, count=len(rows)))
+        return pa.RecordBatch.from_arrays([pa.array(user_ids, type=pa.string()), pa.array(amounts)], schema=BILL_SCHEMA)
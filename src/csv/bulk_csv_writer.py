@@ -0,0 +1,127 @@
+import os
+from itertools import islice
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+HEADER = "user_id,billing_amount\r\n"
+# Text after the pounds for each number of pence, line terminator included
+PENCE = [f".{pence:02d}\r\n" for pence in range(100)]
+PENCE_TEXT = [f".{pence:02d}" for pence in range(100)]
+# Characters csv.writer quotes a field for, with its default dialect
+QUOTED_CHARACTERS = (",", '"', "\r", "\n")
+# Amounts at least this far from a half penny round to the same pence however the product by 100 was rounded
+TIE_MARGIN = 0.49
+# Largest number of pence held exactly in a float
+MAX_EXACT_PENCE = 2 ** 53
+
+
+class BulkCSVWriter:
+    """Writes bills in the same bytes as CSVWriter, chunk_rows at a time.
+
+    Each chunk of bills is turned into whole pence with numpy and formatted as pounds and a two-digit pence suffix
+    from a table, then written as one string instead of one csv.writer call per row. An amount is formatted as
+    f"{amount:.2f}" instead when the pence could round differently: a value near a half penny, negative, too large
+    or not a number. User ids are quoted like csv.writer does when a chunk has any that need it. The file is written
+    next to the output and renamed over it once complete, so a partial file never appears under the output path.
+    """
+
+    def __init__(self, filepath: str, chunk_rows: int = 65536):
+        if chunk_rows < 1:
+            raise ValueError(f"Chunk size must be at least one row, got {chunk_rows}")
+        self.filepath = filepath
+        self.chunk_rows = chunk_rows
+
+    def write_csv(self, data: Iterable[Tuple[str, float]], filepath: str):
+        """Writes (user_id, bill) pairs, from a list or any iterator, to a CSV file. Raises OSError with the message
+        CSVWriter prints if the file cannot be written"""
+        if not data:
+            raise ValueError("Data to write is empty")
+
+        rows = iter(data)
+        chunks = (format_rows(chunk) for chunk in iter(lambda: list(islice(rows, self.chunk_rows)), []))
+        self.write_chunks(HEADER, chunks, filepath)
+
+    def write_chunks(self, header: str, chunks: Iterable[str], filepath: str):
+        """Writes a header line and chunks of formatted CSV lines, moving the file into place once all are written"""
+        directory = os.path.dirname(self.filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # A device or pipe such as /dev/stdout cannot be renamed over, so it is written in place
+        atomic = not os.path.exists(self.filepath) or os.path.isfile(self.filepath)
+        write_path = f"{self.filepath}.tmp" if atomic else self.filepath
+
+        try:
+            with open(write_path, mode='w', newline='') as csvfile:
+                csvfile.write(header)
+                for chunk in chunks:
+                    csvfile.write(chunk)
+            if atomic:
+                os.replace(write_path, self.filepath)
+
+        except Exception as e:
+            if atomic and os.path.exists(write_path):
+                os.remove(write_path)
+            raise OSError(write_error(e, filepath)) from e
+
+
+def format_rows(rows: List[Tuple[str, float]]) -> str:
+    """CSV lines of (user_id, bill) pairs, as csv.writer writes [user_id, f"{bill:.2f}"]"""
+    user_ids = [user_id for user_id, _ in rows]
+    joined = "".join(user_ids)
+    if any(character in joined for character in QUOTED_CHARACTERS):
+        user_ids = [quote_field(user_id) for user_id in user_ids]
+
+    amounts = np.fromiter((amount for _, amount in rows), dtype=np.float64, count=len(rows))
+    pounds, remainder, exact = _whole_pence(amounts)
+    lines = [f"{user_id},{whole}{PENCE[part]}"
+             for user_id, whole, part in zip(user_ids, pounds.tolist(), remainder.tolist())]
+    for index in np.flatnonzero(~exact).tolist():
+        lines[index] = f"{user_ids[index]},{rows[index][1]:.2f}\r\n"
+    return "".join(lines)
+
+
+def format_amounts(amounts: np.ndarray) -> List[str]:
+    """Amounts as f"{amount:.2f}" formats them, without a line terminator"""
+    pounds, remainder, exact = _whole_pence(amounts)
+    texts = [f"{whole}{PENCE_TEXT[part]}" for whole, part in zip(pounds.tolist(), remainder.tolist())]
+    for index in np.flatnonzero(~exact).tolist():
+        texts[index] = f"{amounts[index]:.2f}"
+    return texts
+
+
+def round_to_pence(amounts: np.ndarray) -> np.ndarray:
+    """Amounts rounded to pence, each the number float(f"{amount:.2f}") gives"""
+    pounds, remainder, exact = _whole_pence(amounts)
+    # Whole pence are exact in a float, so dividing them by 100 gives the float nearest the two-decimal text
+    rounded = (pounds * 100 + remainder) / 100
+    for index in np.flatnonzero(~exact).tolist():
+        rounded[index] = float(f"{amounts[index]:.2f}")
+    return rounded
+
+
+def _whole_pence(amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pounds and pence of each amount, and whether they give its text exactly; the others are formatted as text"""
+    scaled = amounts * 100
+    pence = np.rint(scaled)
+    # Infinities and NaN fail the comparisons and are formatted as text
+    with np.errstate(invalid="ignore"):
+        exact = (np.abs(scaled - pence) < TIE_MARGIN) & ~np.signbit(amounts) & (pence < MAX_EXACT_PENCE)
+    pounds, remainder = np.divmod(np.where(exact, pence, 0).astype(np.int64), 100)
+    return pounds, remainder, exact
+
+
+def write_error(error: Exception, filepath: str) -> str:
+    """Message for an error writing an output file, worded as CSVWriter prints it"""
+    if isinstance(error, FileNotFoundError):
+        return f"File Not Found: {filepath}"
+    if isinstance(error, PermissionError):
+        return f"Permission Denied: {filepath}"
+    return f"An Error Occurred Writing File: {error}"
+
+
+def quote_field(field: str) -> str:
+    """A field quoted as csv.writer quotes it with its default dialect"""
+    if any(character in field for character in QUOTED_CHARACTERS):
+        return '"' + field.replace('"', '""') + '"'
+    return field
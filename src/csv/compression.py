@@ -0,0 +1,126 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+from typing import Iterator, Optional, TextIO
+
+# Compressed input files, detected from the extension or, failing that, the leading magic bytes
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_BZ2 = "bz2"
+COMPRESSION_XZ = "xz"
+
+EXTENSIONS = {".gz": COMPRESSION_GZIP, ".gzip": COMPRESSION_GZIP, ".bz2": COMPRESSION_BZ2,
+              ".xz": COMPRESSION_XZ, ".lzma": COMPRESSION_XZ}
+MAGIC = {b"\x1f\x8b": COMPRESSION_GZIP, b"BZh": COMPRESSION_BZ2, b"\xfd7zXZ\x00": COMPRESSION_XZ}
+OPENERS = {COMPRESSION_GZIP: gzip.open, COMPRESSION_BZ2: bz2.open, COMPRESSION_XZ: lzma.open}
+
+# Decompressed bytes handed over at a time, and how many blocks may wait for the parser
+BLOCK_BYTES = 1 << 20
+QUEUED_BLOCKS = 8
+
+
+def detect_compression(file_path: str) -> Optional[str]:
+    """The codec a file is compressed with, or None for a plain file"""
+    compression = EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+    if compression:
+        return compression
+    try:
+        with open(file_path, 'rb') as file:
+            head = file.read(max(len(magic) for magic in MAGIC))
+    except OSError:
+        return None
+    return next((codec for magic, codec in MAGIC.items() if head.startswith(magic)), None)
+
+
+def open_text(file_path: str) -> TextIO:
+    """Opens a file for reading text like open(file_path, 'r'), decompressing it on the fly if it is compressed"""
+    compression = detect_compression(file_path)
+    if compression is None:
+        return open(file_path, 'r')
+    return io.TextIOWrapper(io.BufferedReader(DecompressingReader(file_path, compression), BLOCK_BYTES))
+
+
+def iter_blocks(file_path: str, block_bytes: int = BLOCK_BYTES) -> Iterator[bytes]:
+    """Yields the decompressed data after the header line in blocks of whole lines"""
+    with io.BufferedReader(DecompressingReader(file_path, detect_compression(file_path)), block_bytes) as file:
+        file.readline()
+        while True:
+            block = file.read(block_bytes)
+            if not block:
+                return
+            # Complete the last line so no row is split between blocks
+            yield block + file.readline()
+
+
+class DecompressingReader(io.RawIOBase):
+    """Reads a compressed file, decompressed by a background thread.
+
+    The thread fills a bounded queue of decompressed blocks while the caller parses and bills the previous ones.
+    zlib, bz2 and lzma release the GIL while they work, so decompression overlaps the parsing. The stdlib openers
+    read every member of a multi-member gzip file and every stream of a concatenated bz2 or xz file.
+    """
+
+    def __init__(self, file_path: str, compression: str):
+        if compression not in OPENERS:
+            raise ValueError(f"Unknown compression: {compression}")
+        # Opened here so a missing file fails like open() does
+        self._file = OPENERS[compression](file_path, 'rb')
+        self._blocks: queue.Queue = queue.Queue(QUEUED_BLOCKS)
+        self._stop = threading.Event()
+        self._pending = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._decompress, name=f"decompress {file_path}", daemon=True)
+        self._thread.start()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._pending:
+            if self._eof:
+                return 0
+            block = self._blocks.get()
+            if isinstance(block, BaseException):
+                self._eof = True
+                raise block
+            if not block:
+                self._eof = True
+                return 0
+            self._pending = memoryview(block)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            # Unblock a thread waiting on a full queue when the reader is closed before the end of the file
+            self._stop.set()
+            while self._thread.is_alive():
+                try:
+                    self._blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._file.close()
+        super().close()
+
+    def _decompress(self):
+        try:
+            while not self._stop.is_set():
+                block = self._file.read(BLOCK_BYTES)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
@@ -1,4 +1,8 @@
 import csv
+import os
+from typing import Iterator, List
+
+from src.csv.compression import open_text
 
 
 class CSVReader:
@@ -11,8 +15,8 @@ class CSVReader:
 
         try:
 
-            # Open the CSV file in read mode
-            with open(file_path, 'r') as file:
+            # Open the CSV file in read mode; gzip, bz2 and xz files are decompressed while they are read
+            with open_text(file_path) as file:
 
                 reader = csv.reader(file)
 
@@ -30,3 +34,18 @@ class CSVReader:
         except Exception as e:
             return f"An Error Occurred Reading File: {e}"
 
+    def stream_csv(file_path: str):
+        """Returns a lazy iterator over the CSV rows (header skipped), or an error string if the file cannot be
+        opened. Rows are read one at a time so memory stays flat regardless of file size"""
+
+        if not os.path.isfile(file_path):
+            return f"File Not Found: {file_path}"
+        return CSVReader._iter_rows(file_path)
+
+    def _iter_rows(file_path: str) -> Iterator[List[str]]:
+        with open_text(file_path) as file:
+            reader = csv.reader(file)
+
+            next(reader, None)
+
+            yield from reader
@@ -1,15 +1,37 @@
-from typing import Dict, List
+from typing import Callable, Container, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 from src.csv.csv_reader import CSVReader
+from src.csv.parse_cache import ParseCache, stations_fingerprint, encode_names, decode_names, encode_rejects, \
+    decode_rejects
 from src.model.journey import Journey
+from src.model.journey_columns import JourneyColumns, JourneyColumnsBuilder
+from src.util.reject_sink import current_sink, use_sink, RejectSink, RowRejected, BAD_FIELD_COUNT, BAD_TIMESTAMP, \
+    BAD_ZONE, UNKNOWN_STATION, UNEXPECTED_ROW
+from src.util.timestamp_parser import parse_timestamp
 from src.util.zone_fee_calculator import additional_zone_fee
 
 
 class DataProcessor:
     """Class to process data read from CSV files"""
 
-    # read_transaction_from_csv collects the CSV data from read_csv() and process it to an list with custom object
-    def read_transaction_from_csv(file_path: str) -> List[Journey]:
+    # When set, CSV zone maps and journey files are parsed once and then loaded from this cache; see use_cache
+    cache: Optional[ParseCache] = None
+
+    # use_cache installs a parse cache (None to parse every time) and returns the previous one so it can be restored
+    def use_cache(cache: Optional[ParseCache]) -> Optional[ParseCache]:
+        previous, DataProcessor.cache = DataProcessor.cache, cache
+        return previous
+
+    # read_transaction_from_csv collects the CSV data from read_csv() and process it to an list with custom object.
+    # When stations is given (e.g. a FareTable), rows with a station outside it are rejected
+    def read_transaction_from_csv(file_path: str, stations: Container[str] = None) -> List[Journey]:
+        return DataProcessor._cached("journeys", file_path, stations,
+                                     lambda: DataProcessor._parse_transaction_from_csv(file_path, stations),
+                                     _journey_arrays, lambda entry: list(_journeys_from_arrays(entry)))
+
+    def _parse_transaction_from_csv(file_path: str, stations: Container[str] = None) -> List[Journey]:
         transaction_record = CSVReader.read_csv(file_path)
 
         list_journey: List[Journey] = []
@@ -20,61 +42,322 @@ class DataProcessor:
                 print("No transaction data available.")
 
             for index, record in enumerate(transaction_record):
-                try:
-                    # Check if the row has exactly 4 fields
-                    if len(record) != 4:
-                        raise ValueError(f"Row {index + 2} has an incorrect number of fields: {len(record)}")
-
-
-                    # Unpacking the CSV row into the Journey class
-                    journey = Journey(
-                        user_id=record[0],
-                        station=record[1],
-                        direction=record[2],
-                        time=record[3]
-                    )
+                journey = DataProcessor._journey_from_row(index, record, stations)
+                if journey is not None:
                     list_journey.append(journey)
 
-                except ValueError as ve:
-                    print(f"Error processing row {index + 2}: {ve}")
-                except Exception as e:
-                    print(f"An unexpected error occurred at row {index + 2}: {e}")
-
         return list_journey if list_journey else "No valid transactions found."
 
+    # stream_transaction_from_csv yields Journey objects as rows are read so billing can start before the file ends
+    def stream_transaction_from_csv(file_path: str, stations: Container[str] = None):
+        # A cached parse is streamed from memory; otherwise the file is streamed and not cached, as it is never
+        # held in full
+        _, entry = DataProcessor._cache_lookup("journeys", file_path, stations, replay_rejects=False)
+        if entry is not None:
+            return _stream_cached_journeys(entry)
+
+        transaction_record = CSVReader.stream_csv(file_path)
+
+        if isinstance(transaction_record, str):
+            return transaction_record
+
+        return DataProcessor._iter_journeys(transaction_record, stations)
+
+    def _iter_journeys(rows: Iterator[List[str]], stations: Container[str] = None) -> Iterator[Journey]:
+        for index, record in enumerate(rows):
+            journey = DataProcessor._journey_from_row(index, record, stations)
+            if journey is not None:
+                yield journey
+
+    # read_transaction_columns_from_csv parses the CSV straight into interned columns for the columnar engine
+    def read_transaction_columns_from_csv(file_path: str, stations: Container[str] = None):
+        return DataProcessor.cached_transaction_columns(
+            file_path, stations, lambda: DataProcessor._parse_transaction_columns_from_csv(file_path, stations))
+
+    # cached_transaction_columns returns parse() through the cache, so other column parsers such as
+    # ParallelCSVReader share cache entries with read_transaction_columns_from_csv
+    def cached_transaction_columns(file_path: str, stations: Container[str], parse: Callable[[], JourneyColumns]):
+        return DataProcessor._cached("columns", file_path, stations, parse, _column_arrays, _columns_from_arrays)
+
+    def _parse_transaction_columns_from_csv(file_path: str, stations: Container[str] = None):
+        transaction_record = CSVReader.stream_csv(file_path)
+
+        if isinstance(transaction_record, str):
+            return transaction_record
+
+        builder = JourneyColumnsBuilder()
+        for index, record in enumerate(transaction_record):
+            try:
+                builder.append(*DataProcessor._journey_fields(index, record, stations))
+            except Exception as e:
+                DataProcessor._reject_row(index, record, e)
+
+        columns = builder.build()
+        return columns if len(columns) else "No valid transactions found."
+
+    def _journey_fields(index: int, record: List[str],
+                        stations: Container[str] = None) -> Tuple[str, str, str, int, int, int]:
+        """Validates a journey row and returns (user_id, station, direction, epoch, day, month), raising ValueError
+        with the file row number if it is malformed or, when stations is given, names an unknown station"""
+        # Check if the row has exactly 4 fields
+        if len(record) != 4:
+            raise RowRejected(BAD_FIELD_COUNT, index + 2, count=len(record))
+
+        try:
+            epoch, day, month = parse_timestamp(record[3])
+        except ValueError:
+            raise RowRejected(BAD_TIMESTAMP, index + 2)
+
+        if stations is not None and record[1] not in stations:
+            raise RowRejected(UNKNOWN_STATION, index + 2, station=record[1])
+
+        return record[0], record[1], record[2], epoch, day, month
+
+    def _report_row_error(index: int, record: List[str], stations: Container[str] = None):
+        """Reports why a journey row was rejected, using its row number in the file"""
+        try:
+            DataProcessor._journey_fields(index, record, stations)
+        except Exception as e:
+            DataProcessor._reject_row(index, record, e)
+
+    def _reject_row(index: int, record: List[str], error: Exception):
+        """Sends a rejected row to the reject sink with its reason code"""
+        if isinstance(error, RowRejected):
+            current_sink().reject(error.reason, error.row, record, **error.details)
+        else:
+            current_sink().reject(UNEXPECTED_ROW, index + 2, record, error=error)
+
+    def _journey_from_row(index: int, record: List[str], stations: Container[str] = None) -> Optional[Journey]:
+        """Validates a single CSV row and converts it to a Journey, reporting errors with the file row number"""
+        try:
+            # Unpacking the validated CSV row into the Journey class
+            return Journey.from_parsed(*DataProcessor._journey_fields(index, record, stations))
+
+        except Exception as e:
+            DataProcessor._reject_row(index, record, e)
+        return None
+
 
     def read_zone_map_from_csv(file_path: str) -> dict[str, float]:
-        zone_record = CSVReader.read_csv(file_path)
         zone_map: Dict[str, float] = {}
 
+        for station, zone_number in DataProcessor.read_zone_numbers_from_csv(file_path).items():
+            zone_entry_exit_cost: float = additional_zone_fee(zone_number)
+
+            # Add to the dictionary
+            zone_map[station] = zone_entry_exit_cost
+
+        return zone_map
+
+    # read_zone_numbers_from_csv maps each station to its zone number, for callers that price zones themselves
+    def read_zone_numbers_from_csv(file_path: str) -> dict[str, int]:
+        return DataProcessor._cached("zones", file_path, None,
+                                     lambda: DataProcessor._zone_numbers_from_rows(CSVReader.read_csv(file_path)),
+                                     _zone_arrays, _zones_from_arrays)
+
+    # read_zone_numbers_from_arrow reads the station and zone columns of a Parquet or Arrow IPC zone map
+    def read_zone_numbers_from_arrow(file_path: str, file_format: str = None) -> dict[str, int]:
+        from src.csv.arrow_reader import ArrowReader, ZONE_COLUMNS, zone_rows
+
+        try:
+            zone_record = [row for batch in ArrowReader.iter_batches(file_path, ZONE_COLUMNS, file_format)
+                           for row in zone_rows(batch)]
+        except FileNotFoundError:
+            zone_record = f"File Not Found: {file_path}"
+        except Exception as e:
+            zone_record = f"An Error Occurred Reading File: {e}"
+        return DataProcessor._zone_numbers_from_rows(zone_record)
+
+    # read_transaction_columns_from_arrow streams a Parquet or Arrow IPC journey file in record batches, reading only
+    # the journey columns and converting each batch to columns without a Python object per row. Row numbers in
+    # errors count as in the CSV export, header included
+    def read_transaction_columns_from_arrow(file_path: str, stations: Container[str] = None, file_format: str = None,
+                                            batch_size: int = 65536):
+        try:
+            batches = list(DataProcessor._iter_arrow_columns(file_path, stations, file_format, batch_size))
+        except FileNotFoundError:
+            return f"File Not Found: {file_path}"
+        except Exception as e:
+            return f"An Error Occurred Reading File: {e}"
+
+        if not batches:
+            return "No valid transactions found."
+        return batches[0] if len(batches) == 1 else JourneyColumns.concat(batches)
+
+    # stream_transaction_from_arrow yields the journeys of a Parquet or Arrow IPC file one record batch at a time, so
+    # the journey engine bills a batch while the next one is read and never holds the whole file
+    def stream_transaction_from_arrow(file_path: str, stations: Container[str] = None, file_format: str = None,
+                                      batch_size: int = 65536):
+        batches = DataProcessor._iter_arrow_columns(file_path, stations, file_format, batch_size)
+        try:
+            # Reading the first batch opens the file, so a missing or unreadable file is reported before billing
+            first = next(batches, None)
+        except FileNotFoundError:
+            return f"File Not Found: {file_path}"
+        except Exception as e:
+            return f"An Error Occurred Reading File: {e}"
+
+        def journeys() -> Iterator[Journey]:
+            if first is not None:
+                yield from first.iter_journeys()
+            for columns in batches:
+                yield from columns.iter_journeys()
+        return journeys()
+
+    def _iter_arrow_columns(file_path: str, stations: Container[str] = None, file_format: str = None,
+                            batch_size: int = 65536) -> Iterator[JourneyColumns]:
+        """JourneyColumns of each record batch that has valid rows"""
+        from src.csv.arrow_reader import ArrowReader, JOURNEY_COLUMNS, journey_columns_from_batch
+
+        offset = 0
+        for batch in ArrowReader.iter_batches(file_path, JOURNEY_COLUMNS, file_format, batch_size):
+            columns = journey_columns_from_batch(
+                batch, offset, stations, lambda index, record: DataProcessor._report_row_error(index, record, stations))
+            if columns is not None:
+                yield columns
+            offset += batch.num_rows
+
+    def _zone_numbers_from_rows(zone_record) -> dict[str, int]:
+        zone_numbers: Dict[str, int] = {}
+
         if isinstance(zone_record, list):
             if len(zone_record) <= 1:
                 print("No zone data available.")
-                return zone_map  # Return empty map if no data is available
+                return zone_numbers  # Return empty map if no data is available
 
             for index, record in enumerate(zone_record):
                 try:
                     # Check if the row has exactly 2 fields
                     if len(record) != 2:
-                        raise ValueError(f"Row {index + 2} has an incorrect number of fields: {len(record)}")
+                        raise RowRejected(BAD_FIELD_COUNT, index + 2, count=len(record))
 
-                    # Extract station and cost
+                    # Extract station and zone
                     station = record[0]
                     zone_number: int = int(record[1])
-                    zone_entry_exit_cost: float = additional_zone_fee(zone_number)
-
 
                     # Add to the dictionary
-                    zone_map[station] = zone_entry_exit_cost
+                    zone_numbers[station] = zone_number
 
+                except RowRejected as rejected:
+                    current_sink().reject(rejected.reason, rejected.row, record, **rejected.details)
                 except ValueError as ve:
-                    print(f"Error processing row {index + 2}: {ve}")
+                    current_sink().reject(BAD_ZONE, index + 2, record, error=ve)
                 except Exception as e:
-                    print(f"An unexpected error occurred at row {index + 2}: {e}")
+                    current_sink().reject(UNEXPECTED_ROW, index + 2, record, error=e)
 
         else:
             print(f"Error: Zone data is not in the expected format.")
 
-        return zone_map
+        return zone_numbers
+
+    def _cache_lookup(kind: str, file_path: str, stations: Container[str] = None, replay_rejects: bool = True):
+        """(key, cached arrays) of a parse, with the rows it rejected reported again unless replay_rejects is off;
+        the arrays are None on a miss and the key is None too when the cache is off or the file cannot be read"""
+        cache = DataProcessor.cache
+        if cache is None:
+            return None, None
+        try:
+            key = cache.key(kind, file_path, stations_fingerprint(stations))
+        except OSError:
+            # Unreadable files are left to the parser to report
+            return None, None
+        entry = cache.load(key)
+        if entry is not None and replay_rejects:
+            current_sink().merge(*decode_rejects(entry.pop("rejects")))
+        return key, entry
+
+    def _cached(kind: str, file_path: str, stations: Optional[Container[str]], parse: Callable,
+                to_arrays: Callable, from_arrays: Callable):
+        """Returns parse() from the cache when enabled, or parses and stores the result. Rows rejected while parsing
+        are collected so a cached load reports them again; error strings and empty results are not cached"""
+        key, entry = DataProcessor._cache_lookup(kind, file_path, stations)
+        if entry is not None:
+            return from_arrays(entry)
+        if key is None:
+            return parse()
+
+        collector = RejectSink(echo=False, collect=True)
+        previous = use_sink(collector)
+        try:
+            result = parse()
+        finally:
+            use_sink(previous)
+        records, counts = collector.drain()
+        previous.merge(records, counts)
+
+        if result and not isinstance(result, str):
+            try:
+                DataProcessor.cache.store(key, {**to_arrays(result), "rejects": encode_rejects(records, counts)})
+            except OSError as e:
+                print(f"Could not write to the parse cache: {e}")
+        return result
+
+
+def _intern(values) -> Tuple[List[str], np.ndarray]:
+    ids: Dict[str, int] = {}
+    idx = np.fromiter((ids.setdefault(value, len(ids)) for value in values), dtype=np.int32)
+    return list(ids), idx
+
+
+def _name_arrays(prefix: str, names: List[str]) -> Dict[str, np.ndarray]:
+    offsets, blob = encode_names(names)
+    return {f"{prefix}_offsets": offsets, f"{prefix}_names": blob}
+
+
+def _names(entry: Dict[str, np.ndarray], prefix: str) -> List[str]:
+    return decode_names(entry[f"{prefix}_offsets"], entry[f"{prefix}_names"])
+
+
+def _journey_arrays(journeys: List[Journey]) -> Dict[str, np.ndarray]:
+    # Directions are kept as text, so a cached load reports an invalid direction exactly as the parse did
+    users, user_idx = _intern(journey.userId for journey in journeys)
+    stations, station_idx = _intern(journey.station for journey in journeys)
+    directions, direction_idx = _intern(journey.direction for journey in journeys)
+    return {**_name_arrays("user", users), **_name_arrays("station", stations),
+            **_name_arrays("direction", directions),
+            "user_idx": user_idx, "station_idx": station_idx, "direction_idx": direction_idx,
+            "epoch": np.fromiter((journey.epoch for journey in journeys), dtype=np.int64),
+            "day": np.fromiter((journey.day for journey in journeys), dtype=np.int32),
+            "month": np.fromiter((journey.month for journey in journeys), dtype=np.int32)}
+
+
+def _journeys_from_arrays(entry: Dict[str, np.ndarray]) -> Iterator[Journey]:
+    users, stations, directions = _names(entry, "user"), _names(entry, "station"), _names(entry, "direction")
+    for user, station, direction, epoch, day, month in zip(
+            entry["user_idx"].tolist(), entry["station_idx"].tolist(), entry["direction_idx"].tolist(),
+            entry["epoch"].tolist(), entry["day"].tolist(), entry["month"].tolist()):
+        yield Journey.from_parsed(users[user], stations[station], directions[direction], epoch, day, month)
+
+
+def _stream_cached_journeys(entry: Dict[str, np.ndarray]) -> Iterator[Journey]:
+    """Cached journeys with the rejected rows reported where they were in the file, as a streamed parse does"""
+    records, _ = decode_rejects(entry.pop("rejects"))
+    journeys = _journeys_from_arrays(entry)
+    position = 0
+    for rank, (reason, row, fields, details) in enumerate(records):
+        # Every data row became a journey or a rejected row, so row r comes after r - 2 - rank journeys
+        for _ in range(row - 2 - rank - position):
+            yield next(journeys)
+        position = max(position, row - 2 - rank)
+        current_sink().reject(reason, row, fields, **details)
+    yield from journeys
+
+
+def _column_arrays(columns: JourneyColumns) -> Dict[str, np.ndarray]:
+    return {**_name_arrays("user", columns.users), **_name_arrays("station", columns.stations),
+            "user_idx": columns.user_idx, "station_idx": columns.station_idx, "direction": columns.direction,
+            "epoch": columns.epoch, "day": columns.day, "month": columns.month}
+
+
+def _columns_from_arrays(entry: Dict[str, np.ndarray]) -> JourneyColumns:
+    return JourneyColumns(_names(entry, "user"), _names(entry, "station"), entry["user_idx"], entry["station_idx"],
+                          entry["direction"], entry["epoch"], entry["day"], entry["month"])
+
+
+def _zone_arrays(zone_numbers: Dict[str, int]) -> Dict[str, np.ndarray]:
+    return {**_name_arrays("station", list(zone_numbers)),
+            "zone": np.fromiter(zone_numbers.values(), dtype=np.int64, count=len(zone_numbers))}
 
 
+def _zones_from_arrays(entry: Dict[str, np.ndarray]) -> Dict[str, int]:
+    return dict(zip(_names(entry, "station"), entry["zone"].tolist()))
@@ -0,0 +1,75 @@
+import heapq
+import struct
+import tempfile
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Tuple
+
+from src.csv.bulk_csv_writer import BulkCSVWriter
+
+# Byte length of the user id followed by the bill
+RUN_RECORD = struct.Struct("<Id")
+
+
+def sort_key(item: Tuple[str, float]) -> str:
+    """Case-insensitive user id order, the same as MassTransitBilling.sorted_data"""
+    return item[0].lower()
+
+
+class ExternalSortWriter:
+    """Writes billing data sorted by user id without holding all of it in memory. Bills are sorted in runs of at most
+    max_rows_in_memory rows, spilled to temporary files and k-way merged straight into the output CSV, or into
+    write_rows when given, e.g. ArrowWriter.write_table for a Parquet output"""
+
+    def __init__(self, filepath: str, max_rows_in_memory: int = 1_000_000, temp_dir: str = None,
+                 write_rows: Callable[[Iterable[Tuple[str, float]], str], None] = None):
+        if max_rows_in_memory < 1:
+            raise ValueError(f"Memory budget must be at least one row, got {max_rows_in_memory}")
+        self.filepath = filepath
+        self.max_rows_in_memory = max_rows_in_memory
+        self.temp_dir = temp_dir
+        self.write_rows = write_rows or BulkCSVWriter(filepath).write_csv
+
+    def write(self, billing_data: Iterable[Tuple[str, float]]):
+        """Sort (user_id, bill) pairs case-insensitively and write them to the output CSV"""
+        with tempfile.TemporaryDirectory(dir=self.temp_dir) as run_dir:
+            runs: List[BinaryIO] = []
+            try:
+                chunk: List[Tuple[str, float]] = []
+                for item in billing_data:
+                    chunk.append(item)
+                    if len(chunk) == self.max_rows_in_memory:
+                        runs.append(self._spill(sorted(chunk, key=sort_key), run_dir))
+                        chunk = []
+
+                if not runs:
+                    # Everything fit in the budget; no need to touch the disk
+                    merged: Iterable[Tuple[str, float]] = sorted(chunk, key=sort_key)
+                else:
+                    if chunk:
+                        runs.append(self._spill(sorted(chunk, key=sort_key), run_dir))
+                    # Runs hold consecutive slices of the input and heapq.merge prefers earlier runs on ties, so the
+                    # order is the same as one stable sort
+                    merged = heapq.merge(*[self._read_run(run) for run in runs], key=sort_key)
+
+                self.write_rows(merged, self.filepath)
+            finally:
+                for run in runs:
+                    run.close()
+
+    def _spill(self, rows: List[Tuple[str, float]], run_dir: str) -> BinaryIO:
+        run = tempfile.TemporaryFile(dir=run_dir)
+        buffer = bytearray()
+        for user_id, bill in rows:
+            encoded = user_id.encode()
+            buffer += RUN_RECORD.pack(len(encoded), bill)
+            buffer += encoded
+        run.write(buffer)
+        run.seek(0)
+        return run
+
+    def _read_run(self, run: BinaryIO) -> Iterator[Tuple[str, float]]:
+        while True:
+            header = run.read(RUN_RECORD.size)
+            if not header:
+                return
+            length, bill = RUN_RECORD.unpack(header)
+            yield run.read(length).decode(), bill
@@ -0,0 +1,19 @@
+import os
+
+# File formats for journey, zone and bill files
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+FORMAT_ARROW = "arrow"
+FILE_FORMATS = (FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW)
+
+EXTENSIONS = {".parquet": FORMAT_PARQUET, ".pq": FORMAT_PARQUET,
+              ".arrow": FORMAT_ARROW, ".feather": FORMAT_ARROW, ".ipc": FORMAT_ARROW}
+
+
+def detect_format(file_path: str, file_format: str = None) -> str:
+    """The given format, or the one implied by the file extension; CSV for anything else"""
+    if file_format:
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown file format: {file_format}")
+        return file_format
+    return EXTENSIONS.get(os.path.splitext(file_path)[1].lower(), FORMAT_CSV)
@@ -0,0 +1,116 @@
+import csv
+import io
+import multiprocessing
+import os
+from typing import Container, Iterator, List, Tuple
+
+from src.csv.compression import detect_compression, iter_blocks
+from src.csv.data_processor import DataProcessor
+from src.model.journey_columns import JourneyColumns, JourneyColumnsBuilder
+
+
+def split_ranges(file_path: str, parts: int) -> List[Tuple[int, int]]:
+    """Splits the data section of a CSV file (after the header line) into byte ranges that start and end on line
+    boundaries. Assumes quoted fields never contain newlines, which holds for the journey feed"""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        file.readline()
+        data_start = file.tell()
+
+        bounds = [data_start]
+        for part in range(1, parts):
+            target = data_start + (size - data_start) * part // parts
+            if target <= bounds[-1]:
+                continue
+            file.seek(target - 1)
+            # Move to the start of the next line (stays put if target is already a line start)
+            file.readline()
+            position = file.tell()
+            if bounds[-1] < position < size:
+                bounds.append(position)
+        bounds.append(size)
+
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def parse_range(file_path: str, start: int, end: int,
+                stations: Container[str] = None) -> Tuple[int, JourneyColumns, List[Tuple[int, List[str]]]]:
+    """Parses one byte range into columns. Returns (row count, columns, rejected rows as (local index, record));
+    errors are reported by the caller once the global row numbers are known"""
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        return parse_block(file.read(end - start), stations)
+
+
+def parse_block(data: bytes,
+                stations: Container[str] = None) -> Tuple[int, JourneyColumns, List[Tuple[int, List[str]]]]:
+    """Parses whole lines of journey data into columns, returning the same as parse_range"""
+    text = data.decode()
+    builder = JourneyColumnsBuilder()
+    rejected: List[Tuple[int, List[str]]] = []
+    index = -1
+    for index, record in enumerate(csv.reader(io.StringIO(text, newline=""))):
+        try:
+            builder.append(*DataProcessor._journey_fields(index, record, stations))
+        except Exception:
+            rejected.append((index, record))
+
+    return index + 1, builder.build(), rejected
+
+
+# Known stations, handed to each worker process once instead of with every range
+_worker_stations: Container[str] = None
+
+
+def _init_worker(stations: Container[str]):
+    global _worker_stations
+    _worker_stations = stations
+
+
+def _parse_range_task(task: Tuple[str, int, int]):
+    return parse_range(*task, _worker_stations)
+
+
+def _parse_block_task(data: bytes):
+    return parse_block(data, _worker_stations)
+
+
+class ParallelCSVReader:
+    """Parses a journey CSV in worker processes, one byte range each, and returns columnar batches in file order"""
+
+    def __init__(self, workers: int = None, ranges_per_worker: int = 4, stations: Container[str] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.ranges_per_worker = ranges_per_worker
+        # Rows naming a station outside this container are rejected, as in DataProcessor
+        self.stations = stations
+
+    def iter_batches(self, file_path: str) -> Iterator[JourneyColumns]:
+        """Yields one JourneyColumns batch per byte range, in the original file order. Rejected rows are reported
+        with the same row numbers as DataProcessor"""
+        with multiprocessing.Pool(processes=self.workers, initializer=_init_worker, initargs=(self.stations,)) as pool:
+            # imap hands results back in submission order while later ranges are still being parsed
+            if detect_compression(file_path):
+                # A compressed file cannot be split by offset; its decompressed blocks are parsed as they come
+                results = pool.imap(_parse_block_task, iter_blocks(file_path))
+            else:
+                ranges = split_ranges(file_path, self.workers * self.ranges_per_worker)
+                results = pool.imap(_parse_range_task, [(file_path, start, end) for start, end in ranges])
+
+            rows_before = 0
+            for row_count, columns, rejected in results:
+                for index, record in rejected:
+                    DataProcessor._report_row_error(rows_before + index, record, self.stations)
+                rows_before += row_count
+                yield columns
+
+    def read_columns(self, file_path: str):
+        """Reads the whole file into a single JourneyColumns, or returns an error string like CSVReader"""
+        if not os.path.isfile(file_path):
+            return f"File Not Found: {file_path}"
+
+        try:
+            columns = JourneyColumns.concat(list(self.iter_batches(file_path)))
+        except Exception as e:
+            return f"An Error Occurred Reading File: {e}"
+
+        return columns if len(columns) else "No valid transactions found."
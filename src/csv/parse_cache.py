@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from typing import Container, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.util.reject_sink import RejectRecord
+
+# Bump when the parsers or the entry layout change, so entries written by older code are never read
+VERSION = 1
+# Read size when hashing file content
+HASH_CHUNK_BYTES = 1 << 20
+ENTRY_SUFFIX = ".npz"
+
+
+class ParseCache:
+    """Size-bounded on-disk cache of parsed input files.
+
+    Entries are keyed by what was parsed (zone numbers, journeys or journey columns), the content hash of the file
+    and the station set journeys were checked against. Hashing a large file costs a read of it, so the hash is kept
+    in a stamp per path together with the file's size and mtime, and only recomputed when either changes. An entry
+    holds the parsed arrays and the rows rejected while parsing, in an uncompressed .npz file that loads without
+    any per-row work. Loading an entry touches its mtime; when the directory grows beyond max_bytes the entries used
+    least recently are removed.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30):
+        if max_bytes < 1:
+            raise ValueError(f"Cache size must be at least one byte, got {max_bytes}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._stamp_dir = os.path.join(cache_dir, "stamps")
+        os.makedirs(self._stamp_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind: str, file_path: str, *extra: str) -> str:
+        """Entry key for a file parsed as kind; raises OSError if the file cannot be read"""
+        digest = hashlib.blake2b(digest_size=20)
+        for part in (str(VERSION), kind, self.content_hash(file_path), *extra):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def content_hash(self, file_path: str) -> str:
+        """Hash of the file's content, reused from its stamp while the size and mtime are unchanged"""
+        stat = os.stat(file_path)
+        stamp_path = os.path.join(self._stamp_dir,
+                                  hashlib.blake2b(os.path.abspath(file_path).encode(), digest_size=20).hexdigest())
+        try:
+            with open(stamp_path) as file:
+                stamp = json.load(file)
+            if stamp["size"] == stat.st_size and stamp["mtime_ns"] == stat.st_mtime_ns:
+                return stamp["hash"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        self._replace(stamp_path, json.dumps({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                              "hash": content_hash}).encode())
+        return content_hash
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Arrays of an entry, or None on a miss"""
+        path = self._entry_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            # The mtime records the last use for LRU eviction
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def store(self, key: str, arrays: Dict[str, np.ndarray]):
+        """Write an entry atomically, then evict the least recently used entries beyond the size budget"""
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as file:
+            np.savez(file, **arrays)
+        os.replace(file.name, self._entry_path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(ENTRY_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    # Removed by another run sharing the directory
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def _replace(self, path: str, data: bytes):
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+            file.write(data)
+        os.replace(file.name, path)
+
+
+def stations_fingerprint(stations: Container[str] = None) -> str:
+    """Identifies the station set journeys were checked against, since it decides which rows were rejected"""
+    if stations is None:
+        return "-"
+    digest = hashlib.blake2b(digest_size=20)
+    for station in sorted(stations):
+        digest.update(station.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def encode_names(names: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Names as UTF-8 byte offsets and one byte blob, as in the journey log"""
+    encoded = [name.encode() for name in names]
+    return (np.cumsum([0] + [len(name) for name in encoded], dtype=np.uint64),
+            np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+def decode_names(offsets: np.ndarray, blob: np.ndarray) -> List[str]:
+    offsets = offsets.tolist()
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)]
+
+
+def encode_rejects(records: List[RejectRecord], counts: Dict[str, int]) -> np.ndarray:
+    """Rejected rows as JSON bytes. Detail values other than numbers and strings, e.g. exceptions, are kept as their
+    text, which is all the message templates use"""
+    def plain(value):
+        return value if value is None or isinstance(value, (int, float, str)) else str(value)
+
+    rows = [[reason, row, list(fields) if fields is not None else None,
+             {name: plain(value) for name, value in details.items()}] for reason, row, fields, details in records]
+    return np.frombuffer(json.dumps({"records": rows, "counts": counts}).encode(), dtype=np.uint8)
+
+
+def decode_rejects(data: np.ndarray) -> Tuple[List[RejectRecord], Dict[str, int]]:
+    rejects = json.loads(data.tobytes())
+    return [tuple(record) for record in rejects["records"]], rejects["counts"]
@@ -1,103 +1,157 @@
-from datetime import datetime
-from typing import Dict, List
+from typing import Iterable, Mapping
 
+from src.billing_ledger import BillingLedger, REASON_TRIP, REASON_MISSING_IN, REASON_MISSING_OUT, REASON_CROSS_DAY, \
+    REASON_END_OF_DAY
 from src.billing_manager import BillingManager
 from src.model.journey import Journey
-from src.model.track_prev_tap import TrackPrevInTap, TimeCap
-from src.util.constans import TRIP_CHARGES
+from src.model.user_state import UserState
+from src.tariff import FareTable
+from src.util.constans import TRIP_CHARGES, PENALTY_CHARGES
+from src.util.reject_sink import current_sink, RowRejected, INVALID_DIRECTION, JOURNEY_COST, INTERNAL_ERROR
+from src.util.timestamp_parser import as_datetime
 
 
 class JourneyManager:
     """Manages the journey transactions for billing purposes"""
 
-    def __init__(self, billing_manager: BillingManager, zone_cost: Dict[str, float]):
+    def __init__(self, billing_manager: BillingManager, zone_cost: Mapping[str, float],
+                 ledger: BillingLedger = None):
         self.zone_cost = zone_cost
+        # A FareTable prices journeys from its precomputed zone pair table
+        self.fare_table = zone_cost if isinstance(zone_cost, FareTable) else None
         self.billing_manager = billing_manager
-
-    def calculate(self, transactions: List[Journey]):
-        """Process the list of transactions and calculate the billing for each user"""
+        # Month of the latest tap billed; users idle since before it are evicted when eviction is enabled
+        self.watermark_month = None
+        # When set, every charge is recorded in the ledger with its journey and reason
+        self.ledger = ledger
+
+    def calculate(self, transactions: Iterable[Journey], finalize: bool = True):
+        """Process the transactions and calculate the billing for each user. Accepts a list or any iterator, so a
+        streamed input is billed as it is read. With finalize disabled, open journeys are left pending so the state
+        can be carried into the next run"""
+        billing_manager = self.billing_manager
+        users = billing_manager.users
+        evicting = billing_manager.closed_bills is not None
+        events = 0
         for event in transactions:
+            events += 1
             try:
+                if evicting and (self.watermark_month is None or event.month > self.watermark_month):
+                    self.watermark_month = event.month
+                    billing_manager.evict_closed_periods(event.month)
+
                 user_id = event.userId
                 direction = event.direction
                 station = event.station
-                event_time: datetime = event.time
+                # Epoch seconds; day and month keys were precomputed when the row was parsed
+                event_time: int = event.epoch
 
-                # Initialize user billing and caps if not present
-                if user_id not in self.billing_manager.user_bill:
-                    self.billing_manager.initialize_user(user_id, event_time)
+                # One record holds the user's bill, caps and active journey; initialize it if not present
+                record = users.get(user_id)
+                if record is None:
+                    record = billing_manager.initialize_user(user_id, event_time, event.day, event.month)
 
                 # Check for new day or month and reset caps accordingly
-                if self.billing_manager.user_24hour_cap[user_id].active_time.date() != event_time.date():
-                    self.billing_manager.reset_daily_cap(user_id, event_time)
+                if record.day_key != event.day:
+                    billing_manager.reset_record_daily_cap(record, event_time, event.day)
 
-                if self.billing_manager.user_30days_cap[user_id].active_time.month != event_time.month:
-                    self.billing_manager.reset_monthly_cap(user_id, event_time)
+                if record.month_key != event.month:
+                    billing_manager.reset_record_monthly_cap(record, event_time, event.month)
 
                 # Process "IN" and "OUT" journey events
                 if direction == "IN":
-                    self._handle_in_tap(user_id, station, event_time)
+                    self._handle_in_tap(record, station, event_time, event.day)
                 elif direction == "OUT":
-                    self._handle_out_tap(user_id, station, event_time)
+                    self._handle_out_tap(record, station, event_time, event.day)
                 else:
-                    raise ValueError(f"Invalid direction '{direction}' for user {user_id} at {event_time}")
+                    raise RowRejected(INVALID_DIRECTION, user=user_id, direction=direction, epoch=event_time)
+            except RowRejected as rejected:
+                # Taps are billed after parsing, so an event carries its fields but no row number
+                current_sink().reject(rejected.reason, rejected.row, event_fields(event), **rejected.details)
             except Exception as e:
-                print(f"Error processing transaction for user {user_id} at {event_time}: {e}")
+                current_sink().reject(INTERNAL_ERROR,
+                                      message=f"Error processing transaction for user {user_id} at {event.time}: {e}")
+
+        billing_manager.stats.events += events
 
         # Process any pending journeys
-        self._handle_incomplete_journey()
+        if finalize:
+            self._handle_incomplete_journey()
 
-        return self.billing_manager.user_bill
+        return billing_manager.user_bill
 
     def _handle_incomplete_journey(self):
         """Applies penalties for incomplete journeys """
-        for userId in self.billing_manager.track_active_journey:
+        for record in self.billing_manager.users.open_journeys():
             try:
-                self.billing_manager.add_penalty(userId)
+                charged = self.billing_manager.charge_penalty(record)
+                if self.ledger is not None:
+                    self.ledger.record(record.user_id, record.day_key, record.in_station, record.in_time, None, None,
+                                       PENALTY_CHARGES, charged, REASON_END_OF_DAY)
             except Exception as e:
-                print(f"Error applying penalty for user {userId}: {e}")
+                current_sink().reject(INTERNAL_ERROR, message=f"Error applying penalty for user {record.user_id}: {e}")
 
-    def _handle_in_tap(self, user_id: str, station: str, event_time: datetime):
+    def _handle_in_tap(self, record: UserState, station: str, event_time: int, day: int):
         """Handle when the user taps IN"""
         try:
             # If there's already an active journey apply a penalty for missing the previous OUT tap
-            if user_id in self.billing_manager.track_active_journey:
-                self.billing_manager.add_penalty(user_id)
-                self.billing_manager.track_active_journey.pop(user_id)
+            if record.in_station is not None:
+                charged = self.billing_manager.charge_penalty(record)
+                if self.ledger is not None:
+                    self.ledger.record(record.user_id, record.day_key, record.in_station, record.in_time, None, None,
+                                       PENALTY_CHARGES, charged, REASON_MISSING_OUT)
 
             # Record the new IN tap and start tracking the journey
-            self.billing_manager.track_active_journey[user_id] = TrackPrevInTap(event_time, station)
+            self.billing_manager.users.open_journey(record, station, event_time, day)
 
         except Exception as e:
-            print(f"Error handling IN tap for user {user_id} at {event_time}: {e}")
+            current_sink().reject(INTERNAL_ERROR, message=f"Error handling IN tap for user {record.user_id} at "
+                                                          f"{as_datetime(event_time)}: {e}")
 
-    def _handle_out_tap(self, user_id: str, station: str, event_time: datetime):
+    def _handle_out_tap(self, record: UserState, station: str, event_time: int, day: int):
         """Handle when the user taps OUT"""
         try:
             # If no active IN tap exists apply a penalty
-            if user_id not in self.billing_manager.track_active_journey:
-                self.billing_manager.add_penalty(user_id)
+            if record.in_station is None:
+                charged = self.billing_manager.charge_penalty(record)
+                if self.ledger is not None:
+                    self.ledger.record(record.user_id, record.day_key, None, None, station, event_time,
+                                       PENALTY_CHARGES, charged, REASON_MISSING_IN)
             else:
                 # Check if the journey spanned multiple days
-                in_tap = self.billing_manager.track_active_journey[user_id]
-                if in_tap.transaction_time.date() != event_time.date():
-                    self.billing_manager.add_penalty(user_id)
+                if record.in_day != day:
+                    journey_cost, reason = PENALTY_CHARGES, REASON_CROSS_DAY
+                    charged = self.billing_manager.charge_penalty(record)
                 else:
                     # Calculate the cost of the complete journey
-                    journey_cost = self._calculate_journey_cost(in_tap.station, station)
-                    self.billing_manager.add_journey_cost(user_id, journey_cost)
+                    journey_cost, reason = self._calculate_journey_cost(record.in_station, station), REASON_TRIP
+                    charged = self.billing_manager.charge(record, journey_cost)
+                if self.ledger is not None:
+                    self.ledger.record(record.user_id, record.day_key, record.in_station, record.in_time, station,
+                                       event_time, journey_cost, charged, reason)
 
                 # Remove the completed journey
-                self.billing_manager.track_active_journey.pop(user_id)
+                self.billing_manager.users.close_journey(record)
 
         except Exception as e:
-            print(f"Error handling OUT tap for user {user_id} at {event_time}: {e}")
+            current_sink().reject(INTERNAL_ERROR, message=f"Error handling OUT tap for user {record.user_id} at "
+                                                          f"{as_datetime(event_time)}: {e}")
+
     def _calculate_journey_cost(self, start_station: str, end_station: str) -> float:
         """Calculate the cost of the journey based on zones"""
         try:
+            if self.fare_table is not None:
+                return self.fare_table.trip_cost(start_station, end_station)
+
             start_zone_cost = self.zone_cost.get(start_station)
             end_zone_cost = self.zone_cost.get(end_station)
             return TRIP_CHARGES + start_zone_cost + end_zone_cost
         except Exception as e:
-            print(f"Error calculating journey cost from {start_station} to {end_station}: {e}")
+            current_sink().reject(JOURNEY_COST, fields=(start_station, end_station), start=start_station,
+                                  end=end_station, error=e)
             return 0.0
+
+
+def event_fields(event: Journey) -> tuple:
+    """The fields of a tap, for the quarantine record of an event rejected while billing"""
+    return event.userId, event.station, event.direction, as_datetime(event.epoch).isoformat()
@@ -0,0 +1,150 @@
+import argparse
+import mmap
+import os
+import struct
+from typing import Container, Iterator, List
+
+import numpy as np
+
+from src.csv.data_processor import DataProcessor
+from src.model.journey import Journey
+from src.model.journey_columns import JourneyColumns, day_keys, month_keys, DIRECTION_IN, DIRECTION_OUT, _compact
+from src.tariff import FareTable
+from src.util.reject_sink import current_sink, UNKNOWN_STATION
+from src.util.timestamp_parser import as_datetime
+
+MAGIC = b"MTJL"
+VERSION = 1
+# magic, version, padding, number of taps, users and stations
+HEADER = struct.Struct("<4sHHQQQ")
+# One packed fixed-width record per tap, in file (timestamp) order
+RECORD = np.dtype([("epoch", "<i8"), ("user", "<u4"), ("station", "<u4"), ("direction", "i1")])
+
+
+class JourneyLog:
+    """A journey file converted to packed binary records, read through a memory map.
+
+    Layout after the header: records[n] of (epoch i64, user id u32, station id u32, direction i8), then the user and
+    station dictionaries, each as name offsets u64[count + 1] followed by the UTF-8 names. Ids follow first
+    appearance, as in JourneyColumns. Re-billing a log costs an mmap and a pass over the records: the tap columns are
+    views into the mapped file, and only the dictionaries are decoded.
+    """
+
+    def __init__(self, log_path: str):
+        self.log_path = log_path
+        with open(log_path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, count, user_count, station_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a journey log file: {log_path}")
+
+        self._count = count
+        self.records = np.frombuffer(self._mmap, dtype=RECORD, count=count, offset=HEADER.size)
+        offset = HEADER.size + RECORD.itemsize * count
+        self.users, offset = self._read_names(offset, user_count)
+        self.stations, _ = self._read_names(offset, station_count)
+
+    @staticmethod
+    def is_log(path: str) -> bool:
+        """True if path is a journey log rather than a text or columnar journey file"""
+        try:
+            with open(path, 'rb') as file:
+                return file.read(len(MAGIC)) == MAGIC
+        except OSError:
+            return False
+
+    @staticmethod
+    def write(columns: JourneyColumns, log_path: str) -> int:
+        """Write parsed journeys as a log; returns the number of taps. The file is replaced atomically"""
+        records = np.empty(len(columns), dtype=RECORD)
+        records["epoch"] = columns.epoch
+        records["user"] = columns.user_idx
+        records["station"] = columns.station_idx
+        records["direction"] = columns.direction
+
+        temp_path = f"{log_path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, 0, len(columns), len(columns.users), len(columns.stations)))
+            file.write(records.tobytes())
+            for names in (columns.users, columns.stations):
+                encoded = [name.encode() for name in names]
+                file.write(np.cumsum([0] + [len(name) for name in encoded], dtype=np.uint64).tobytes())
+                file.write(b"".join(encoded))
+        os.replace(temp_path, log_path)
+        return len(columns)
+
+    @staticmethod
+    def convert(journey_path: str, log_path: str, stations=None) -> int:
+        """Parse a journey CSV once and write it as a log; rows rejected by the parser are left out"""
+        columns = DataProcessor.read_transaction_columns_from_csv(journey_path, stations)
+        if isinstance(columns, str):
+            raise ValueError(f"Error reading transaction data: {columns}")
+        return JourneyLog.write(columns, log_path)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def drop_unknown_stations(self, stations: Container[str]) -> int:
+        """Leaves out the taps at stations missing from stations, as parsing the journey file against that zone map
+        would, and returns how many were left out. Each is reported as an unknown station with its row number in the
+        log, counted as in a CSV export with a header. A log written without --zone-path can hold such taps"""
+        known = np.array([name in stations for name in self.stations] or [False], dtype=bool)
+        keep = known[self.records["station"]]
+        dropped = np.flatnonzero(~keep).tolist()
+        directions = {DIRECTION_IN: "IN", DIRECTION_OUT: "OUT"}
+        for index in dropped:
+            epoch, user, station, direction = self.records[index].tolist()
+            fields = [self.users[user], self.stations[station], directions.get(direction, ""),
+                      as_datetime(epoch).isoformat()]
+            current_sink().reject(UNKNOWN_STATION, index + 2, fields, station=self.stations[station])
+        if dropped:
+            # A copy of the taps kept; the mapped file is left as it is. Users and stations left without a tap are
+            # dropped from the dictionaries too, so no engine bills a user the parse would not have seen
+            records = self.records[keep]
+            self.users, records["user"] = _compact(self.users, records["user"])
+            self.stations, records["station"] = _compact(self.stations, records["station"])
+            self.records = records
+            self._count = len(self.records)
+        return len(dropped)
+
+    def columns(self, start: int = 0, stop: int = None) -> JourneyColumns:
+        """Taps start to stop as JourneyColumns sharing the full user and station dictionaries. The id, direction
+        and epoch columns are views into the mapped file; only day and month keys are computed"""
+        records = self.records[start:stop]
+        epoch = records["epoch"]
+        return JourneyColumns(self.users, self.stations, records["user"], records["station"], records["direction"],
+                              epoch, day_keys(epoch), month_keys(epoch))
+
+    def batches(self, batch_size: int = 1_000_000) -> Iterator[JourneyColumns]:
+        for start in range(0, self._count, batch_size):
+            yield self.columns(start, start + batch_size)
+
+    def iter_journeys(self, batch_size: int = 1_000_000) -> Iterator[Journey]:
+        """Journey objects for JourneyManager, built one batch at a time"""
+        for batch in self.batches(batch_size):
+            yield from batch.iter_journeys()
+
+    def _read_names(self, offset: int, count: int):
+        offsets = np.frombuffer(self._mmap, dtype="<u8", count=count + 1, offset=offset).tolist()
+        start = offset + 8 * (count + 1)
+        blob = self._mmap[start:start + offsets[-1]]
+        names: List[str] = [blob[offsets[i]:offsets[i + 1]].decode() for i in range(count)]
+        return names, start + offsets[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a journey CSV file into a binary journey log.")
+    parser.add_argument("journey_path", type=str, help="Path to the journey data CSV file")
+    parser.add_argument("log_path", type=str, help="Path to write the journey log to")
+    parser.add_argument("--zone-path", type=str, default=None,
+                        help="Zone map CSV; journeys at stations missing from it are left out")
+    args = parser.parse_args()
+
+    stations = FareTable.from_zone_map_csv(args.zone_path) if args.zone_path else None
+    count = JourneyLog.convert(args.journey_path, args.log_path, stations)
+    print(f"Wrote {count} journeys to {args.log_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,143 @@
 import argparse
+import glob
+import json
+import multiprocessing
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Mapping, Sequence, Tuple, Union
 
-from typing import List, Tuple
-
+from src.billing_ledger import BillingLedger
 from src.billing_manager import BillingManager
-from src.csv.csv_writer import CSVWriter
+from src.closed_bills import ClosedBills
+from src.columnar_billing import ColumnarBillingEngine
+from src.csv.bulk_csv_writer import BulkCSVWriter
+from src.csv.compression import EXTENSIONS as COMPRESSION_EXTENSIONS
 from src.csv.data_processor import DataProcessor
+from src.csv.external_sort_writer import ExternalSortWriter
+from src.csv.file_format import FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW, detect_format
+from src.csv.parallel_csv_reader import ParallelCSVReader
+from src.csv.parse_cache import ParseCache
 from src.journey import JourneyManager
+from src.journey_log import JourneyLog
+from src.model.journey_columns import JourneyColumns
+from src.reorder_buffer import ReorderBuffer
+from src.run_metrics import RunMetrics
+from src.sharded_billing import ShardedBilling
+from src.state_checkpoint import StateCheckpoint
+from src.tariff import FareTable, Tariff
+from src.tariff_simulation import TariffSimulation
+from src.util.reject_sink import RejectSink, use_sink
+from src.zone_index import ZoneIndex
+from src.zone_rebill import RebillIndex, all_taps, zone_numbers_of
+
+# Billing engines selectable for a run
+ENGINE_JOURNEY = "journey"
+ENGINE_COLUMNAR = "columnar"
+
+
 class MassTransitBilling:
-    def __init__(self, journey_path: str, zone_path: str, output_path: str):
+    def __init__(self, journey_path: str, zone_path: str, output_path: str, engine: str = ENGINE_JOURNEY,
+                 workers: int = 1, state_in: str = None, state_out: str = None, sort_memory_rows: int = None,
+                 quarantine_path: str = None, count_rejects_only: bool = False, metrics_path: str = None,
+                 reorder_window: int = None, input_format: str = None, output_format: str = None,
+                 evict_idle_users: bool = False, spill_dir: str = None, closed_bills_in_memory: int = 1_000_000,
+                 cache_dir: str = None, cache_max_bytes: int = 1 << 30, zone_table: FareTable = None,
+                 rebill_index_path: str = None, ledger_path: str = None):
+        if engine not in (ENGINE_JOURNEY, ENGINE_COLUMNAR):
+            raise ValueError(f"Unknown billing engine: {engine}")
+        if workers < 1:
+            raise ValueError(f"Number of workers must be at least 1, got {workers}")
+        if (state_in or state_out) and (engine != ENGINE_JOURNEY or workers > 1):
+            raise ValueError("Billing state can only be carried between single-process journey engine runs")
+        if reorder_window is not None and (engine != ENGINE_JOURNEY or workers > 1):
+            raise ValueError("Reordering taps is only supported by single-process journey engine runs")
+        if evict_idle_users and (engine != ENGINE_JOURNEY or workers > 1 or state_out):
+            raise ValueError("Evicting idle users is only supported by single-process journey engine runs that do "
+                             "not save their state")
+        if ledger_path and (engine != ENGINE_JOURNEY or workers > 1):
+            raise ValueError("A billing ledger is only written by single-process journey engine runs")
+        if rebill_index_path and (state_in or detect_format(output_path, output_format) != FORMAT_CSV):
+            raise ValueError("A re-bill index needs a CSV output and a run that does not start from a saved state")
+        if rebill_index_path and reorder_window is not None:
+            # The index re-bills taps in file order, which a reordered run does not bill them in
+            raise ValueError("A re-bill index cannot be saved by a run that reorders taps")
+
         self.journey_path = journey_path
         self.zone_path = zone_path
         self.output_path = output_path
+        self.engine = engine
+        # More than one worker parses the file in parallel and, for the journey engine, bills shards of users in
+        # separate processes
+        self.workers = workers
+        # Billing state loaded before the run and saved after it, for incremental daily runs
+        self.state_in = state_in
+        self.state_out = state_out
+        # When set, the output is sorted externally holding at most this many rows in memory
+        self.sort_memory_rows = sort_memory_rows
+        # When set, taps up to this many seconds out of order are put back in timestamp order before billing
+        self.reorder_window = reorder_window
+        self.reorder_buffer = None
+        # When set, users idle since before the month of the latest tap are evicted from memory; their bills are
+        # kept in closed_bills, with at most closed_bills_in_memory of them in memory and the rest spilled to spill_dir
+        self.evict_idle_users = evict_idle_users
+        self.spill_dir = spill_dir
+        self.closed_bills_in_memory = closed_bills_in_memory
+        # When set, parsed CSV inputs are cached in cache_dir, keeping at most cache_max_bytes of entries
+        self.parse_cache = ParseCache(cache_dir, cache_max_bytes) if cache_dir else None
+        # Journey and output file formats (csv, parquet or arrow); None picks the format from the file extension
+        self.input_format = detect_format(journey_path, input_format)
+        self.output_format = detect_format(output_path, output_format)
+        # Rejected rows and events are written to a quarantine file or only counted instead of printed one by one
+        self.reject_sink = RejectSink(quarantine_path=quarantine_path, count_only=count_rejects_only)
+        # Stage timings and counters of the last run; written as JSON to metrics_path ("-" for stdout) when set
+        self.metrics = RunMetrics()
+        self.metrics_path = metrics_path
+        # A zone map already loaded, e.g. shared by the runs of a batch; zone_path is not read when it is set
+        self.zone_table = zone_table
+        # When set, a RebillIndex of the run is saved there, so a zone map change can be re-billed with zone_rebill
+        self.rebill_index_path = rebill_index_path
+        # Every tap of the journey file, those at stations missing from the zone map included, for the re-bill index
+        self.rebill_taps = None
+        # When set, every charge is recorded in a SQLite ledger there, indexed by user and day
+        self.ledger_path = ledger_path
+        self.ledger = None
+        # Message of the error that stopped the last run, None if it completed
+        self.error = None
         self.data_transaction = None
         self.zone_data = None
         self.billing_manager = BillingManager()
         self.journey_manager = None
 
-    def load_data(self):
+    def load_data(self, streaming: bool = False):
         """
-        Load transaction and zone data from CSV files.
+        Load transaction and zone data from CSV, Parquet or Arrow files.
+        In streaming mode the transactions are a lazy iterator that is consumed during billing.
         """
-        self.data_transaction = DataProcessor.read_transaction_from_csv(self.journey_path)
-        self.zone_data = DataProcessor.read_zone_map_from_csv(self.zone_path)
+        if streaming and self.engine == ENGINE_COLUMNAR:
+            raise ValueError("Streaming is not supported by the columnar engine")
+        if streaming and self.workers > 1:
+            raise ValueError("Streaming is not supported with more than one worker")
+
+        # Trip costs come from a precomputed fare table; a compiled zone index is memory-mapped instead of parsing the
+        # CSV zone map. Journeys at stations missing from the zone map are rejected while loading
+        if self.zone_table is not None:
+            self.zone_data = self.zone_table
+        elif ZoneIndex.is_index(self.zone_path):
+            self.zone_data = FareTable.from_zone_index(ZoneIndex(self.zone_path))
+        elif detect_format(self.zone_path) != FORMAT_CSV:
+            self.zone_data = FareTable.from_zone_numbers(DataProcessor.read_zone_numbers_from_arrow(self.zone_path))
+        else:
+            self.zone_data = FareTable.from_zone_map_csv(self.zone_path)
+        if self.state_in:
+            self.billing_manager = StateCheckpoint().load(self.state_in)
+
+        if self.rebill_index_path:
+            if streaming:
+                raise ValueError("A re-bill index needs the whole journey file, so it cannot be built while streaming")
+            self.data_transaction, self.rebill_taps = self._read_transactions_and_all_taps()
+        else:
+            self.data_transaction = self._read_transactions(streaming)
 
         if isinstance(self.data_transaction, str):
             raise ValueError(f"Error reading transaction data: {self.data_transaction}")
@@ -29,33 +145,332 @@ class MassTransitBilling:
         if isinstance(self.zone_data, str):
             raise ValueError(f"Error reading zone data: {self.zone_data}")
 
+    def _read_transactions(self, streaming: bool = False):
+        """The transactions to bill, in the form the engine takes, or the message of an error reading them"""
+        if JourneyLog.is_log(self.journey_path):
+            # A binary journey log is memory-mapped instead of parsed. It may have been written without a zone map, so
+            # its taps at stations this zone map does not know are rejected as parsing the journey file would
+            journey_log = JourneyLog(self.journey_path)
+            journey_log.drop_unknown_stations(self.zone_data)
+            if self.engine == ENGINE_JOURNEY and self.workers == 1:
+                return journey_log.iter_journeys()
+            return journey_log.columns()
+        if self.input_format != FORMAT_CSV:
+            # Columnar files go straight to columns. The journey engine bills them tap by tap one record batch at a
+            # time, so only the columnar and sharded engines and runs saving a re-bill index hold the whole file
+            if self.engine == ENGINE_JOURNEY and self.workers == 1 and not self.rebill_index_path:
+                return DataProcessor.stream_transaction_from_arrow(
+                    self.journey_path, self.zone_data, self.input_format)
+            return DataProcessor.read_transaction_columns_from_arrow(
+                self.journey_path, self.zone_data, self.input_format)
+        if self.workers > 1:
+            return DataProcessor.cached_transaction_columns(
+                self.journey_path, self.zone_data,
+                lambda: ParallelCSVReader(self.workers, stations=self.zone_data).read_columns(self.journey_path))
+        if self.engine == ENGINE_COLUMNAR:
+            return DataProcessor.read_transaction_columns_from_csv(self.journey_path, self.zone_data)
+        if streaming:
+            return DataProcessor.stream_transaction_from_csv(self.journey_path, self.zone_data)
+        return DataProcessor.read_transaction_from_csv(self.journey_path, self.zone_data)
+
+    def _read_transactions_and_all_taps(self):
+        """
+        The transactions to bill and every tap of the journey file for the re-bill index, from one parse.
+        The rows rejected while parsing are collected and passed on to the run's sink once it is done; the taps at
+        stations missing from the zone map are rebuilt from them.
+        """
+        if JourneyLog.is_log(self.journey_path):
+            # Nothing is parsed: the index takes the mapped taps, those at unknown stations included
+            return self._read_transactions(), JourneyLog(self.journey_path).columns()
+
+        collector = RejectSink(echo=False, collect=True)
+        run_sink = use_sink(collector)
+        try:
+            transactions = self._read_transactions()
+        finally:
+            use_sink(run_sink)
+            records, counts = collector.drain()
+            run_sink.merge(records, counts)
+        if isinstance(transactions, str):
+            return transactions, None
+
+        taps = all_taps(transactions, records)
+        if self.engine == ENGINE_JOURNEY and self.workers == 1 and isinstance(transactions, JourneyColumns):
+            # Columnar files are read whole for the index; the journey engine bills them tap by tap
+            transactions = transactions.iter_journeys()
+        return transactions, taps
+
     def process_billing(self):
         """
-        Initialize JourneyManager and process billing.
+        Initialize JourneyManager (or the columnar engine) and process billing.
         """
-        self.journey_manager = JourneyManager(billing_manager=self.billing_manager, zone_cost=self.zone_data)
-        billing_data = self.journey_manager.calculate(self.data_transaction)
+        if self.engine == ENGINE_COLUMNAR:
+            return ColumnarBillingEngine(self.zone_data).calculate(self.data_transaction)
+        if self.workers > 1:
+            sharded_billing = ShardedBilling(self.zone_data, self.workers)
+            billing_data = sharded_billing.calculate(self.data_transaction)
+            self.billing_manager.stats = sharded_billing.stats
+            return billing_data
+
+        transactions = self.data_transaction
+        if self.reorder_window is not None:
+            self.reorder_buffer = ReorderBuffer(self.reorder_window)
+            transactions = self.reorder_buffer.reorder(transactions)
+
+        if self.ledger_path:
+            self.ledger = BillingLedger(self.ledger_path)
+        self.journey_manager = JourneyManager(billing_manager=self.billing_manager, zone_cost=self.zone_data,
+                                              ledger=self.ledger)
+        if self.evict_idle_users:
+            self.billing_manager.enable_eviction(ClosedBills(self.spill_dir, self.closed_bills_in_memory))
+            self.journey_manager.calculate(transactions)
+            # Evicted users are billed too; only their bills come back into memory
+            try:
+                return dict(self.billing_manager.all_bills())
+            finally:
+                self.billing_manager.closed_bills.close()
+        if not self.state_out:
+            return self.journey_manager.calculate(transactions)
+
+        # Save the state with journeys still open so tomorrow's taps can close them, then penalise them for today's
+        # output as a full run would
+        billing_data = self.journey_manager.calculate(transactions, finalize=False)
+        StateCheckpoint().save(self.billing_manager, self.state_out)
+        self.journey_manager._handle_incomplete_journey()
         return billing_data
 
-    def run(self):
+    @contextmanager
+    def _run_context(self) -> Iterator[RunMetrics]:
         """
-        Execute the billing process.
+        Set up a run and tear it down, for run() and simulate(): install the reject sink and the parse cache, collect
+        the metrics and, however the run ends, restore them, report the rejects and write the metrics.
+        An error that stops the run is printed and kept in self.error instead of being raised.
         """
+        self.error = None
+        self.reject_sink.open()
+        previous_sink = use_sink(self.reject_sink)
+        previous_cache = DataProcessor.use_cache(self.parse_cache)
+        metrics = self.metrics = RunMetrics()
+        if self.parse_cache is not None:
+            self.parse_cache.hits = self.parse_cache.misses = 0
         try:
-            self.load_data()
-            billing_data = self.process_billing()
+            yield metrics
+        except (ValueError, OSError) as e:
+            self.error = str(e)
+            print(e)
+        except Exception as e:
+            self.error = f"An unexpected error occurred: {e}"
+            print(self.error)
+        finally:
+            use_sink(previous_sink)
+            DataProcessor.use_cache(previous_cache)
+            if self.parse_cache is not None:
+                metrics.count(cache_hits=self.parse_cache.hits, cache_misses=self.parse_cache.misses)
+            if self.ledger is not None:
+                # Leaves a closed ledger in place; drops the part written by a run that failed
+                self.ledger.discard()
+                self.ledger = None
+            self.reject_sink.close()
+            self.report_rejects()
+            metrics.count(rejected_rows=self.reject_sink.total)
+            if self.metrics_path:
+                metrics.write_json(self.metrics_path)
+
+    def run(self, streaming: bool = False):
+        """
+        Execute the billing process.
+        With streaming enabled, journeys are billed while the file is being read instead of loaded up front, so
+        parsing is timed as part of the billing stage.
+        Returns True if the bills were written, False if an error stopped the run.
+        """
+        with self._run_context() as metrics:
+            with metrics.stage("load_data"):
+                self.load_data(streaming)
+            with metrics.stage("process_billing"):
+                billing_data = self.process_billing()
+            self.count_billing(billing_data)
+            if self.ledger is not None:
+                with metrics.stage("ledger"):
+                    self.ledger.close()
+                metrics.count(ledger_rows=self.ledger.rows)
+            if self.rebill_index_path:
+                with metrics.stage("rebill_index"):
+                    RebillIndex.build(self.rebill_taps, zone_numbers_of(self.zone_data)).save(self.rebill_index_path)
+
+            if self.sort_memory_rows:
+                # Sort in bounded memory and merge the sorted runs straight into Output.CSV
+                with metrics.stage("sort_and_write"):
+                    ExternalSortWriter(self.output_path, self.sort_memory_rows,
+                                       write_rows=self.output_writer()).write(billing_data.items())
+                return True
 
             # Sort the data by user_id alphanumerically
-            sorted_data = self.sorted_data(billing_data)
+            with metrics.stage("sort"):
+                sorted_data = self.sorted_data(billing_data)
 
             # Write the sorted data to Output.CSV
-            write = CSVWriter(self.output_path)
-            write.write_csv(sorted_data, self.output_path)
-        except ValueError as ve:
-            print(ve)
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+            with metrics.stage("write"):
+                write = self.output_writer()
+                write(sorted_data, self.output_path)
+            return True
+        return False
+
+    def simulate(self, tariffs: Sequence[Tariff], summary_path: str = None):
+        """
+        Bill the journeys under every tariff in one pass and write a bill column per tariff to the output path.
+        Prints the revenue of each tariff and writes it as JSON to summary_path ("-" for stdout) when set.
+        Needs the journeys as columns, so the run must use the columnar engine, and writes CSV only.
+        Returns the SimulationResult, or None if an error stopped the run.
+        """
+        with self._run_context() as metrics:
+            if self.output_format != FORMAT_CSV:
+                raise ValueError(f"Tariff simulation writes CSV bills, not {self.output_format}")
+            with metrics.stage("load_data"):
+                self.load_data()
+            if not isinstance(self.data_transaction, JourneyColumns):
+                raise ValueError("Tariff simulation needs the columnar engine")
+            with metrics.stage("simulate"):
+                result = TariffSimulation(self.zone_data, tariffs).calculate(self.data_transaction)
+            with metrics.stage("write"):
+                result.write_bills(self.output_path)
+
+            summary = result.summary()
+            for line in summary:
+                print(f"{line['tariff']}: revenue {line['revenue']:.2f}, {line['users']} users, {line['trips']} "
+                      f"trips, {line['penalties']} penalties, {line['capped_charges']} capped charges")
+            if summary_path == "-":
+                print(json.dumps(summary, indent=2))
+            elif summary_path:
+                with open(summary_path, 'w') as file:
+                    json.dump(summary, file, indent=2)
+            return result
+        return None
+
+    def output_writer(self):
+        """Writes the sorted bills in the output format: BulkCSVWriter, or ArrowWriter for Parquet and Arrow files"""
+        if self.output_format == FORMAT_CSV:
+            return BulkCSVWriter(self.output_path).write_csv
+
+        from src.csv.arrow_writer import ArrowWriter
+        return ArrowWriter(self.output_path, self.output_format).write_table
+
+    def count_billing(self, billing_data: dict):
+        """Record event, user, penalty, cap clamp and cap reset counts of the billing stage"""
+        if self.engine == ENGINE_COLUMNAR:
+            # The columnar engine bills in bulk and keeps no per-charge counters
+            self.metrics.count(events=len(self.data_transaction), users=len(billing_data))
+            return
+        self.metrics.count(users=len(billing_data), **self.billing_manager.stats.as_dict())
+        closed_bills = self.billing_manager.closed_bills
+        if closed_bills is not None:
+            self.metrics.count(evicted_users=closed_bills.evicted, spilled_bills=closed_bills.spilled)
+        if self.reorder_buffer is not None:
+            self.metrics.count(late_events=self.reorder_buffer.late_events,
+                               max_reorder_held=self.reorder_buffer.max_held)
+
+    def report_rejects(self):
+        """Summarise rejected records by reason when they were not printed as they happened"""
+        if self.reject_sink.echo or not self.reject_sink.total:
+            return
+        print(f"Rejected {self.reject_sink.total} records: " +
+              ", ".join(f"{reason}={count}" for reason, count in sorted(self.reject_sink.counts.items())))
+        if self.reject_sink.quarantine_path:
+            print(f"Rejected records written to {self.reject_sink.quarantine_path}")
 
     def sorted_data(self, billing_data: dict) -> List[Tuple[str, float]]:
         """Sort the billing data by user_id alphanumerically."""
-        return sorted(billing_data.items(), key=lambda x: x[0].lower())
\ No newline at end of file
+        return sorted(billing_data.items(), key=lambda x: x[0].lower())
+
+    @staticmethod
+    def run_batch(journey_paths: Union[str, Sequence[str]], zone_path: str, output_dir: str, processes: int = None,
+                  output_format: str = None, streaming: bool = False, **options) -> Dict[str, str]:
+        """
+        Bill many journey files with one zone map, in a pool of processes. journey_paths is a list of files, a
+        directory (every file in it) or a glob pattern. Each input is written to output_dir under its own name, with
+        the extension of output_format when given (CSV by default). Inputs whose outputs would have the same name fail
+        without being billed.
+        The zone map is read once and compiled to a zone index that every worker memory-maps, so the table is shared
+        through the page cache instead of being parsed or pickled per process. Other options are passed to each
+        MassTransitBilling run, and each file is streamed when streaming is set. Returns the failed inputs with their
+        error, after printing a summary.
+        """
+        if options.get("workers", 1) > 1:
+            raise ValueError("Files of a batch are billed one per process; workers cannot be set")
+        journey_paths = batch_inputs(journey_paths)
+        if not journey_paths:
+            raise ValueError("No journey files to bill")
+        os.makedirs(output_dir, exist_ok=True)
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            index_path = zone_path
+            if not ZoneIndex.is_index(zone_path):
+                index_path = os.path.join(index_dir, "zone_map.idx")
+                zone_numbers = (DataProcessor.read_zone_numbers_from_csv(zone_path)
+                                if detect_format(zone_path) == FORMAT_CSV
+                                else DataProcessor.read_zone_numbers_from_arrow(zone_path))
+                if not zone_numbers:
+                    raise ValueError(f"Error reading zone data: {zone_path}")
+                ZoneIndex.write(zone_numbers, index_path)
+
+            # Inputs that would write the same output, e.g. a.csv and a.parquet, fail instead of overwriting each other
+            inputs_of: Dict[str, List[str]] = {}
+            for path in journey_paths:
+                inputs_of.setdefault(batch_output_path(path, output_dir, output_format), []).append(path)
+            failures = {path: f"Output {output_path} is also written for {', '.join(p for p in paths if p != path)}"
+                        for output_path, paths in inputs_of.items() if len(paths) > 1 for path in paths}
+            tasks = [(paths[0], output_path, output_format, streaming, options)
+                     for output_path, paths in inputs_of.items() if len(paths) == 1]
+
+            if tasks:
+                processes = min(processes or os.cpu_count() or 1, len(tasks))
+                with multiprocessing.Pool(processes=processes, initializer=_init_batch_worker,
+                                          initargs=(index_path,)) as pool:
+                    failures.update((path, error) for path, error in pool.imap_unordered(_bill_batch_file, tasks)
+                                    if error is not None)
+
+        print(f"Billed {len(journey_paths) - len(failures)} of {len(journey_paths)} journey files into {output_dir}")
+        for path in sorted(failures):
+            print(f"Failed: {path}: {failures[path]}")
+        return failures
+
+
+def batch_inputs(journey_paths: Union[str, Sequence[str]]) -> List[str]:
+    """Journey files of a batch, in name order: the files of a directory, the matches of a glob pattern or a list"""
+    if isinstance(journey_paths, str):
+        if os.path.isdir(journey_paths):
+            journey_paths = [os.path.join(journey_paths, name) for name in os.listdir(journey_paths)]
+        else:
+            journey_paths = glob.glob(journey_paths)
+    return sorted(path for path in journey_paths if os.path.isfile(path))
+
+
+def batch_output_path(journey_path: str, output_dir: str, output_format: str = None) -> str:
+    """Output of a journey file in a batch: its name without the format and compression extensions, e.g. x for
+    x.csv.gz, with the extension of the output format"""
+    stem, extension = os.path.splitext(os.path.basename(journey_path))
+    if extension.lower() in COMPRESSION_EXTENSIONS:
+        stem = os.path.splitext(stem)[0]
+    extension = {FORMAT_PARQUET: ".parquet", FORMAT_ARROW: ".arrow"}.get(output_format, ".csv")
+    return os.path.join(output_dir, stem + extension)
+
+
+# Zone index of a batch worker and its fare table, opened once by the pool initializer
+_batch_index_path = None
+_batch_zone_table = None
+
+
+def _init_batch_worker(index_path: str):
+    global _batch_index_path, _batch_zone_table
+    _batch_index_path = index_path
+    _batch_zone_table = FareTable.from_zone_index(ZoneIndex(index_path))
+
+
+def _bill_batch_file(task: Tuple[str, str, str, bool, Mapping]) -> Tuple[str, str]:
+    """Bill one file of a batch; returns its path and the error that stopped it, or None"""
+    journey_path, output_path, output_format, streaming, options = task
+    try:
+        billing = MassTransitBilling(journey_path, _batch_index_path, output_path,
+                                     output_format=output_format, zone_table=_batch_zone_table, **options)
+        return journey_path, None if billing.run(streaming) else billing.error
+    except Exception as e:
+        return journey_path, str(e)
@@ -0,0 +1,24 @@
+from typing import Dict
+
+
+# Running counters of a billing run; plain integer attributes so they are cheap enough to keep on in production
+class BillingStats:
+    __slots__ = ("events", "penalties", "cap_clamps", "daily_cap_resets", "monthly_cap_resets")
+
+    def __init__(self):
+        # Taps processed by JourneyManager
+        self.events = 0
+        # Penalties charged for missing IN or OUT taps, cross-day journeys and journeys left open
+        self.penalties = 0
+        # Charges reduced to stay within the daily or monthly cap
+        self.cap_clamps = 0
+        self.daily_cap_resets = 0
+        self.monthly_cap_resets = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def merge(self, counters: Dict[str, int]):
+        """Add counters from another run, e.g. a shard billed in a worker process"""
+        for name, value in counters.items():
+            setattr(self, name, getattr(self, name) + value)
@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from src.util.timestamp_parser import as_datetime, parse_timestamp
+
 
 # Represents a transit journey of a user
 class Journey:
@@ -10,9 +12,23 @@ class Journey:
             self.userId: str = user_id
             self.station: str = station
             self.direction: str = direction
-            self.time: datetime = datetime.strptime(time, "%Y-%m-%dT%H:%M:%S")
+            # Integer epoch seconds, day ordinal and month key so cap checks are plain integer comparisons
+            self.epoch, self.day, self.month = parse_timestamp(time)
 
         except ValueError:
             raise ValueError(f"Invalid format for journey")
 
+    @classmethod
+    def from_parsed(cls, user_id: str, station: str, direction: str, epoch: int, day: int, month: int) -> "Journey":
+        """Builds a Journey from fields that were already parsed, e.g. from columnar data"""
+        journey = cls.__new__(cls)
+        journey.userId = user_id
+        journey.station = station
+        journey.direction = direction
+        journey.epoch, journey.day, journey.month = epoch, day, month
+        return journey
 
+    @property
+    def time(self) -> datetime:
+        """The tap time as a datetime, built on demand"""
+        return as_datetime(self.epoch)
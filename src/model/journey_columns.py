@@ -0,0 +1,135 @@
+from array import array
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+from src.model.journey import Journey
+from src.util.timestamp_parser import EPOCH, EPOCH_ORDINAL, SECONDS_PER_DAY
+
+# Direction codes used by the columnar representation
+DIRECTION_OUT = 0
+DIRECTION_IN = 1
+DIRECTION_INVALID = -1
+
+DIRECTION_CODES = {"IN": DIRECTION_IN, "OUT": DIRECTION_OUT}
+
+
+# JourneyColumns holds a journey file as parallel arrays, with user ids and stations interned to integers
+class JourneyColumns:
+
+    def __init__(self, users: List[str], stations: List[str], user_idx: np.ndarray, station_idx: np.ndarray,
+                 direction: np.ndarray, epoch: np.ndarray, day: np.ndarray, month: np.ndarray):
+        # Distinct user ids and station names in order of first appearance
+        self.users = users
+        self.stations = stations
+        # One entry per tap, in file order
+        self.user_idx = user_idx
+        self.station_idx = station_idx
+        self.direction = direction
+        self.epoch = epoch
+        self.day = day
+        self.month = month
+
+    def __len__(self) -> int:
+        return len(self.user_idx)
+
+    def iter_journeys(self) -> Iterator[Journey]:
+        """Yields the taps as Journey objects for JourneyManager, in column order"""
+        directions = {DIRECTION_IN: "IN", DIRECTION_OUT: "OUT"}
+        users, stations = self.users, self.stations
+        for user, station, direction, epoch, day, month in zip(
+                self.user_idx.tolist(), self.station_idx.tolist(), self.direction.tolist(), self.epoch.tolist(),
+                self.day.tolist(), self.month.tolist()):
+            yield Journey.from_parsed(users[user], stations[station], directions.get(direction, ""), epoch, day,
+                                      month)
+
+    def take(self, indices: np.ndarray) -> "JourneyColumns":
+        """A subset of the taps, with user and station tables compacted to the ids the subset uses"""
+        users, user_idx = _compact(self.users, self.user_idx[indices])
+        stations, station_idx = _compact(self.stations, self.station_idx[indices])
+        return JourneyColumns(users, stations, user_idx, station_idx, self.direction[indices], self.epoch[indices],
+                              self.day[indices], self.month[indices])
+
+    @staticmethod
+    def concat(batches: Sequence["JourneyColumns"]) -> "JourneyColumns":
+        """Joins batches in order, re-interning users and stations so ids follow first appearance overall"""
+        user_ids: Dict[str, int] = {}
+        station_ids: Dict[str, int] = {}
+        user_idx, station_idx = [], []
+        for batch in batches:
+            user_map = np.array([user_ids.setdefault(user, len(user_ids)) for user in batch.users], dtype=np.int32)
+            station_map = np.array([station_ids.setdefault(station, len(station_ids)) for station in batch.stations],
+                                   dtype=np.int32)
+            user_idx.append(user_map[batch.user_idx])
+            station_idx.append(station_map[batch.station_idx])
+
+        return JourneyColumns(
+            users=list(user_ids),
+            stations=list(station_ids),
+            user_idx=_concat(user_idx, np.int32),
+            station_idx=_concat(station_idx, np.int32),
+            direction=_concat([batch.direction for batch in batches], np.int8),
+            epoch=_concat([batch.epoch for batch in batches], np.int64),
+            day=_concat([batch.day for batch in batches], np.int32),
+            month=_concat([batch.month for batch in batches], np.int32),
+        )
+
+
+def day_keys(epoch: np.ndarray) -> np.ndarray:
+    """Day ordinals of epoch seconds, as timestamp_parser.day_key"""
+    return (epoch // SECONDS_PER_DAY + EPOCH_ORDINAL).astype(np.int32)
+
+
+def month_keys(epoch: np.ndarray) -> np.ndarray:
+    """Month keys (year * 12 + month - 1) of epoch seconds, as timestamp_parser.month_key"""
+    months_since_epoch = epoch.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+    return (months_since_epoch + EPOCH.year * 12).astype(np.int32)
+
+
+def _compact(names: List[str], idx: np.ndarray):
+    """Renumbers ids in order of first appearance and keeps only the names that are used"""
+    used, first, inverse = np.unique(idx, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return [names[i] for i in used[order].tolist()], rank[inverse].astype(np.int32, copy=False)
+
+
+def _concat(arrays: List[np.ndarray], dtype) -> np.ndarray:
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+
+# JourneyColumnsBuilder accumulates parsed taps row by row into compact typed arrays
+class JourneyColumnsBuilder:
+
+    def __init__(self):
+        self._user_ids: Dict[str, int] = {}
+        self._station_ids: Dict[str, int] = {}
+        self._user_idx = array("i")
+        self._station_idx = array("i")
+        self._direction = array("b")
+        self._epoch = array("q")
+        self._day = array("i")
+        self._month = array("i")
+
+    def append(self, user_id: str, station: str, direction: str, epoch: int, day: int, month: int):
+        user_ids = self._user_ids
+        station_ids = self._station_ids
+        self._user_idx.append(user_ids.setdefault(user_id, len(user_ids)))
+        self._station_idx.append(station_ids.setdefault(station, len(station_ids)))
+        self._direction.append(DIRECTION_CODES.get(direction, DIRECTION_INVALID))
+        self._epoch.append(epoch)
+        self._day.append(day)
+        self._month.append(month)
+
+    def build(self) -> JourneyColumns:
+        return JourneyColumns(
+            users=list(self._user_ids),
+            stations=list(self._station_ids),
+            user_idx=np.frombuffer(self._user_idx, dtype=np.int32),
+            station_idx=np.frombuffer(self._station_idx, dtype=np.int32),
+            direction=np.frombuffer(self._direction, dtype=np.int8),
+            epoch=np.frombuffer(self._epoch, dtype=np.int64),
+            day=np.frombuffer(self._day, dtype=np.int32),
+            month=np.frombuffer(self._month, dtype=np.int32),
+        )
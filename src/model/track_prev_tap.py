@@ -1,17 +1,32 @@
-from datetime import time, datetime
+from datetime import datetime
+from typing import Union
+
+from src.util.timestamp_parser import day_key, month_key
 
 
 # TrackPrevInTap a data class of a user's entry tap at a station with the timestamp
 class TrackPrevInTap:
 
-    def __init__(self, transaction_time: datetime, station: str):
+    def __init__(self, transaction_time: Union[int, datetime], station: str):
         self.transaction_time = transaction_time
         self.station = station
+        self.day = day_key(transaction_time)
 
 
 # TimeCap is the time cap for a journey including the time of activity and bill cost
 class TimeCap:
 
-    def __init__(self, active_time: datetime, bill_cost: float):
+    def __init__(self, active_time: Union[int, datetime], bill_cost: float):
         self.active_time = active_time
         self.bill_cost = bill_cost
+
+    @property
+    def active_time(self) -> Union[int, datetime]:
+        return self._active_time
+
+    @active_time.setter
+    def active_time(self, value: Union[int, datetime]):
+        # Keep the integer day and month keys in step with the activity time
+        self._active_time = value
+        self.day = day_key(value)
+        self.month = month_key(value)
@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Optional, Union
+
+
+# UserState is the single per-rider record: running bill, daily and monthly cap counters and the open journey
+class UserState:
+    __slots__ = ("user_id", "bill",
+                 "day_cost", "day_key", "day_time",
+                 "month_cost", "month_key", "month_time",
+                 "in_station", "in_time", "in_day")
+
+    def __init__(self, user_id: str, event_time: Union[int, datetime], day: int, month: int):
+        self.user_id = user_id
+        self.bill = 0.0
+        # Daily and monthly cap counters keyed by integer day ordinal and month key. Billing only compares the keys;
+        # day_time and month_time keep the reset time for the active_time of the cap views and the state checkpoint
+        self.day_cost = 0.0
+        self.day_key = day
+        self.day_time = event_time
+        self.month_cost = 0.0
+        self.month_key = month
+        self.month_time = event_time
+        # Open journey; in_station is None when the user has no active IN tap. in_time is kept for the ledger
+        self.in_station: Optional[str] = None
+        self.in_time: Union[int, datetime, None] = None
+        self.in_day = 0
@@ -0,0 +1,67 @@
+import heapq
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from src.journey import event_fields
+from src.model.journey import Journey
+from src.util.reject_sink import RejectSink, current_sink, LATE_EVENT
+
+
+class ReorderBuffer:
+    """Restores timestamp order to a feed whose taps can arrive up to lateness_seconds late.
+
+    The watermark trails the latest tap seen by the lateness window. Taps are held in a heap and released in
+    timestamp order once the watermark passes them, so only the taps inside the window are held in memory. Taps with
+    the same timestamp keep their arrival order. A tap older than a tap already released is too late to be put back
+    in order: it is reported to the reject sink and dropped. Late taps go to sink when one is given, otherwise to the
+    sink installed when they arrive.
+    """
+
+    def __init__(self, lateness_seconds: int, sink: RejectSink = None):
+        if lateness_seconds < 0:
+            raise ValueError(f"Lateness window must not be negative, got {lateness_seconds}")
+        self.lateness_seconds = lateness_seconds
+        self.sink = sink
+        self._heap: List[Tuple[int, int, Journey]] = []
+        self._arrivals = 0
+        self._latest: Optional[int] = None
+        self._released: Optional[int] = None
+        self.late_events = 0
+        self.max_held = 0
+
+    def push(self, journey: Journey) -> List[Journey]:
+        """Add a tap; returns the taps the watermark has passed, in timestamp order"""
+        if self._released is not None and journey.epoch < self._released:
+            self.late_events += 1
+            (self.sink or current_sink()).reject(LATE_EVENT, fields=event_fields(journey), user=journey.userId,
+                                                 epoch=journey.epoch, lateness=self.lateness_seconds)
+            return []
+
+        heapq.heappush(self._heap, (journey.epoch, self._arrivals, journey))
+        self._arrivals += 1
+        if len(self._heap) > self.max_held:
+            self.max_held = len(self._heap)
+        if self._latest is None or journey.epoch > self._latest:
+            self._latest = journey.epoch
+        return self._release(self._latest - self.lateness_seconds)
+
+    def drain(self) -> List[Journey]:
+        """Release every held tap, e.g. at the end of the input or of the day"""
+        return self._release(None)
+
+    def reorder(self, journeys: Iterable[Journey]) -> Iterator[Journey]:
+        """Reorder a whole feed lazily, so it can stand in front of JourneyManager.calculate"""
+        for journey in journeys:
+            yield from self.push(journey)
+        yield from self.drain()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _release(self, watermark: Optional[int]) -> List[Journey]:
+        heap = self._heap
+        released = []
+        while heap and (watermark is None or heap[0][0] <= watermark):
+            released.append(heapq.heappop(heap)[2])
+        if released:
+            self._released = released[-1].epoch
+        return released
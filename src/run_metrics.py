@@ -0,0 +1,55 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from src.util.memory_usage import peak_rss_mb, reset_peak_rss
+
+
+class RunMetrics:
+    """Per-stage wall time, CPU time and peak memory of a billing run, plus its counters, summarised as JSON.
+
+    Stages are timed with a clock read on entry and exit only, so the metrics are cheap enough to leave on for every
+    run. Peak memory is per stage where the high-water mark can be reset (Linux), otherwise it is the process peak
+    at the end of the stage.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, Optional[int]] = {}
+        self.per_stage_peaks = True
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self.per_stage_peaks = reset_peak_rss() and self.per_stage_peaks
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.stages[name] = {
+                "wall_seconds": time.perf_counter() - wall_start,
+                "cpu_seconds": time.process_time() - cpu_start,
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+
+    def count(self, **counters: Optional[int]):
+        self.counters.update(counters)
+
+    def summary(self) -> dict:
+        return {
+            "stages": self.stages,
+            "total_wall_seconds": sum(stage["wall_seconds"] for stage in self.stages.values()),
+            "peak_rss_scope": "stage" if self.per_stage_peaks else "process",
+            "counters": self.counters,
+        }
+
+    def write_json(self, path: str):
+        """Write the summary to path, or to stdout for "-" """
+        summary = json.dumps(self.summary(), indent=2)
+        if path == "-":
+            sys.stdout.write(summary + "\n")
+            return
+        with open(path, 'w') as file:
+            file.write(summary + "\n")
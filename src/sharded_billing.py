@@ -0,0 +1,85 @@
+import heapq
+import multiprocessing
+import zlib
+from typing import Dict, List, Mapping, Tuple
+
+import numpy as np
+
+from src.billing_manager import BillingManager
+from src.journey import JourneyManager
+from src.model.billing_stats import BillingStats
+from src.model.journey_columns import JourneyColumns
+from src.util.reject_sink import RejectSink, RejectRecord, current_sink, use_sink
+
+
+def shard_of(user_id: str, shard_count: int) -> int:
+    """Stable shard number for a user id; the same in every process, unlike hash()"""
+    return zlib.crc32(user_id.encode()) % shard_count
+
+
+def partition_columns(columns: JourneyColumns, shard_count: int) -> List[Tuple[np.ndarray, JourneyColumns]]:
+    """Splits the taps into shards by user id, keeping file (timestamp) order within each shard.
+    Returns (positions in the input, shard columns) for every shard"""
+    user_shard = np.array([shard_of(user_id, shard_count) for user_id in columns.users], dtype=np.int32)
+    event_shard = user_shard[columns.user_idx]
+
+    shards = []
+    for shard in range(shard_count):
+        positions = np.flatnonzero(event_shard == shard)
+        shards.append((positions, columns.take(positions)))
+    return shards
+
+
+def bill_shard(zone_cost: Mapping[str, float], positions: np.ndarray, columns: JourneyColumns,
+               sink: RejectSink = None) -> Tuple[List[Tuple[int, str, float]], List[RejectRecord], Dict[str, int],
+                                                 Dict[str, int]]:
+    """Bills one shard with its own BillingManager and JourneyManager.
+    Returns (position of the user's first tap, user_id, bill) in order of first appearance, with the records and
+    counters of the shard's reject sink and the shard's billing counters"""
+    sink = sink or RejectSink()
+    billing_manager = BillingManager()
+    previous = use_sink(sink)
+    try:
+        bills = JourneyManager(billing_manager, zone_cost).calculate(columns.iter_journeys())
+    finally:
+        use_sink(previous)
+
+    # Users are interned in order of first appearance, so the first tap of each user is easy to find
+    first_tap = np.full(len(columns.users), len(columns), dtype=np.int64)
+    np.minimum.at(first_tap, columns.user_idx, np.arange(len(columns)))
+    first_position = dict(zip(columns.users, positions[first_tap].tolist()))
+
+    records, counts = sink.drain()
+    return ([(first_position[user_id], user_id, bill) for user_id, bill in bills.items()], records, counts,
+            billing_manager.stats.as_dict())
+
+
+class ShardedBilling:
+    """Bills a journey file across worker processes, one shard of users per process"""
+
+    def __init__(self, zone_cost: Mapping[str, float], workers: int):
+        if workers < 1:
+            raise ValueError(f"Number of workers must be at least 1, got {workers}")
+        self.zone_cost = zone_cost
+        self.workers = workers
+        # Billing counters summed over the shards
+        self.stats = BillingStats()
+
+    def calculate(self, columns: JourneyColumns) -> Dict[str, float]:
+        """Partition the taps by user, bill every shard in parallel and merge the per-shard bills"""
+        shards = partition_columns(columns, self.workers)
+        sink = current_sink()
+        # Workers report to a sink of their own; buffered records must not be inherited by forked processes
+        sink.flush()
+        worker_sink = sink.worker_sink()
+
+        with multiprocessing.Pool(processes=self.workers) as pool:
+            results = pool.starmap(bill_shard, [(self.zone_cost, positions, shard, worker_sink)
+                                                for positions, shard in shards])
+
+        for _, records, counts, stats in results:
+            sink.merge(records, counts)
+            self.stats.merge(stats)
+
+        # Merge in order of first appearance so the result matches a single-process run
+        return {user_id: bill for _, user_id, bill in heapq.merge(*(bills for bills, _, _, _ in results))}
@@ -0,0 +1,124 @@
+import os
+import struct
+from array import array
+from datetime import datetime
+from typing import BinaryIO, List, Union
+
+from src.billing_manager import BillingManager
+from src.model.user_state import UserState
+from src.util.timestamp_parser import EPOCH
+
+MAGIC = b"MTBS"
+VERSION = 1
+# magic, version, number of users
+HEADER = struct.Struct("<4sHQ")
+# number of users in the block, byte length of the user id and station blobs
+BLOCK_HEADER = struct.Struct("<III")
+
+
+def _to_epoch(event_time: Union[int, datetime, None]) -> int:
+    if event_time is None:
+        return 0
+    if isinstance(event_time, datetime):
+        return int((event_time - EPOCH).total_seconds())
+    return event_time
+
+
+class StateCheckpoint:
+    """Saves and restores BillingManager state (bills, open journeys, daily and monthly cap counters) in a compact
+    binary file, so a run can continue where the previous one stopped. Users are written in fixed-size blocks of
+    packed arrays to keep memory bounded"""
+
+    def __init__(self, block_size: int = 65536):
+        self.block_size = block_size
+
+    def save(self, billing_manager: BillingManager, path: str):
+        """Write the state to path; the file is replaced atomically"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(billing_manager.users)))
+
+            block: List[UserState] = []
+            for record in billing_manager.users.records():
+                block.append(record)
+                if len(block) == self.block_size:
+                    self._write_block(file, block)
+                    block = []
+            if block:
+                self._write_block(file, block)
+
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> BillingManager:
+        """Read a state file written by save into a new BillingManager"""
+        billing_manager = BillingManager()
+        with open(path, 'rb') as file:
+            magic, version, count = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Not a billing state file: {path}")
+
+            loaded = 0
+            while loaded < count:
+                loaded += self._read_block(file, billing_manager)
+
+        return billing_manager
+
+    def _write_block(self, file: BinaryIO, block: List[UserState]):
+        user_ids = [record.user_id.encode() for record in block]
+        stations = [(record.in_station or "").encode() for record in block]
+        user_blob = b"".join(user_ids)
+        station_blob = b"".join(stations)
+
+        file.write(BLOCK_HEADER.pack(len(block), len(user_blob), len(station_blob)))
+        columns = (
+            array("I", [len(user_id) for user_id in user_ids]),
+            array("d", [record.bill for record in block]),
+            array("d", [record.day_cost for record in block]),
+            array("i", [record.day_key for record in block]),
+            array("q", [_to_epoch(record.day_time) for record in block]),
+            array("d", [record.month_cost for record in block]),
+            array("i", [record.month_key for record in block]),
+            array("q", [_to_epoch(record.month_time) for record in block]),
+            # Station length is -1 for users without an open journey
+            array("i", [-1 if record.in_station is None else len(station) for record, station in zip(block, stations)]),
+            array("q", [_to_epoch(record.in_time) for record in block]),
+            array("i", [record.in_day for record in block]),
+        )
+        for column in columns:
+            file.write(column.tobytes())
+        file.write(user_blob)
+        file.write(station_blob)
+
+    def _read_block(self, file: BinaryIO, billing_manager: BillingManager) -> int:
+        size, user_blob_size, station_blob_size = BLOCK_HEADER.unpack(file.read(BLOCK_HEADER.size))
+
+        def column(typecode: str) -> list:
+            values = array(typecode)
+            values.frombytes(file.read(values.itemsize * size))
+            return values.tolist()
+
+        user_lengths = column("I")
+        bills, day_costs, day_keys, day_times = column("d"), column("d"), column("i"), column("q")
+        month_costs, month_keys, month_times = column("d"), column("i"), column("q")
+        station_lengths, in_times, in_days = column("i"), column("q"), column("i")
+        user_blob = file.read(user_blob_size)
+        station_blob = file.read(station_blob_size)
+
+        users = billing_manager.users
+        user_offset = station_offset = 0
+        for i in range(size):
+            user_id = user_blob[user_offset:user_offset + user_lengths[i]].decode()
+            user_offset += user_lengths[i]
+
+            record = users.add(user_id, day_times[i], day_keys[i], month_keys[i])
+            record.bill = bills[i]
+            record.day_cost = day_costs[i]
+            record.month_cost = month_costs[i]
+            record.month_time = month_times[i]
+
+            if station_lengths[i] >= 0:
+                station = station_blob[station_offset:station_offset + station_lengths[i]].decode()
+                station_offset += station_lengths[i]
+                users.open_journey(record, station, in_times[i], in_days[i])
+
+        return size
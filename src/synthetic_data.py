@@ -0,0 +1,151 @@
+import argparse
+import csv
+import math
+import os
+import random
+from datetime import date, timedelta
+from typing import List, Tuple
+
+from src.util.constans import DAILY_CAP, TRIP_CHARGES
+
+# Service hours in seconds after midnight; every journey is completed before midnight as the README assumes
+FIRST_TAP = 5 * 3600
+LAST_TAP = 23 * 3600 + 59 * 60
+
+# (seconds after midnight, user_id, station, direction) for one day
+DayEvent = Tuple[int, str, str, str]
+
+
+class JourneyGenerator:
+    """Writes synthetic zone maps and timestamp-sorted journey files at any scale, reproducibly for a given seed.
+
+    - users, stations, days, zones: size of the network and of the period covered
+    - journeys_per_day: journeys started each day by riders picked at random from the users
+    - missing_tap_rate: share of journeys that lose their IN or their OUT tap and so cost a penalty
+    - cap_hit_rate: share of riders each day who ride often enough to hit the daily cap. They come from a small pool
+      of frequent riders, so over a few weeks the same riders also reach the monthly cap
+
+    Journeys are generated and sorted one day at a time, so memory is bounded by a single day of taps.
+    """
+
+    def __init__(self, users: int = 1000, stations: int = 100, days: int = 1, zones: int = 6,
+                 journeys_per_day: int = None, missing_tap_rate: float = 0.02, cap_hit_rate: float = 0.05,
+                 start_date: date = date(2022, 4, 4), seed: int = 0):
+        if users < 1 or stations < 1 or days < 1 or zones < 1:
+            raise ValueError("Users, stations, days and zones must be at least 1")
+        if not 0.0 <= missing_tap_rate <= 1.0 or not 0.0 <= cap_hit_rate <= 1.0:
+            raise ValueError("Missing tap and cap hit rates must be between 0 and 1")
+
+        self.users = users
+        self.stations = stations
+        self.days = days
+        self.zones = zones
+        self.journeys_per_day = users if journeys_per_day is None else journeys_per_day
+        self.missing_tap_rate = missing_tap_rate
+        self.cap_hit_rate = cap_hit_rate
+        self.start_date = start_date
+        self.seed = seed
+        # Enough trips to pass the daily cap even when every trip is the cheapest one
+        self.capped_trips = math.ceil(DAILY_CAP / TRIP_CHARGES) + 1
+        self.frequent_riders = max(1, int(users * cap_hit_rate))
+
+    def station_name(self, station: int) -> str:
+        return f"station_{station}"
+
+    def user_name(self, user: int) -> str:
+        return f"user_{user}"
+
+    def write_zone_map(self, path: str) -> int:
+        """Write the zone map CSV; returns the number of stations"""
+        rng = random.Random(self.seed)
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['station', 'zone'])
+            writer.writerows([self.station_name(station), rng.randint(1, self.zones)]
+                             for station in range(self.stations))
+        return self.stations
+
+    def write_journeys(self, path: str) -> int:
+        """Write the journey CSV sorted by timestamp; returns the number of taps written"""
+        rng = random.Random(self.seed + 1)
+        rows = 0
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['user_id', 'station', 'direction', 'time'])
+            for day in range(self.days):
+                current = (self.start_date + timedelta(days=day)).isoformat()
+                events = self._day_events(rng)
+                events.sort(key=lambda event: event[0])
+                writer.writerows([user_id, station, direction,
+                                  f"{current}T{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"]
+                                 for seconds, user_id, station, direction in events)
+                rows += len(events)
+        return rows
+
+    def generate(self, output_dir: str) -> Tuple[str, str]:
+        """Write zone_map.csv and journey_data.csv into output_dir; returns their paths"""
+        os.makedirs(output_dir, exist_ok=True)
+        zone_path = os.path.join(output_dir, "zone_map.csv")
+        journey_path = os.path.join(output_dir, "journey_data.csv")
+        self.write_zone_map(zone_path)
+        self.write_journeys(journey_path)
+        return zone_path, journey_path
+
+    def _day_events(self, rng: random.Random) -> List[DayEvent]:
+        events: List[DayEvent] = []
+        for _ in range(self.journeys_per_day):
+            if rng.random() < self.cap_hit_rate:
+                # A frequent rider with back to back trips from early morning
+                user_id = self.user_name(rng.randrange(self.frequent_riders))
+                start = FIRST_TAP + rng.randrange(3600)
+                for _ in range(self.capped_trips):
+                    start = self._add_journey(events, rng, user_id, start, rng.randint(10, 50)) + rng.randint(5, 30) * 60
+            else:
+                user_id = self.user_name(rng.randrange(self.users))
+                self._add_journey(events, rng, user_id, rng.randint(FIRST_TAP, LAST_TAP - 3600), rng.randint(5, 60))
+        return events
+
+    def _add_journey(self, events: List[DayEvent], rng: random.Random, user_id: str, start: int,
+                     minutes: int) -> int:
+        """Append the taps of one journey; returns the time of the OUT tap"""
+        start = min(start, LAST_TAP - 60)
+        end = min(start + minutes * 60 + rng.randrange(60), LAST_TAP)
+        in_station = self.station_name(rng.randrange(self.stations))
+        out_station = self.station_name(rng.randrange(self.stations))
+
+        if rng.random() < self.missing_tap_rate:
+            # Lose one of the two taps at random
+            if rng.random() < 0.5:
+                events.append((start, user_id, in_station, "IN"))
+            else:
+                events.append((end, user_id, out_station, "OUT"))
+        else:
+            events.append((start, user_id, in_station, "IN"))
+            events.append((end, user_id, out_station, "OUT"))
+        return end
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic zone map and journey file.")
+    parser.add_argument("output_dir", type=str, help="Directory to write zone_map.csv and journey_data.csv to")
+    parser.add_argument("--users", type=int, default=1000, help="Number of distinct users riders are drawn from")
+    parser.add_argument("--stations", type=int, default=100, help="Number of stations in the zone map")
+    parser.add_argument("--days", type=int, default=1, help="Number of days of journeys")
+    parser.add_argument("--zones", type=int, default=6, help="Number of zones stations are spread over")
+    parser.add_argument("--journeys-per-day", type=int, default=None,
+                        help="Journeys started each day (defaults to the number of users)")
+    parser.add_argument("--missing-tap-rate", type=float, default=0.02,
+                        help="Share of journeys missing their IN or OUT tap")
+    parser.add_argument("--cap-hit-rate", type=float, default=0.05,
+                        help="Share of riders each day who ride enough to hit the daily cap")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives the same files")
+    args = parser.parse_args()
+
+    generator = JourneyGenerator(args.users, args.stations, args.days, args.zones, args.journeys_per_day,
+                                 args.missing_tap_rate, args.cap_hit_rate, seed=args.seed)
+    zone_path, journey_path = generator.generate(args.output_dir)
+    print(f"Wrote {zone_path} and {journey_path}")
+
+
+if __name__ == "__main__":
+    main()
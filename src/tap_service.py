@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import json
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from src.billing_manager import BillingManager
+from src.csv.bulk_csv_writer import BulkCSVWriter
+from src.journey import JourneyManager
+from src.model.journey import Journey
+from src.reorder_buffer import ReorderBuffer
+from src.tariff import FareTable
+from src.util.reject_sink import RejectSink, use_sink, BAD_EVENT, BAD_TIMESTAMP, INVALID_DIRECTION, UNKNOWN_STATION, \
+    INTERNAL_ERROR
+
+# Longest request line accepted, so large batches fit in one message
+MAX_LINE_BYTES = 16 * 1024 * 1024
+EVENT_FIELDS = ("user_id", "station", "direction", "time")
+
+
+class TapService:
+    """Long-lived online billing over a local socket.
+
+    Clients send one JSON object per line and get one JSON object back per line:
+
+    - {"op": "tap", "user_id": ..., "station": ..., "direction": "IN" | "OUT", "time": "2022-04-04T9:40:00"}
+    - {"op": "taps", "events": [{...}, ...]} for a batch of taps
+    - {"op": "bill", "user_id": ...} for the user's running bill
+    - {"op": "close_day", "output_path": optional} to penalise open journeys and write the bills
+
+    Accepted taps go into a bounded queue and a single billing task feeds them to JourneyManager in batches. When
+    the queue is full, connections stop reading until it drains, which pushes back on the clients. Taps are billed in
+    arrival order, so clients are expected to send them in timestamp order unless reorder_window is set. Then taps up
+    to that many seconds late are put back in order first and later ones are rejected. A bill query waits until
+    every tap accepted before it has been billed, so a client always sees its own taps, except those still held in
+    the reorder window.
+    """
+
+    def __init__(self, zone_cost: Mapping[str, float], output_path: str = None, billing_manager: BillingManager = None,
+                 max_queued_batches: int = 1024, batch_size: int = 1000, reorder_window: int = None):
+        self.zone_cost = zone_cost
+        self.output_path = output_path
+        self.billing_manager = billing_manager or BillingManager()
+        self.journey_manager = JourneyManager(self.billing_manager, zone_cost)
+        self.max_queued_batches = max_queued_batches
+        self.batch_size = batch_size
+        # Rejected taps are answered to the client; the sink keeps per-reason counts, including those of late taps
+        # and of events rejected while billing
+        self.reject_sink = RejectSink(count_only=True)
+        self.reorder_buffer = ReorderBuffer(reorder_window, self.reject_sink) if reorder_window is not None else None
+        self._queue: Optional[asyncio.Queue] = None
+        self._billed: Optional[asyncio.Condition] = None
+        # Taps accepted and taps billed so far; queries wait for billed to catch up with accepted
+        self._accepted_count = 0
+        self._billed_count = 0
+        self._biller: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0, unix_path: str = None) -> "TapService":
+        """Start the billing task and listen on a TCP port (0 picks a free one) or a Unix socket"""
+        self.start_billing()
+        if unix_path:
+            self._server = await asyncio.start_unix_server(self._handle_client, unix_path, limit=MAX_LINE_BYTES)
+        else:
+            self._server = await asyncio.start_server(self._handle_client, host, port, limit=MAX_LINE_BYTES)
+        return self
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()
+
+    def start_billing(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queued_batches)
+        self._billed = asyncio.Condition()
+        self._biller = asyncio.create_task(self._bill_batches())
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        """Stop listening, bill the taps still queued and stop the billing task"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self._wait_until_billed(self._accepted_count)
+        self._biller.cancel()
+
+    async def submit(self, events: List[dict]) -> Tuple[int, List[dict]]:
+        """Validate and queue taps; waits while the queue is full. Returns the number accepted and the rejected ones
+        with their reason"""
+        journeys, rejected = [], []
+        for index, event in enumerate(events):
+            journey, reason, error = self._journey(event)
+            if journey is None:
+                rejected.append({"index": index, "reason": reason, "error": error})
+            else:
+                journeys.append(journey)
+
+        if journeys:
+            await self._queue.put(journeys)
+            self._accepted_count += len(journeys)
+        return len(journeys), rejected
+
+    async def bill(self, user_id: str) -> Optional[float]:
+        """Running bill of a user, or None for a user without taps"""
+        await self._wait_until_billed(self._accepted_count)
+        record = self.billing_manager.users.get(user_id)
+        return None if record is None else record.bill
+
+    async def close_day(self, output_path: str = None) -> int:
+        """Penalise journeys still open, as at the end of a batch run, and write the bills sorted by user id.
+        Returns the number of users written"""
+        await self._wait_until_billed(self._accepted_count)
+        previous_sink = use_sink(self.reject_sink)
+        try:
+            if self.reorder_buffer is not None:
+                self.journey_manager.calculate(self.reorder_buffer.drain(), finalize=False)
+            self.journey_manager._handle_incomplete_journey()
+        finally:
+            use_sink(previous_sink)
+        # Journeys left open were penalised; they must not be closed or penalised again on the next day
+        for record in list(self.billing_manager.users.open_journeys()):
+            self.billing_manager.users.close_journey(record)
+
+        output_path = output_path or self.output_path
+        bills = sorted(self.billing_manager.user_bill.items(), key=lambda x: x[0].lower())
+        if output_path and bills:
+            BulkCSVWriter(output_path).write_csv(bills, output_path)
+        return len(bills)
+
+    def _journey(self, event: dict) -> Tuple[Optional[Journey], Optional[str], Optional[str]]:
+        """Journey for a tap event, or None with the reason code and error message"""
+        sink = self.reject_sink
+        if not isinstance(event, dict) or any(not isinstance(event.get(field), str) for field in EVENT_FIELDS):
+            error = f"A tap needs string fields {', '.join(EVENT_FIELDS)}"
+            sink.reject(BAD_EVENT, error=error)
+            return None, BAD_EVENT, error
+        # Events have no row number; their fields go to the quarantine record instead
+        fields = [event[field] for field in EVENT_FIELDS]
+        try:
+            journey = Journey(event["user_id"], event["station"], event["direction"], event["time"])
+        except ValueError as ve:
+            sink.reject(BAD_TIMESTAMP, fields=fields)
+            return None, BAD_TIMESTAMP, str(ve)
+        if journey.direction not in ("IN", "OUT"):
+            sink.reject(INVALID_DIRECTION, fields=fields, user=journey.userId, direction=journey.direction,
+                        epoch=journey.epoch)
+            return None, INVALID_DIRECTION, f"Invalid direction '{journey.direction}'"
+        if journey.station not in self.zone_cost:
+            sink.reject(UNKNOWN_STATION, fields=fields, station=journey.station)
+            return None, UNKNOWN_STATION, f"Unknown station '{journey.station}'"
+        return journey, None, None
+
+    async def _bill_batches(self):
+        """Bill queued taps, taking as many waiting batches as fit in batch_size per JourneyManager call"""
+        while True:
+            journeys = await self._queue.get()
+            batches = 1
+            while len(journeys) < self.batch_size and not self._queue.empty():
+                journeys.extend(self._queue.get_nowait())
+                batches += 1
+
+            # Billing does not await, so the service sink is installed only while this batch is billed
+            previous_sink = use_sink(self.reject_sink)
+            try:
+                released = journeys
+                if self.reorder_buffer is not None:
+                    released = [journey for arrived in journeys for journey in self.reorder_buffer.push(arrived)]
+                # Open journeys stay pending until close_day
+                self.journey_manager.calculate(released, finalize=False)
+            except Exception as e:
+                self.reject_sink.reject(INTERNAL_ERROR,
+                                        message=f"An unexpected error occurred billing {len(journeys)} taps: {e}")
+            finally:
+                use_sink(previous_sink)
+            for _ in range(batches):
+                self._queue.task_done()
+
+            async with self._billed:
+                self._billed_count += len(journeys)
+                self._billed.notify_all()
+
+    async def _wait_until_billed(self, count: int):
+        async with self._billed:
+            await self._billed.wait_for(lambda: self._billed_count >= count)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._handle_request(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+            op = request.get("op")
+            if op == "tap":
+                accepted, rejected = await self.submit([request])
+                return {"ok": not rejected, **(rejected[0] if rejected else {})}
+            if op == "taps":
+                accepted, rejected = await self.submit(request.get("events") or [])
+                return {"ok": True, "accepted": accepted, "rejected": rejected}
+            if op == "bill":
+                return {"ok": True, "user_id": request.get("user_id"), "bill": await self.bill(request.get("user_id"))}
+            if op == "close_day":
+                return {"ok": True, "users": await self.close_day(request.get("output_path"))}
+            return {"ok": False, "error": f"Unknown op: {op}"}
+        except ValueError as ve:
+            return {"ok": False, "error": f"Invalid request: {ve}"}
+        except Exception as e:
+            return {"ok": False, "error": f"An unexpected error occurred: {e}"}
+
+
+class TapClient:
+    """Minimal client for TapService, one request at a time"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = None, unix_path: str = None) -> "TapClient":
+        if unix_path:
+            reader, writer = await asyncio.open_unix_connection(unix_path, limit=MAX_LINE_BYTES)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE_BYTES)
+        return cls(reader, writer)
+
+    async def request(self, request: dict) -> dict:
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def tap(self, user_id: str, station: str, direction: str, time: str) -> dict:
+        return await self.request({"op": "tap", "user_id": user_id, "station": station, "direction": direction,
+                                   "time": time})
+
+    async def taps(self, events: List[Dict[str, str]]) -> dict:
+        return await self.request({"op": "taps", "events": events})
+
+    async def bill(self, user_id: str) -> Optional[float]:
+        return (await self.request({"op": "bill", "user_id": user_id}))["bill"]
+
+    async def close_day(self, output_path: str = None) -> dict:
+        return await self.request({"op": "close_day", "output_path": output_path})
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def _serve(args):
+    service = TapService(FareTable.from_zone_map_csv(args.zone_path), args.output_path,
+                         max_queued_batches=args.max_queued_batches, batch_size=args.batch_size,
+                         reorder_window=args.reorder_window)
+    await service.start(args.host, args.port, args.unix_socket)
+    print(f"Listening on {args.unix_socket or service.address}")
+    await service.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve online billing of tap events over a local socket.")
+    parser.add_argument("zone_path", type=str, help="Path to the zone map CSV file")
+    parser.add_argument("output_path", type=str, help="Path the bills are written to when the day is closed")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument("--unix-socket", type=str, default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Most taps billed in one JourneyManager call")
+    parser.add_argument("--reorder-window", type=int, default=None,
+                        help="Put taps arriving up to this many seconds out of order back in timestamp order")
+    parser.add_argument("--max-queued-batches", type=int, default=1024,
+                        help="Queued requests before clients are made to wait")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import json
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Mapping, Optional
+
+import numpy as np
+
+from src.csv.data_processor import DataProcessor
+from src.util.constans import TRIP_CHARGES, PENALTY_CHARGES, DAILY_CAP, MONTHLY_CAP
+from src.util.zone_fee_calculator import additional_zone_fee
+from src.zone_index import ZoneIndex
+
+
+class FareTable(Mapping):
+    """Precomputed trip costs for every pair of zones.
+
+    Stations are interned to a small zone id once, and the cost of a trip is a single read from the zone pair table,
+    computed as TRIP_CHARGES + start fee + end fee exactly like JourneyManager._calculate_journey_cost. As a Mapping
+    it still answers station -> zone fee, so it can be used wherever a zone map is expected.
+    """
+
+    def __init__(self, zone_of: Callable[[str], int], zones: Iterable[int], stations: Collection[str]):
+        # zone_of returns a station's zone number and raises KeyError for unknown stations
+        self._zone_of = zone_of
+        self._stations = stations
+        self.zones: List[int] = sorted(set(zones))
+        self.fees: List[float] = [additional_zone_fee(zone) for zone in self.zones]
+        self._zone_ids: Dict[int, int] = {zone: zone_id for zone_id, zone in enumerate(self.zones)}
+        # Station -> zone id, filled as stations are resolved
+        self._station_zone_ids: Dict[str, int] = {}
+
+        self.matrix = np.array([[TRIP_CHARGES + start_fee + end_fee for end_fee in self.fees]
+                                for start_fee in self.fees], dtype=np.float64).reshape(len(self.zones), len(self.zones))
+        self._rows: List[List[float]] = self.matrix.tolist()
+
+    @classmethod
+    def from_zone_numbers(cls, zone_numbers: Dict[str, int]) -> "FareTable":
+        fare_table = cls(zone_numbers.__getitem__, zone_numbers.values(), zone_numbers)
+        for station in zone_numbers:
+            fare_table.zone_id(station)
+        return fare_table
+
+    @classmethod
+    def from_zone_map_csv(cls, zone_path: str) -> "FareTable":
+        return cls.from_zone_numbers(DataProcessor.read_zone_numbers_from_csv(zone_path))
+
+    @classmethod
+    def from_zone_index(cls, zone_index: ZoneIndex) -> "FareTable":
+        """Stations are resolved against the memory-mapped index on first use, so no dictionary of the whole
+        network is built"""
+        return cls(zone_index.zone_of, zone_index.distinct_zones(), zone_index)
+
+    def zone_id(self, station: str) -> int:
+        """Interned zone id of a station; raises KeyError for unknown stations"""
+        zone_id = self._station_zone_ids.get(station)
+        if zone_id is None:
+            zone_id = self._zone_ids[self._zone_of(station)]
+            self._station_zone_ids[station] = zone_id
+        return zone_id
+
+    def zone_ids(self, stations: List[str]) -> np.ndarray:
+        """Zone ids for a list of stations; raises KeyError if any station is unknown"""
+        return np.array([self.zone_id(station) for station in stations], dtype=np.int32)
+
+    def cost(self, start_zone_id: int, end_zone_id: int) -> float:
+        return self._rows[start_zone_id][end_zone_id]
+
+    def trip_cost(self, start_station: str, end_station: str) -> float:
+        """Cost of a trip between two stations; raises KeyError for unknown stations"""
+        station_zone_ids = self._station_zone_ids
+        if start_station in station_zone_ids and end_station in station_zone_ids:
+            return self._rows[station_zone_ids[start_station]][station_zone_ids[end_station]]
+        return self._rows[self.zone_id(start_station)][self.zone_id(end_station)]
+
+    def batch_costs(self, start_zone_ids: np.ndarray, end_zone_ids: np.ndarray) -> np.ndarray:
+        """Costs of many trips at once, given arrays of zone ids"""
+        return self.matrix[start_zone_ids, end_zone_ids]
+
+    def __getitem__(self, station: str) -> float:
+        return self.fees[self.zone_id(station)]
+
+    def get(self, station: str, default: float = None) -> Optional[float]:
+        try:
+            return self[station]
+        except KeyError:
+            return default
+
+    def __contains__(self, station) -> bool:
+        try:
+            self.zone_id(station)
+            return True
+        except (KeyError, TypeError):
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._stations)
+
+    def __len__(self) -> int:
+        return len(self._stations)
+
+
+class Tariff:
+    """One set of fares for a what-if run: trip and penalty charges, daily and monthly caps and zone fees.
+
+    zone_fees maps zone numbers to the fee charged on entry and exit; zones it leaves out keep the fee of
+    additional_zone_fee. The defaults are the fares in src/util/constans.py.
+    """
+
+    def __init__(self, name: str, trip_charge: float = TRIP_CHARGES, penalty_charge: float = PENALTY_CHARGES,
+                 daily_cap: float = DAILY_CAP, monthly_cap: float = MONTHLY_CAP, zone_fees: Mapping[int, float] = None):
+        self.name = name
+        self.trip_charge = trip_charge
+        self.penalty_charge = penalty_charge
+        self.daily_cap = daily_cap
+        self.monthly_cap = monthly_cap
+        self.zone_fees: Dict[int, float] = dict(zone_fees or {})
+
+    def zone_fee(self, zone: int) -> float:
+        fee = self.zone_fees.get(zone)
+        return additional_zone_fee(zone) if fee is None else fee
+
+    @classmethod
+    def from_dict(cls, config: Mapping) -> "Tariff":
+        """A tariff from a JSON object; zone numbers may be given as strings, as JSON object keys are"""
+        return cls(config["name"], config.get("trip_charge", TRIP_CHARGES),
+                   config.get("penalty_charge", PENALTY_CHARGES), config.get("daily_cap", DAILY_CAP),
+                   config.get("monthly_cap", MONTHLY_CAP),
+                   {int(zone): fee for zone, fee in (config.get("zone_fees") or {}).items()})
+
+    @staticmethod
+    def load(path: str) -> List["Tariff"]:
+        """Tariffs from a JSON file holding a list of objects with a name and the values that differ"""
+        with open(path) as file:
+            tariffs = [Tariff.from_dict(config) for config in json.load(file)]
+        names = [tariff.name for tariff in tariffs]
+        if not tariffs or len(set(names)) != len(names):
+            raise ValueError(f"Tariff file needs at least one tariff and distinct names: {path}")
+        return tariffs
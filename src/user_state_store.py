@@ -0,0 +1,208 @@
+from datetime import datetime
+from typing import Dict, Iterator, MutableMapping, Optional, Union
+
+from src.model.track_prev_tap import TrackPrevInTap
+from src.model.user_state import UserState
+from src.util.timestamp_parser import day_key, month_key
+
+
+class UserStateStore:
+    """Holds one UserState record per rider, so each event costs a single hash lookup. Records with an open journey
+    are also kept apart, so they can be listed and counted without going over every rider"""
+
+    def __init__(self):
+        self._records: Dict[str, UserState] = {}
+        self._open: Dict[str, UserState] = {}
+
+    def get(self, user_id: str) -> Optional[UserState]:
+        return self._records.get(user_id)
+
+    def add(self, user_id: str, event_time: Union[int, datetime], day: int = None, month: int = None) -> UserState:
+        """Creates the record for a new user, or resets the bill and caps of an existing one"""
+        if day is None:
+            day = day_key(event_time)
+        if month is None:
+            month = month_key(event_time)
+
+        record = self._records.get(user_id)
+        if record is None:
+            record = UserState(user_id, event_time, day, month)
+            self._records[user_id] = record
+        else:
+            record.bill = 0.0
+            record.day_cost, record.day_key, record.day_time = 0.0, day, event_time
+            record.month_cost, record.month_key, record.month_time = 0.0, month, event_time
+        return record
+
+    def remove(self, user_id: str):
+        del self._records[user_id]
+        self._open.pop(user_id, None)
+
+    def records(self) -> Iterator[UserState]:
+        return iter(self._records.values())
+
+    def open_journey(self, record: UserState, station: str, event_time: Union[int, datetime], day: int):
+        """Records an IN tap as the open journey of a user, replacing any open one"""
+        record.in_station, record.in_time, record.in_day = station, event_time, day
+        self._open[record.user_id] = record
+
+    def close_journey(self, record: UserState):
+        """Clears the open journey of a user"""
+        record.in_station, record.in_time = None, None
+        self._open.pop(record.user_id, None)
+
+    def open_journeys(self) -> Iterator[UserState]:
+        """Records of users with an IN tap that has not been closed, in the order the journeys were opened"""
+        return iter(self._open.values())
+
+    def open_journey_count(self) -> int:
+        return len(self._open)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._records
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+# The views below expose the store through the dictionaries BillingManager used to keep
+
+class BillView(MutableMapping):
+    """user_id -> running bill"""
+
+    def __init__(self, store: UserStateStore):
+        self._store = store
+
+    def __getitem__(self, user_id: str) -> float:
+        record = self._store.get(user_id)
+        if record is None:
+            raise KeyError(user_id)
+        return record.bill
+
+    def __setitem__(self, user_id: str, bill: float):
+        record = self._store.get(user_id)
+        if record is None:
+            raise KeyError(f"User {user_id} not initialized.")
+        record.bill = bill
+
+    def __delitem__(self, user_id: str):
+        if user_id not in self._store:
+            raise KeyError(user_id)
+        self._store.remove(user_id)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._store
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+class CapRecord:
+    """Live TimeCap-style view of the daily or monthly counter of one record"""
+    __slots__ = ("_record", "_daily")
+
+    def __init__(self, record: UserState, daily: bool):
+        self._record = record
+        self._daily = daily
+
+    @property
+    def bill_cost(self) -> float:
+        return self._record.day_cost if self._daily else self._record.month_cost
+
+    @bill_cost.setter
+    def bill_cost(self, value: float):
+        if self._daily:
+            self._record.day_cost = value
+        else:
+            self._record.month_cost = value
+
+    @property
+    def active_time(self) -> Union[int, datetime]:
+        return self._record.day_time if self._daily else self._record.month_time
+
+    @active_time.setter
+    def active_time(self, value: Union[int, datetime]):
+        if self._daily:
+            self._record.day_time, self._record.day_key = value, day_key(value)
+        else:
+            self._record.month_time, self._record.month_key = value, month_key(value)
+
+    @property
+    def day(self) -> int:
+        return self._record.day_key
+
+    @property
+    def month(self) -> int:
+        return self._record.month_key
+
+
+class CapView(MutableMapping):
+    """user_id -> CapRecord for either the daily or the monthly cap"""
+
+    def __init__(self, store: UserStateStore, daily: bool):
+        self._store = store
+        self._daily = daily
+
+    def __getitem__(self, user_id: str) -> CapRecord:
+        record = self._store.get(user_id)
+        if record is None:
+            raise KeyError(user_id)
+        return CapRecord(record, self._daily)
+
+    def __setitem__(self, user_id: str, cap):
+        view = self[user_id]
+        view.active_time = cap.active_time
+        view.bill_cost = cap.bill_cost
+
+    def __delitem__(self, user_id: str):
+        raise TypeError("Cap counters are removed together with the user")
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._store
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+class ActiveJourneyView(MutableMapping):
+    """user_id -> TrackPrevInTap for users with an open journey"""
+
+    def __init__(self, store: UserStateStore):
+        self._store = store
+
+    def __getitem__(self, user_id: str) -> TrackPrevInTap:
+        record = self._store.get(user_id)
+        if record is None or record.in_station is None:
+            raise KeyError(user_id)
+        return TrackPrevInTap(record.in_time, record.in_station)
+
+    def __setitem__(self, user_id: str, tap: TrackPrevInTap):
+        record = self._store.get(user_id)
+        if record is None:
+            raise KeyError(f"User {user_id} not initialized.")
+        self._store.open_journey(record, tap.station, tap.transaction_time, tap.day)
+
+    def __delitem__(self, user_id: str):
+        record = self._store.get(user_id)
+        if record is None or record.in_station is None:
+            raise KeyError(user_id)
+        self._store.close_journey(record)
+
+    def __contains__(self, user_id) -> bool:
+        record = self._store.get(user_id)
+        return record is not None and record.in_station is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (record.user_id for record in self._store.open_journeys())
+
+    def __len__(self) -> int:
+        return self._store.open_journey_count()
@@ -0,0 +1,27 @@
+import resource
+import sys
+
+
+def reset_peak_rss() -> bool:
+    """Reset the process high-water mark so the next reading covers what ran since. Linux only; returns False
+    where the peak cannot be reset"""
+    try:
+        with open("/proc/self/clear_refs", 'w') as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in megabytes"""
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
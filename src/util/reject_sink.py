@@ -0,0 +1,179 @@
+import csv
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.util.timestamp_parser import as_datetime
+
+# Reason codes for rejected rows and events
+BAD_FIELD_COUNT = "bad_field_count"
+BAD_TIMESTAMP = "bad_timestamp"
+BAD_ZONE = "bad_zone"
+UNKNOWN_STATION = "unknown_station"
+UNEXPECTED_ROW = "unexpected_row_error"
+INVALID_DIRECTION = "invalid_direction"
+UNKNOWN_USER = "unknown_user"
+JOURNEY_COST = "journey_cost_error"
+INTERNAL_ERROR = "internal_error"
+LATE_EVENT = "late_event"
+BAD_EVENT = "bad_event"
+
+# Messages are only built from these templates when something will read them
+TEMPLATES = {
+    BAD_FIELD_COUNT: "Error processing row {row}: Row {row} has an incorrect number of fields: {count}",
+    BAD_TIMESTAMP: "Error processing row {row}: Invalid format for journey",
+    BAD_ZONE: "Error processing row {row}: {error}",
+    UNKNOWN_STATION: "Error processing row {row}: Unknown station '{station}'",
+    UNEXPECTED_ROW: "An unexpected error occurred at row {row}: {error}",
+    INVALID_DIRECTION: "Error processing transaction for user {user} at {time}: Invalid direction '{direction}' for "
+                       "user {user} at {time}",
+    UNKNOWN_USER: "'User {user} {problem}'",
+    JOURNEY_COST: "Error calculating journey cost from {start} to {end}: {error}",
+    INTERNAL_ERROR: "{message}",
+    BAD_EVENT: "Malformed tap event: {error}",
+    LATE_EVENT: "Late tap for user {user} at {time}: more than {lateness} seconds behind the latest tap",
+}
+
+QUARANTINE_HEADER = ["row", "reason", "message", "fields"]
+
+# (reason, row number, raw fields, details)
+RejectRecord = Tuple[str, Optional[int], Optional[Sequence[str]], Dict[str, object]]
+
+
+class RowRejected(ValueError):
+    """Raised by row validation with a reason code; the message is only formatted if it is asked for"""
+
+    def __init__(self, reason: str, row: int = None, **details):
+        super().__init__(reason)
+        self.reason = reason
+        self.row = row
+        self.details = details
+
+    def __str__(self) -> str:
+        return format_reject(self.reason, self.row, self.details)
+
+
+def format_reject(reason: str, row: Optional[int], details: Dict[str, object]) -> str:
+    values = dict(details)
+    values["row"] = row
+    if "epoch" in values:
+        values["time"] = as_datetime(values["epoch"])
+    return TEMPLATES[reason].format(**values)
+
+
+class RejectSink:
+    """Destination for rejected rows and events, replacing a print per error.
+
+    - echo: print each message to stdout as it happens, the historical behaviour (the default)
+    - quarantine_path: append records to a CSV quarantine file (row number, reason code, message, raw fields) in
+      batches of buffer_records
+    - count_only: keep the per-reason counters only; no message is ever formatted
+    - collect: keep records in memory until drain(), used to ship them from worker processes
+
+    Per-reason counters are kept in every mode. open() starts a run: it resets the counters and empties the
+    quarantine file; records after close() are appended to it. Rows rejected while parsing carry their row number and
+    raw fields. Events rejected while billing have no row number, since taps may come from columns, a journey log or
+    the tap service by then; their fields are those of the event instead (user, station, direction and time of a tap).
+    """
+
+    def __init__(self, quarantine_path: str = None, echo: bool = None, count_only: bool = False,
+                 collect: bool = False, buffer_records: int = 4096):
+        self.quarantine_path = quarantine_path
+        self.echo = (quarantine_path is None and not count_only and not collect) if echo is None else echo
+        self.count_only = count_only
+        self.collect = collect
+        self.buffer_records = buffer_records
+        self.counts: Dict[str, int] = {}
+        self._pending: List[RejectRecord] = []
+        self._file = None
+        self._writer = None
+        # Whether the quarantine file was emptied since the sink was created; until then it is left untouched
+        self._started = False
+
+    def open(self):
+        """Start a run: reset the counters and empty the quarantine file, leaving only its header"""
+        self.close()
+        self.counts = {}
+        self._pending = []
+        if self.quarantine_path:
+            self._open_file('w')
+
+    def reject(self, reason: str, row: int = None, fields: Sequence[str] = None, **details):
+        """Record a rejected row or event; details fill the message template of the reason"""
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        if self.count_only:
+            return
+
+        if self.echo:
+            print(format_reject(reason, row, details))
+        if self.quarantine_path or self.collect:
+            self._pending.append((reason, row, fields, details))
+            if self.quarantine_path and len(self._pending) >= self.buffer_records:
+                self.flush()
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def flush(self):
+        """Write buffered records to the quarantine file in one batch"""
+        if not self.quarantine_path or not self._pending:
+            return
+        if self._writer is None:
+            self._open_file('a' if self._started else 'w')
+        self._writer.writerows([row, reason, format_reject(reason, row, details), "|".join(fields or ())]
+                               for reason, row, fields, details in self._pending)
+        self._pending = []
+        self._file.flush()
+
+    def drain(self) -> Tuple[List[RejectRecord], Dict[str, int]]:
+        """Hand over collected records and counters, e.g. from a worker process to the parent's sink"""
+        records, counts = self._pending, self.counts
+        self._pending, self.counts = [], {}
+        return records, counts
+
+    def merge(self, records: List[RejectRecord], counts: Dict[str, int]):
+        """Take in records and counters drained from another sink"""
+        for reason, count in counts.items():
+            self.counts[reason] = self.counts.get(reason, 0) + count
+        if self.count_only:
+            return
+        for reason, row, fields, details in records:
+            if self.echo:
+                print(format_reject(reason, row, details))
+            if self.quarantine_path or self.collect:
+                self._pending.append((reason, row, fields, details))
+        if self.quarantine_path and len(self._pending) >= self.buffer_records:
+            self.flush()
+
+    def worker_sink(self) -> "RejectSink":
+        """A sink for a worker process that mirrors this one: echo prints directly, otherwise records are collected
+        for merge()"""
+        return RejectSink(echo=self.echo, count_only=self.count_only, collect=bool(self.quarantine_path))
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def _open_file(self, mode: str):
+        self._file = open(self.quarantine_path, mode, newline='')
+        self._writer = csv.writer(self._file)
+        if mode == 'w':
+            self._writer.writerow(QUARANTINE_HEADER)
+        self._started = True
+
+
+_current = RejectSink()
+
+
+def current_sink() -> RejectSink:
+    """The sink that DataProcessor, JourneyManager and BillingManager report to"""
+    return _current
+
+
+def use_sink(sink: RejectSink) -> RejectSink:
+    """Install a sink and return the previous one so it can be restored"""
+    global _current
+    previous, _current = _current, sink
+    return previous
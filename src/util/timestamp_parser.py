@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from typing import Dict, Tuple, Union
+
+# Naive feed timestamps are treated as UTC wall-clock time
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+SECONDS_PER_DAY = 86400
+
+
+class TimestampParser:
+    """Parses tap timestamps of the form YYYY-MM-DDTH:MM:SS (hours are not always zero padded) into integer epoch
+    seconds, a day ordinal and a month key. Date prefixes repeat for every tap of a day so they are cached"""
+
+    def __init__(self, max_cached_dates: int = 4096):
+        self.max_cached_dates = max_cached_dates
+        # Maps a date prefix to (epoch seconds at midnight, day ordinal, month key)
+        self._dates: Dict[str, Tuple[int, int, int]] = {}
+
+    def parse(self, text: str) -> Tuple[int, int, int]:
+        """Returns (epoch_seconds, day_ordinal, month_key) for a timestamp, raising ValueError if it is malformed"""
+        date_part, separator, time_part = text.partition("T")
+        if not separator:
+            raise ValueError(f"Invalid timestamp '{text}'")
+
+        day_info = self._dates.get(date_part)
+        if day_info is None:
+            day_info = self._parse_date(date_part)
+
+        fields = time_part.split(":")
+        if len(fields) != 3:
+            raise ValueError(f"Invalid timestamp '{text}'")
+        for field in fields:
+            if not (0 < len(field) <= 2 and field.isascii() and field.isdigit()):
+                raise ValueError(f"Invalid timestamp '{text}'")
+
+        hours, minutes, seconds = int(fields[0]), int(fields[1]), int(fields[2])
+        if hours > 23 or minutes > 59 or seconds > 59:
+            raise ValueError(f"Invalid timestamp '{text}'")
+
+        midnight, day, month = day_info
+        return midnight + hours * 3600 + minutes * 60 + seconds, day, month
+
+    def _parse_date(self, date_part: str) -> Tuple[int, int, int]:
+        parsed = datetime.strptime(date_part, "%Y-%m-%d")
+        day = parsed.toordinal()
+        day_info = ((day - EPOCH_ORDINAL) * SECONDS_PER_DAY, day, parsed.year * 12 + parsed.month - 1)
+
+        if len(self._dates) >= self.max_cached_dates:
+            self._dates.clear()
+        self._dates[date_part] = day_info
+        return day_info
+
+
+_default_parser = TimestampParser()
+
+
+def parse_timestamp(text: str) -> Tuple[int, int, int]:
+    """Parses a tap timestamp with the shared parser, see TimestampParser.parse"""
+    return _default_parser.parse(text)
+
+
+def day_key(event_time: Union[int, datetime]) -> int:
+    """Day ordinal of an event time given as epoch seconds or a datetime"""
+    if isinstance(event_time, datetime):
+        return event_time.toordinal()
+    return event_time // SECONDS_PER_DAY + EPOCH_ORDINAL
+
+
+def month_key(event_time: Union[int, datetime]) -> int:
+    """Month key (year * 12 + month - 1) of an event time given as epoch seconds or a datetime"""
+    moment = as_datetime(event_time)
+    return moment.year * 12 + moment.month - 1
+
+
+def as_datetime(event_time: Union[int, datetime]) -> datetime:
+    """Converts epoch seconds back to a naive datetime; datetimes are returned unchanged"""
+    if isinstance(event_time, datetime):
+        return event_time
+    return EPOCH + timedelta(seconds=event_time)
@@ -0,0 +1,167 @@
+import argparse
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, Iterator, Mapping, Optional, Set
+
+from src.csv.data_processor import DataProcessor
+from src.util.zone_fee_calculator import additional_zone_fee
+
+MAGIC = b"MTZI"
+VERSION = 2
+# magic, version, padding, number of stations and of distinct zones; keeps the arrays that follow 8-byte aligned
+HEADER = struct.Struct("<4sHHQQ")
+
+
+class ZoneIndex(Mapping):
+    """Read-only station -> zone fee mapping backed by a memory-mapped index file.
+
+    The file holds the stations sorted by name with their precomputed fee and zone, so opening it costs the same
+    whatever the size of the network and pages are only read when stations are looked up. A station's id is its
+    position in the sorted table. Layout after the header: distinct zones i64[z] in ascending order, fee f64[n], name
+    offsets u64[n + 1], zone i32[n], names.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        with open(index_path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, count, zone_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a zone index file: {index_path}")
+        if version != VERSION:
+            raise ValueError(f"Zone index {index_path} was written by another version; compile it again")
+
+        view = memoryview(self._mmap)
+        fees_start = HEADER.size + 8 * zone_count
+        self._distinct_zones = view[HEADER.size:fees_start].cast("q")
+        offsets_start = fees_start + 8 * count
+        zones_start = offsets_start + 8 * (count + 1)
+        self._names_start = zones_start + 4 * count
+        self._count = count
+        self._fees = view[fees_start:offsets_start].cast("d")
+        self._offsets = view[offsets_start:zones_start].cast("Q")
+        self._zones = view[zones_start:self._names_start].cast("i")
+        # Stations already looked up; bounded by the stations that actually appear in journeys
+        self._ids: Dict[str, int] = {}
+
+    @staticmethod
+    def is_index(path: str) -> bool:
+        """True if path is a compiled zone index rather than a CSV zone map"""
+        try:
+            with open(path, 'rb') as file:
+                return file.read(len(MAGIC)) == MAGIC
+        except OSError:
+            return False
+
+    @staticmethod
+    def compile(zone_path: str, index_path: str) -> int:
+        """Compile a zone map CSV into an index file; returns the number of stations"""
+        return ZoneIndex.write(DataProcessor.read_zone_numbers_from_csv(zone_path), index_path)
+
+    @staticmethod
+    def write(zone_numbers: Mapping[str, int], index_path: str) -> int:
+        """Write station -> zone numbers read from any zone map as an index file; returns the number of stations"""
+        stations = sorted((station.encode(), zone) for station, zone in zone_numbers.items())
+
+        offsets = array("Q", [0])
+        for name, _ in stations:
+            offsets.append(offsets[-1] + len(name))
+
+        # Stored so opening the index does not scan the zone of every station
+        distinct_zones = sorted({zone for _, zone in stations})
+
+        temp_path = f"{index_path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, 0, len(stations), len(distinct_zones)))
+            file.write(array("q", distinct_zones).tobytes())
+            file.write(array("d", [additional_zone_fee(zone) for _, zone in stations]).tobytes())
+            file.write(offsets.tobytes())
+            file.write(array("i", [zone for _, zone in stations]).tobytes())
+            file.write(b"".join(name for name, _ in stations))
+        os.replace(temp_path, index_path)
+        return len(stations)
+
+    def station_id(self, station: str) -> Optional[int]:
+        """Id of a station, or None if it is not in the index"""
+        station_id = self._ids.get(station)
+        if station_id is not None:
+            return station_id
+
+        # Binary search over the sorted names in the mapped file
+        target = station.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name_bytes(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._name_bytes(low) == target:
+            self._ids[station] = low
+            return low
+        return None
+
+    def station_name(self, station_id: int) -> str:
+        return self._name_bytes(station_id).decode()
+
+    def fee(self, station_id: int) -> float:
+        return self._fees[station_id]
+
+    def zone(self, station_id: int) -> int:
+        return self._zones[station_id]
+
+    def zone_of(self, station: str) -> int:
+        """Zone number of a station; raises KeyError for unknown stations"""
+        station_id = self.station_id(station)
+        if station_id is None:
+            raise KeyError(station)
+        return self._zones[station_id]
+
+    def distinct_zones(self) -> Set[int]:
+        """Zone numbers used by the stations, read from the header section rather than the zone of every station"""
+        return set(self._distinct_zones)
+
+    def _name_bytes(self, station_id: int) -> bytes:
+        start = self._names_start + self._offsets[station_id]
+        end = self._names_start + self._offsets[station_id + 1]
+        return self._mmap[start:end]
+
+    def __getitem__(self, station: str) -> float:
+        station_id = self.station_id(station)
+        if station_id is None:
+            raise KeyError(station)
+        return self._fees[station_id]
+
+    def get(self, station: str, default: float = None) -> Optional[float]:
+        station_id = self.station_id(station)
+        return default if station_id is None else self._fees[station_id]
+
+    def __contains__(self, station) -> bool:
+        return isinstance(station, str) and self.station_id(station) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.station_name(station_id) for station_id in range(self._count))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __reduce__(self):
+        # Worker processes reopen the same file and share its pages instead of receiving a pickled copy
+        return ZoneIndex, (self.index_path,)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a zone map CSV into a memory-mapped zone index.")
+    parser.add_argument("zone_path", type=str, help="Path to the zone map CSV file")
+    parser.add_argument("index_path", type=str, help="Path to write the zone index to")
+    args = parser.parse_args()
+
+    count = ZoneIndex.compile(args.zone_path, args.index_path)
+    print(f"Compiled {count} stations into {args.index_path}")
+
+
+if __name__ == "__main__":
+    main()
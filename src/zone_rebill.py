@@ -0,0 +1,337 @@
+import argparse
+import os
+import sys
+import tempfile
+from typing import Dict, List, Mapping, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from src.billing_manager import BillingManager
+from src.columnar_billing import ColumnarBillingEngine
+from src.csv.csv_reader import CSVReader
+from src.csv.bulk_csv_writer import BulkCSVWriter
+from src.csv.data_processor import DataProcessor
+from src.csv.file_format import FORMAT_CSV, detect_format
+from src.csv.parse_cache import encode_names, decode_names
+from src.journey import JourneyManager
+from src.journey_log import JourneyLog
+from src.model.journey import Journey
+from src.model.journey_columns import JourneyColumns, JourneyColumnsBuilder, DIRECTION_IN, DIRECTION_OUT
+from src.tariff import FareTable
+from src.util.constans import PENALTY_CHARGES
+from src.util.reject_sink import RejectRecord, RejectSink, use_sink, UNKNOWN_STATION
+from src.util.timestamp_parser import parse_timestamp
+from src.util.zone_fee_calculator import additional_zone_fee
+from src.zone_index import ZoneIndex
+
+DIRECTIONS = {DIRECTION_IN: "IN", DIRECTION_OUT: "OUT"}
+
+
+class RebillIndex:
+    """What a billing run needs to re-bill only the riders a rezoning affects.
+
+    Saved next to a run, it holds every tap of the journey file grouped by user (taps at stations missing from the
+    zone map included, as a rezoning can add those stations), the users who tapped at each station, the zone map
+    the run was billed with, each user's bill and the cost contribution of each of their journeys: trip or
+    penalty, stations, base cost and the amount charged after the caps.
+
+    Re-billing diffs the zone fees, takes the users of the stations whose fee changed and runs their taps, without
+    those at stations missing from the new map, through JourneyManager, so caps apply exactly as in a full run.
+    The work is proportional to the affected riders, not to the file.
+    """
+
+    def __init__(self, users: List[str], stations: List[str], user_offsets: np.ndarray, tap_order: np.ndarray,
+                 station_idx: np.ndarray, direction: np.ndarray, epoch: np.ndarray, day: np.ndarray,
+                 month: np.ndarray, station_user_offsets: np.ndarray, station_users: np.ndarray,
+                 zone_numbers: Dict[str, int], bills: np.ndarray, billed: np.ndarray, charges: Dict[str, np.ndarray]):
+        self.users = users
+        self.stations = stations
+        # Taps of user u are rows user_offsets[u]:user_offsets[u + 1], in file order; tap_order is the row's tap
+        # number in the file
+        self.user_offsets = user_offsets
+        self.tap_order = tap_order
+        self.station_idx = station_idx
+        self.direction = direction
+        self.epoch = epoch
+        self.day = day
+        self.month = month
+        # Users of station s are station_users[station_user_offsets[s]:station_user_offsets[s + 1]]
+        self.station_user_offsets = station_user_offsets
+        self.station_users = station_users
+        self.zone_numbers = zone_numbers
+        # Bill of each user, and whether the user has a tap the zone map accepts, i.e. a row in the output
+        self.bills = bills
+        self.billed = billed
+        # Journey contributions: user, is trip, start and end station, base cost and amount charged, by user
+        self.charges = charges
+
+    @staticmethod
+    def build(columns: JourneyColumns, zone_numbers: Mapping[str, int]) -> "RebillIndex":
+        """Index a parsed journey file, read without dropping unknown stations, as billed with zone_numbers"""
+        n_users, n_stations = len(columns.users), len(columns.stations)
+        order = np.argsort(columns.user_idx, kind="stable")
+        user_offsets = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(columns.user_idx, minlength=n_users), out=user_offsets[1:])
+
+        # Distinct (station, user) pairs sorted by station then user
+        pairs = np.unique(columns.station_idx.astype(np.int64) * max(n_users, 1) + columns.user_idx)
+        station_users = (pairs % max(n_users, 1)).astype(np.int32)
+        station_user_offsets = np.zeros(n_stations + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs // max(n_users, 1), minlength=n_stations), out=station_user_offsets[1:])
+
+        index = RebillIndex(columns.users, columns.stations, user_offsets, order.astype(np.int64),
+                            columns.station_idx[order], columns.direction[order], columns.epoch[order],
+                            columns.day[order], columns.month[order], station_user_offsets, station_users,
+                            dict(zone_numbers), np.zeros(n_users, dtype=np.float64), np.zeros(n_users, dtype=bool),
+                            _no_charges())
+        index._price(np.arange(n_users, dtype=np.int32))
+        return index
+
+    def changed_stations(self, zone_numbers: Mapping[str, int]) -> List[int]:
+        """Ids of indexed stations whose fee differs under zone_numbers, counting a station leaving or joining the
+        map as a change"""
+        def fee(zones: Mapping[str, int], station: str) -> Optional[float]:
+            zone = zones.get(station)
+            return None if zone is None else additional_zone_fee(zone)
+
+        return [station_id for station_id, station in enumerate(self.stations)
+                if fee(self.zone_numbers, station) != fee(zone_numbers, station)]
+
+    def affected_users(self, zone_numbers: Mapping[str, int]) -> np.ndarray:
+        """Ids of the users who tapped at a station whose fee changes"""
+        offsets, users = self.station_user_offsets, self.station_users
+        parts = [users[offsets[s]:offsets[s + 1]] for s in self.changed_stations(zone_numbers)]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int32)
+
+    def rebill(self, zone_numbers: Mapping[str, int]) -> Tuple[Dict[str, float], Set[str]]:
+        """Re-bill the affected users under zone_numbers and update the index to it. Returns their new bills and
+        the users left without any accepted tap, who no longer have a bill"""
+        affected = self.affected_users(zone_numbers)
+        fare_table = FareTable.from_zone_numbers(dict(zone_numbers))
+        billing_manager = BillingManager()
+        # Rows JourneyManager rejects were reported by the indexed run
+        previous = use_sink(RejectSink(count_only=True))
+        try:
+            JourneyManager(billing_manager, fare_table).calculate(self._journeys(affected, fare_table))
+        finally:
+            use_sink(previous)
+        bills = dict(billing_manager.user_bill)
+
+        self.zone_numbers = dict(zone_numbers)
+        self._price(affected)
+        removed = {self.users[user] for user in affected.tolist() if self.users[user] not in bills}
+        return bills, removed
+
+    def sort_keys(self) -> Dict[str, Tuple[str, int]]:
+        """Output sort key of every billed user: the case-insensitive id, then the file position of the user's first
+        accepted tap, which is how a full run orders ids differing only in case"""
+        accepted = np.flatnonzero(self._known(self.zone_numbers)[self.station_idx])
+        # Rows are grouped by user in file order, so a user's first accepted row is their first accepted tap
+        users, first = np.unique(self._user_of_row()[accepted], return_index=True)
+        return {self.users[user]: (self.users[user].lower(), position)
+                for user, position in zip(users.tolist(), self.tap_order[accepted[first]].tolist())}
+
+    def _known(self, zone_numbers: Mapping[str, int]) -> np.ndarray:
+        return np.array([station in zone_numbers for station in self.stations] or [False], dtype=bool)
+
+    def _user_of_row(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.users), dtype=np.int32), np.diff(self.user_offsets))
+
+    def _taps(self, users: np.ndarray) -> np.ndarray:
+        """Rows of the given users' taps, user by user"""
+        starts = self.user_offsets[users]
+        lengths = self.user_offsets[users + 1] - starts
+        # Each row is its user's first row plus its rank among the user's rows
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum(), dtype=np.int64)
+
+    def _journeys(self, users: np.ndarray, stations: FareTable):
+        """The users' accepted taps as Journey objects, one user after another; billing is per user, so the
+        order between users does not matter"""
+        rows = self._taps(users)
+        rows = rows[self._known(stations)[self.station_idx[rows]]]
+        user_of_row = self._user_of_row()
+        for user, station, direction, epoch, day, month in zip(
+                user_of_row[rows].tolist(), self.station_idx[rows].tolist(), self.direction[rows].tolist(),
+                self.epoch[rows].tolist(), self.day[rows].tolist(), self.month[rows].tolist()):
+            yield Journey.from_parsed(self.users[user], self.stations[station], DIRECTIONS.get(direction, ""),
+                                      epoch, day, month)
+
+    def _price(self, users: np.ndarray):
+        """Recompute the bills and journey contributions of the given users under the index's zone map"""
+        fare_table = FareTable.from_zone_numbers(self.zone_numbers)
+        rows = self._taps(users)
+        rows = rows[self._known(self.zone_numbers)[self.station_idx[rows]]]
+        columns = JourneyColumns(self.users, self.stations, self._user_of_row()[rows], self.station_idx[rows],
+                                 self.direction[rows], self.epoch[rows], self.day[rows], self.month[rows])
+
+        bills = np.zeros(len(self.users), dtype=np.float64)
+        charges = _no_charges()
+        if len(columns):
+            engine = ColumnarBillingEngine(fare_table)
+            charge_users, trip, start, end, day_bucket, month_bucket = engine.charge_plan(columns)
+            base = np.full(len(charge_users), PENALTY_CHARGES, dtype=np.float64)
+            base[trip] = engine._trip_costs(columns, start[trip], end[trip])
+            charged = np.zeros(len(charge_users), dtype=np.float64)
+            engine._apply_caps(bills, charge_users, base, day_bucket, month_bucket, charged=charged)
+            charges = {"user": charge_users.astype(np.int32), "trip": trip, "start": start.astype(np.int32),
+                       "end": end.astype(np.int32), "base": base, "charged": charged}
+
+        self.bills[users] = bills[users]
+        self.billed[users] = False
+        self.billed[np.unique(columns.user_idx)] = True
+        keep = ~np.isin(self.charges["user"], users)
+        merged = {name: np.concatenate((self.charges[name][keep], charges[name])) for name in charges}
+        by_user = np.argsort(merged["user"], kind="stable")
+        self.charges = {name: values[by_user] for name, values in merged.items()}
+
+    def save(self, path: str):
+        """Write the index to path; the file is replaced atomically"""
+        zone_stations = list(self.zone_numbers)
+        arrays = {"user_offsets": self.user_offsets, "tap_order": self.tap_order, "station_idx": self.station_idx,
+                  "direction": self.direction, "epoch": self.epoch, "day": self.day, "month": self.month,
+                  "station_user_offsets": self.station_user_offsets, "station_users": self.station_users,
+                  "zone": np.array([self.zone_numbers[station] for station in zone_stations], dtype=np.int64),
+                  "bills": self.bills, "billed": self.billed}
+        for prefix, names in (("user", self.users), ("station", self.stations), ("zone_station", zone_stations)):
+            arrays[f"{prefix}_name_offsets"], arrays[f"{prefix}_name_blob"] = encode_names(names)
+        for name, values in self.charges.items():
+            arrays[f"charge_{name}"] = values
+
+        directory = os.path.dirname(path) or "."
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as file:
+            np.savez(file, **arrays)
+        os.replace(file.name, path)
+
+    @staticmethod
+    def load(path: str) -> "RebillIndex":
+        with np.load(path, allow_pickle=False) as entry:
+            arrays = {name: entry[name] for name in entry.files}
+
+        def names(prefix: str) -> List[str]:
+            return decode_names(arrays[f"{prefix}_name_offsets"], arrays[f"{prefix}_name_blob"])
+
+        return RebillIndex(names("user"), names("station"), arrays["user_offsets"], arrays["tap_order"],
+                           arrays["station_idx"], arrays["direction"], arrays["epoch"], arrays["day"],
+                           arrays["month"], arrays["station_user_offsets"], arrays["station_users"],
+                           dict(zip(names("zone_station"), arrays["zone"].tolist())), arrays["bills"],
+                           arrays["billed"],
+                           {name[len("charge_"):]: values for name, values in arrays.items()
+                            if name.startswith("charge_")})
+
+    @staticmethod
+    def from_journey_file(journey_path: str, zone_numbers: Mapping[str, int],
+                          input_format: str = None) -> "RebillIndex":
+        """Parse a journey file keeping taps at every station and index it. Rows the parser rejects are only
+        counted, as the billing run has already reported them"""
+        previous = use_sink(RejectSink(count_only=True))
+        try:
+            if JourneyLog.is_log(journey_path):
+                columns = JourneyLog(journey_path).columns()
+            elif detect_format(journey_path, input_format) != FORMAT_CSV:
+                columns = DataProcessor.read_transaction_columns_from_arrow(journey_path, None, input_format)
+            else:
+                columns = DataProcessor.read_transaction_columns_from_csv(journey_path)
+        finally:
+            use_sink(previous)
+        if isinstance(columns, str):
+            raise ValueError(f"Error reading transaction data: {columns}")
+        return RebillIndex.build(columns, zone_numbers)
+
+
+def all_taps(parsed: Union[JourneyColumns, List[Journey]], records: List[RejectRecord]) -> JourneyColumns:
+    """Every tap of a journey file, in file order, from a parse that left out the taps at stations missing from the
+    zone map and the rows it rejected: those taps are rebuilt from their rejected rows, so a billing run indexes the
+    file without parsing it again. Every data row became a tap or a rejected row, so the parsed taps take the row
+    numbers the rejected rows leave free"""
+    if not isinstance(parsed, JourneyColumns):
+        builder = JourneyColumnsBuilder()
+        for journey in parsed:
+            builder.append(journey.userId, journey.station, journey.direction, journey.epoch, journey.day,
+                           journey.month)
+        parsed = builder.build()
+
+    unknown = [(row, fields) for reason, row, fields, _ in records if reason == UNKNOWN_STATION]
+    if not unknown:
+        return parsed
+    left_out = JourneyColumnsBuilder()
+    for _, fields in unknown:
+        left_out.append(fields[0], fields[1], fields[2], *parse_timestamp(fields[3]))
+
+    rejected_rows = np.array([row for _, row, _, _ in records], dtype=np.int64)
+    parsed_rows = np.setdiff1d(np.arange(2, len(parsed) + len(records) + 2), rejected_rows)
+    rows = np.concatenate([parsed_rows, np.array([row for row, _ in unknown], dtype=np.int64)])
+    return JourneyColumns.concat([parsed, left_out.build()]).take(np.argsort(rows, kind="stable"))
+
+
+def _no_charges() -> Dict[str, np.ndarray]:
+    return {"user": np.zeros(0, dtype=np.int32), "trip": np.zeros(0, dtype=bool),
+            "start": np.zeros(0, dtype=np.int32), "end": np.zeros(0, dtype=np.int32),
+            "base": np.zeros(0, dtype=np.float64), "charged": np.zeros(0, dtype=np.float64)}
+
+
+def zone_numbers_of(fare_table: FareTable) -> Dict[str, int]:
+    """Station -> zone number of a loaded zone map"""
+    return {station: fare_table.zones[fare_table.zone_id(station)] for station in fare_table}
+
+
+def read_zone_numbers(zone_path: str) -> Dict[str, int]:
+    """Station -> zone number of a zone map in any supported form: CSV, Parquet, Arrow or a zone index"""
+    if ZoneIndex.is_index(zone_path):
+        return zone_numbers_of(FareTable.from_zone_index(ZoneIndex(zone_path)))
+    if detect_format(zone_path) != FORMAT_CSV:
+        return DataProcessor.read_zone_numbers_from_arrow(zone_path)
+    return DataProcessor.read_zone_numbers_from_csv(zone_path)
+
+
+def patch_output(output_path: str, index: RebillIndex, bills: Mapping[str, float], removed: Set[str]) -> int:
+    """Replace the bills of re-billed users in a CSV bill file, drop users left without a bill and add new ones,
+    keeping the order of a full run. Returns the number of users written"""
+    rows = CSVReader.read_csv(output_path)
+    if isinstance(rows, str):
+        raise ValueError(f"Error reading output: {rows}")
+
+    # Amounts have two decimals, so reading and formatting them again gives the same text
+    output = {row[0]: float(row[1]) for row in rows}
+    output.update(bills)
+    for user_id in removed:
+        output.pop(user_id, None)
+
+    sort_keys = index.sort_keys()
+    data = sorted(output.items(), key=lambda item: sort_keys.get(item[0], (item[0].lower(), 0)))
+    BulkCSVWriter(output_path).write_csv(data, output_path)
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-bill only the users affected by a zone map change and patch "
+                                                 "the output of the run that saved the index.")
+    parser.add_argument("index_path", type=str, help="Re-bill index saved by main.py --rebill-index")
+    parser.add_argument("zone_path", type=str, help="The new zone map")
+    parser.add_argument("output_path", type=str, help="Bill CSV of the indexed run, patched in place")
+    parser.add_argument("--old-zone-path", type=str, default=None,
+                        help="Zone map to diff against instead of the one the index was billed with")
+    args = parser.parse_args()
+
+    index = RebillIndex.load(args.index_path)
+    if args.old_zone_path:
+        index.zone_numbers = read_zone_numbers(args.old_zone_path)
+    zone_numbers = read_zone_numbers(args.zone_path)
+    # The zone map readers report their errors and return an empty map; re-billing against it would drop every bill
+    for zones, path in ((index.zone_numbers, args.old_zone_path or args.index_path), (zone_numbers, args.zone_path)):
+        if not zones:
+            print(f"Error reading zone data: {path}")
+            sys.exit(1)
+    changed = index.changed_stations(zone_numbers)
+    bills, removed = index.rebill(zone_numbers)
+    try:
+        written = patch_output(args.output_path, index, bills, removed)
+    except (ValueError, OSError) as e:
+        print(e)
+        sys.exit(1)
+    index.save(args.index_path)
+    print(f"{len(changed)} stations changed fee; re-billed {len(bills) + len(removed)} of {len(index.users)} users, "
+          f"{written} bills in {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
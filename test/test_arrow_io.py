@@ -0,0 +1,110 @@
+import os
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from src.csv.arrow_writer import ArrowWriter
+from src.csv.csv_reader import CSVReader
+from src.csv.data_processor import DataProcessor
+from src.mass_transit_billing import MassTransitBilling
+from src.tariff import FareTable
+
+
+def _journey_table(rows):
+    return pa.table({name: [row[i] for row in rows] for i, name in enumerate(["user_id", "station", "direction",
+                                                                             "time"])})
+
+
+def test_parquet_columns_match_csv_columns():
+    path = os.path.join(tempfile.mkdtemp(), "journeys.parquet")
+    # An extra column that projection never reads, and small row groups to stream several batches
+    pq.write_table(_journey_table(CSVReader.read_csv("journey_data.csv")).append_column("note", pa.array(["x"] * 15)),
+                   path, row_group_size=4)
+    fare_table = FareTable.from_zone_map_csv("zone_map.csv")
+
+    expected = DataProcessor.read_transaction_columns_from_csv("journey_data.csv", fare_table)
+    columns = DataProcessor.read_transaction_columns_from_arrow(path, fare_table, batch_size=4)
+
+    assert columns.users == expected.users and columns.stations == expected.stations
+    for name in ("user_idx", "station_idx", "direction", "epoch", "day", "month"):
+        assert np.array_equal(getattr(columns, name), getattr(expected, name)), name
+
+
+def test_parquet_journeys_stream_batch_by_batch():
+    path = os.path.join(tempfile.mkdtemp(), "journeys.parquet")
+    pq.write_table(_journey_table(CSVReader.read_csv("journey_data.csv")), path, row_group_size=4)
+    fare_table = FareTable.from_zone_map_csv("zone_map.csv")
+
+    streamed = DataProcessor.stream_transaction_from_arrow(path, fare_table, batch_size=4)
+    expected = DataProcessor.read_transaction_from_csv("journey_data.csv", fare_table)
+
+    assert not isinstance(streamed, list)
+    assert [(j.userId, j.station, j.direction, j.epoch) for j in streamed] == \
+           [(j.userId, j.station, j.direction, j.epoch) for j in expected]
+    assert DataProcessor.stream_transaction_from_arrow("missing.parquet") == "File Not Found: missing.parquet"
+
+
+def test_timestamp_columns_and_rejected_rows(capsys):
+    path = os.path.join(tempfile.mkdtemp(), "journeys.arrow")
+    feather.write_feather(pa.table({
+        "user_id": ["user1", "user1", None, "user2"],
+        "station": ["core_cross", "atlantis", "core_cross", "core_cross"],
+        "direction": ["IN", "OUT", "IN", "IN"],
+        "time": pa.array([datetime(2022, 4, 4, 9, 40), datetime(2022, 4, 4, 9, 50), datetime(2022, 4, 4, 10),
+                          datetime(2022, 5, 31, 23, 59)], type=pa.timestamp("ms")),
+    }), path)
+
+    columns = DataProcessor.read_transaction_columns_from_arrow(path, FareTable.from_zone_map_csv("zone_map.csv"))
+
+    assert capsys.readouterr().out.splitlines() == [
+        "Error processing row 3: Unknown station 'atlantis'",
+        "Error processing row 4: Row 4 has an incorrect number of fields: 3",
+    ]
+    assert columns.users == ["user1", "user2"]
+    assert [journey.time for journey in columns.iter_journeys()] == [datetime(2022, 4, 4, 9, 40),
+                                                                      datetime(2022, 5, 31, 23, 59)]
+    assert columns.month.tolist() == [2022 * 12 + 3, 2022 * 12 + 4]
+
+
+def test_parquet_run_writes_the_same_bills():
+    directory = tempfile.mkdtemp()
+    journey_path = os.path.join(directory, "journeys.parquet")
+    pq.write_table(_journey_table(CSVReader.read_csv("journey_data.csv")), journey_path)
+    csv_output = os.path.join(directory, "output.csv")
+    parquet_output = os.path.join(directory, "output.parquet")
+
+    MassTransitBilling("journey_data.csv", "zone_map.csv", csv_output).run()
+    MassTransitBilling(journey_path, "zone_map.csv", parquet_output).run()
+
+    expected = [(row[0], float(row[1])) for row in CSVReader.read_csv(csv_output)]
+    assert [(row["user_id"], row["billing_amount"]) for row in pq.read_table(parquet_output).to_pylist()] == expected
+
+
+def test_arrow_writer_accepts_an_iterator_in_batches():
+    path = os.path.join(tempfile.mkdtemp(), "bills.arrow")
+    ArrowWriter(path, batch_size=2).write_table(iter([("a", 1.005), ("b", 2.0), ("c", 0.125)]), path)
+
+    table = feather.read_table(path)
+    assert table.column("user_id").to_pylist() == ["a", "b", "c"]
+    assert table.column("billing_amount").to_pylist() == [float(f"{amount:.2f}") for amount in (1.005, 2.0, 0.125)]
+
+
+def test_arrow_writer_rounds_like_the_csv_output():
+    path = os.path.join(tempfile.mkdtemp(), "bills.parquet")
+    amounts = [76.465, 2.675, 1.115, 0.005, 10.0, -1.005] + np.round(np.random.default_rng(3).uniform(0, 200, 5000),
+                                                                      3).tolist()
+    ArrowWriter(path).write_table([(f"user{index}", amount) for index, amount in enumerate(amounts)], path)
+
+    stored = pq.read_table(path).column("billing_amount").to_pylist()
+    assert [f"{amount:.2f}" for amount in stored] == [f"{amount:.2f}" for amount in amounts]
+
+
+def test_zone_map_with_a_float_zone_column():
+    path = os.path.join(tempfile.mkdtemp(), "zones.parquet")
+    pq.write_table(pa.table({"station": ["a", "b", "c"], "zone": [1.0, 2.0, 3.0]}), path)
+
+    assert DataProcessor.read_zone_numbers_from_arrow(path) == {"a": 1, "b": 2, "c": 3}
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from main import main
+from src.mass_transit_billing import MassTransitBilling, batch_inputs, batch_output_path
+from src.synthetic_data import JourneyGenerator
+from src.zone_index import ZoneIndex
+
+
+def _read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_batch_writes_the_same_bills_as_single_runs():
+    directory = tempfile.mkdtemp()
+    input_dir = os.path.join(directory, "journeys")
+    os.makedirs(input_dir)
+    zone_path = None
+    for seed in range(3):
+        zone_path, journey_path = JourneyGenerator(users=50, stations=8, days=3, journeys_per_day=60,
+                                                   seed=seed).generate(os.path.join(directory, str(seed)))
+        shutil.copy(journey_path, os.path.join(input_dir, f"operator{seed}.csv"))
+    # Every seed writes the same zone map; a file of another format fails without stopping the batch
+    with open(os.path.join(input_dir, "broken.csv"), 'w') as file:
+        file.write("not a journey file\n")
+
+    output_dir = os.path.join(directory, "bills")
+    failures = MassTransitBilling.run_batch(input_dir, zone_path, output_dir, processes=2,
+                                            count_rejects_only=True)
+
+    assert list(failures) == [os.path.join(input_dir, "broken.csv")]
+    for seed in range(3):
+        journey_path = os.path.join(input_dir, f"operator{seed}.csv")
+        expected_path = os.path.join(directory, f"expected{seed}.csv")
+        assert MassTransitBilling(journey_path, zone_path, expected_path).run()
+        assert _read(os.path.join(output_dir, f"operator{seed}.csv")) == _read(expected_path)
+
+
+def test_batch_inputs_and_output_names():
+    directory = tempfile.mkdtemp()
+    for name in ("b.csv", "a.csv", "notes.txt"):
+        open(os.path.join(directory, name), 'w').close()
+    os.makedirs(os.path.join(directory, "archive"))
+
+    assert batch_inputs(directory) == [os.path.join(directory, name) for name in ("a.csv", "b.csv", "notes.txt")]
+    assert batch_inputs(os.path.join(directory, "*.csv")) == [os.path.join(directory, "a.csv"),
+                                                              os.path.join(directory, "b.csv")]
+    assert batch_output_path("in/a.csv", "out", "parquet") == os.path.join("out", "a.parquet")
+    assert batch_output_path("in/a.mtjl", "out") == os.path.join("out", "a.csv")
+    assert batch_output_path("in/a.csv.gz", "out") == os.path.join("out", "a.csv")
+
+
+def test_inputs_with_the_same_output_name_fail():
+    directory = tempfile.mkdtemp()
+    input_dir = os.path.join(directory, "journeys")
+    os.makedirs(input_dir)
+    shutil.copy("journey_data.csv", os.path.join(input_dir, "day.csv"))
+    shutil.copy("journey_data.csv", os.path.join(input_dir, "day.csv.gz"))
+    shutil.copy("journey_data.csv", os.path.join(input_dir, "other.csv"))
+
+    output_dir = os.path.join(directory, "bills")
+    failures = MassTransitBilling.run_batch(input_dir, "zone_map.csv", output_dir, processes=1)
+
+    assert sorted(failures) == [os.path.join(input_dir, "day.csv"), os.path.join(input_dir, "day.csv.gz")]
+    assert os.listdir(output_dir) == ["other.csv"]
+
+
+def test_zone_index_written_from_zone_numbers():
+    index_path = os.path.join(tempfile.mkdtemp(), "zones.idx")
+
+    assert ZoneIndex.write({"core": 1, "outer": 4}, index_path) == 2
+    assert ZoneIndex(index_path).zone_of("outer") == 4
+
+
+def test_per_file_options_reach_every_run(monkeypatch):
+    directory = tempfile.mkdtemp()
+    input_dir = os.path.join(directory, "journeys")
+    os.makedirs(input_dir)
+    # The OUT tap arrives before its IN tap, so the bill depends on the reorder window reaching the run
+    with open(os.path.join(input_dir, "day.csv"), 'w') as file:
+        file.write("user_id,station,direction,time\n"
+                   "user1,core_cross,OUT,2022-04-04T10:05:00\n"
+                   "user1,think_tank_terminus,IN,2022-04-04T10:00:00\n")
+    output_dir = os.path.join(directory, "bills")
+    monkeypatch.setattr("sys.argv", ["main.py", "zone_map.csv", input_dir, output_dir, "--batch", "--batch-processes",
+                                     "1", "--stream", "--reorder-window", "600", "--count-rejects-only"])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 0
+
+    expected_path = os.path.join(directory, "expected.csv")
+    assert MassTransitBilling(os.path.join(input_dir, "day.csv"), "zone_map.csv", expected_path,
+                              reorder_window=600).run(True)
+    assert _read(os.path.join(output_dir, "day.csv")) == _read(expected_path)
+    assert MassTransitBilling(os.path.join(input_dir, "day.csv"), "zone_map.csv", expected_path).run(True)
+    assert _read(os.path.join(output_dir, "day.csv")) != _read(expected_path)
+
+
+def test_single_run_options_are_refused_in_batch_mode(monkeypatch, capsys):
+    monkeypatch.setattr("sys.argv", ["main.py", "zone_map.csv", "journeys", "bills", "--batch", "--tariffs", "t.json",
+                                     "--ledger", "ledger.db"])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 2
+    assert "--ledger, --tariffs cannot be used with --batch" in capsys.readouterr().err
@@ -0,0 +1,61 @@
+import csv
+import os
+import tempfile
+
+from src.benchmark import BenchmarkHarness, STAGES, compare, find_baseline
+from src.billing_manager import BillingManager
+from src.csv.data_processor import DataProcessor
+from src.journey import JourneyManager
+from src.synthetic_data import JourneyGenerator
+from src.tariff import FareTable
+from src.util.constans import DAILY_CAP, MONTHLY_CAP
+
+
+def _bills(zone_path, journey_path):
+    zones = FareTable.from_zone_map_csv(zone_path)
+    journeys = DataProcessor.read_transaction_from_csv(journey_path, zones)
+    return journeys, dict(JourneyManager(BillingManager(), zones).calculate(journeys))
+
+
+def test_generated_journeys_are_sorted_and_reproducible():
+    generator = JourneyGenerator(users=200, stations=20, days=3, seed=7)
+    zone_path, journey_path = generator.generate(tempfile.mkdtemp())
+    again_zone_path, again_journey_path = generator.generate(tempfile.mkdtemp())
+
+    with open(journey_path) as file, open(again_journey_path) as again:
+        assert file.read() == again.read()
+    with open(zone_path, newline='') as file:
+        assert len(list(csv.reader(file))) == 21
+
+    journeys, _ = _bills(zone_path, journey_path)
+    times = [journey.epoch for journey in journeys]
+    assert times == sorted(times)
+
+
+def test_cap_hit_rate_drives_riders_to_the_caps():
+    directory = tempfile.mkdtemp()
+    generator = JourneyGenerator(users=50, stations=10, days=10, journeys_per_day=50, missing_tap_rate=0.0,
+                                 cap_hit_rate=0.2)
+    _, bills = _bills(*generator.generate(directory))
+    assert max(bills.values()) == MONTHLY_CAP
+
+    calm = JourneyGenerator(users=50, stations=10, days=1, journeys_per_day=20, missing_tap_rate=0.0,
+                            cap_hit_rate=0.0)
+    _, bills = _bills(*calm.generate(tempfile.mkdtemp()))
+    assert max(bills.values()) < DAILY_CAP
+
+
+def test_harness_records_every_stage_and_detects_regressions():
+    directory = tempfile.mkdtemp()
+    zone_path, journey_path = JourneyGenerator(users=100, stations=10).generate(directory)
+    result = BenchmarkHarness(zone_path, journey_path, os.path.join(directory, "output.csv"), repeat=1).run()
+
+    assert list(result["stages"]) == STAGES
+    assert result["stages"]["parse"]["rows"] == result["dataset"]["journey_rows"]
+    assert all(stage["peak_rss_mb"] > 0 for stage in result["stages"].values())
+    assert find_baseline([result], result) is result
+
+    slower = {**result, "stages": {stage: {**timing, "seconds": timing["seconds"] * 2 + 1}
+                                   for stage, timing in result["stages"].items()}}
+    assert len(compare(slower, result)) == len(STAGES)
+    assert compare(result, slower) == []
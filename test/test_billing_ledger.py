@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import tempfile
+from collections import defaultdict
+from datetime import date
+
+import pytest
+
+from src.billing_ledger import BillingLedger, LedgerReader
+from src.billing_manager import BillingManager
+from src.journey import JourneyManager
+from src.mass_transit_billing import MassTransitBilling, ENGINE_COLUMNAR
+
+JOURNEYS = """User ID,Station,Direction,Time
+user1,think_tank_terminus,IN,2022-04-04T9:00:00
+user1,payments_junction,OUT,2022-04-04T9:30:00
+user1,payments_junction,OUT,2022-04-04T10:00:00
+user1,payments_junction,OUT,2022-04-04T10:30:00
+user1,think_tank_terminus,IN,2022-04-04T11:00:00
+user1,payments_junction,IN,2022-04-04T11:30:00
+user1,think_tank_terminus,OUT,2022-04-05T1:00:00
+user2,think_tank_terminus,IN,2022-04-05T8:00:00
+"""
+
+
+def _bill(directory, **options):
+    journey_path = os.path.join(directory, "journeys.csv")
+    with open(journey_path, 'w') as file:
+        file.write(JOURNEYS)
+    output_path = os.path.join(directory, "output.csv")
+    billing = MassTransitBilling(journey_path, os.path.join(os.path.dirname(__file__), "..", "zone_map.csv"),
+                                 output_path, **options)
+    assert billing.run()
+    with open(output_path) as file:
+        return {user_id: float(amount) for user_id, amount in (line.split(",") for line in file.read().split()[1:])}
+
+
+def test_every_charge_is_recorded_with_its_reason():
+    directory = tempfile.mkdtemp()
+    ledger_path = os.path.join(directory, "ledger.db")
+    bills = _bill(directory, ledger_path=ledger_path)
+
+    reader = LedgerReader(ledger_path)
+    user1 = reader.history("user1")
+    assert [(entry.reason, entry.day) for entry in user1] == [
+        ("trip", date(2022, 4, 4)), ("missing-IN", date(2022, 4, 4)), ("missing-IN", date(2022, 4, 4)),
+        ("missing-OUT", date(2022, 4, 4)), ("cross-day", date(2022, 4, 5))]
+    assert (user1[0].in_station, user1[0].out_station) == ("think_tank_terminus", "payments_junction")
+    assert user1[0].base_cost == user1[0].charged == pytest.approx(3.3)
+    # The daily cap of 15.00 clamps the missing-OUT penalty on the first day
+    assert user1[3].base_cost == 5.0 and user1[3].charged == pytest.approx(15.0 - 3.3 - 5.0 - 5.0)
+    assert [entry.reason for entry in reader.history("user2")] == ["end-of-day"]
+    assert [entry.reason for entry in reader.history("user1", date(2022, 4, 5), date(2022, 4, 5))] == ["cross-day"]
+    assert reader.history("nobody") == []
+    reader.close()
+
+    totals = defaultdict(float)
+    with sqlite3.connect(ledger_path) as db:
+        for user_id, charged in db.execute("SELECT user_id, charged FROM charge_history"):
+            totals[user_id] += charged
+    assert {user_id: round(total, 2) for user_id, total in totals.items()} == bills
+
+
+def test_ledger_written_in_batches_matches_one_batch():
+    directory = tempfile.mkdtemp()
+    _bill(directory, ledger_path=os.path.join(directory, "one.db"))
+    billing = MassTransitBilling(os.path.join(directory, "journeys.csv"),
+                                 os.path.join(os.path.dirname(__file__), "..", "zone_map.csv"), "output.csv")
+    billing.load_data()
+    # Batches are inserted by a writer thread on a machine with more than one core, in place otherwise
+    for writer_thread in (False, True):
+        many_path = os.path.join(directory, f"many-{writer_thread}.db")
+        ledger = BillingLedger(many_path, batch_rows=1, writer_thread=writer_thread)
+        JourneyManager(BillingManager(), billing.zone_data, ledger).calculate(billing.data_transaction)
+        ledger.close()
+
+        with sqlite3.connect(os.path.join(directory, "one.db")) as one, sqlite3.connect(many_path) as many:
+            assert one.execute("SELECT * FROM charge_history").fetchall() == \
+                   many.execute("SELECT * FROM charge_history").fetchall()
+
+
+def test_ledger_needs_the_journey_engine():
+    with pytest.raises(ValueError):
+        MassTransitBilling("journeys.csv", "zone_map.csv", "output.csv", engine=ENGINE_COLUMNAR, ledger_path="x.db")
+
+
+def test_batches_longer_than_one_insert_keep_every_charge():
+    ledger_path = os.path.join(tempfile.mkdtemp(), "ledger.db")
+    ledger = BillingLedger(ledger_path, batch_rows=240, writer_thread=False)
+    for index in range(250):
+        ledger.record(f"user{index % 3}", date(2022, 4, 4).toordinal(), "a" if index % 2 else None, index, "b", index,
+                      3.0, float(index), "trip")
+    ledger.close()
+
+    reader = LedgerReader(ledger_path)
+    history = reader.history("user1")
+    reader.close()
+    assert [entry.charged for entry in history] == [float(index) for index in range(1, 250, 3)]
+    assert [entry.in_station for entry in history[:2]] == ["a", None]
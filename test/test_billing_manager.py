@@ -2,6 +2,7 @@ import unittest
 from datetime import datetime, timedelta
 
 from src.billing_manager import BillingManager
+from src.model.track_prev_tap import TrackPrevInTap
 
 
 class TestBillingManager(unittest.TestCase):
@@ -126,3 +127,26 @@ class TestBillingManager(unittest.TestCase):
         self.assertEqual(self.billing_manager.calculate_max_addable_amount(self.user_id,5),3)
 
 
+    def test_users_share_a_single_record(self):
+        """ Test that the bill, both caps and the active journey of a user live in one compact record
+        verifies that writes through the dictionary views land on the record and open journeys are tracked"""
+        self.billing_manager.initialize_user(self.user_id, self.event_time)
+        self.billing_manager.initialize_user("test-user2", self.event_time)
+
+        self.billing_manager.add_journey_cost(self.user_id, 3.3)
+        self.billing_manager.track_active_journey[self.user_id] = TrackPrevInTap(self.event_time, "core_cross")
+
+        record = self.billing_manager.users.get(self.user_id)
+        self.assertEqual(record.bill, 3.3)
+        self.assertEqual(record.day_cost, 3.3)
+        self.assertEqual(record.month_cost, 3.3)
+        self.assertEqual(record.in_station, "core_cross")
+        self.assertEqual(list(self.billing_manager.track_active_journey), [self.user_id])
+        self.assertEqual(len(self.billing_manager.track_active_journey), 1)
+
+        self.billing_manager.track_active_journey.pop(self.user_id)
+        self.assertNotIn(self.user_id, self.billing_manager.track_active_journey)
+        self.assertIsNone(record.in_station)
+        self.assertEqual(len(self.billing_manager.track_active_journey), 0)
+
+
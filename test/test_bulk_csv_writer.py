@@ -0,0 +1,71 @@
+import os
+import random
+import tempfile
+
+import pytest
+
+from src.csv.bulk_csv_writer import BulkCSVWriter
+from src.csv.csv_writer import CSVWriter
+from src.mass_transit_billing import MassTransitBilling
+
+
+def _read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def _bills(rng, rows):
+    """Bills as sums of charges, with ids and amounts csv.writer and the pence formatting treat specially"""
+    bills = []
+    for i in range(rows):
+        bill = 0.0
+        for _ in range(rng.randrange(6)):
+            bill += rng.choice([2.5, 5.0, 0.8, 0.55, 0.3, 0.1])
+        bills.append((f"user{i}", bill))
+    bills += [('quote"d', 1.005), ("comma,id", 2.675), ("line\nbreak", 0.125), ("", -0.0), ("big", 1e300),
+              ("nan", float("nan")), ("inf", float("inf")), ("negative", -3.456), ("tie", 0.375), ("zero", 0)]
+    rng.shuffle(bills)
+    return bills
+
+
+def test_same_bytes_as_csv_writer():
+    rng = random.Random(3)
+    directory = tempfile.mkdtemp()
+    expected_path = os.path.join(directory, "expected.csv")
+    actual_path = os.path.join(directory, "actual.csv")
+
+    for chunk_rows in (1, 7, 65536):
+        bills = _bills(rng, 300)
+        CSVWriter(expected_path).write_csv(bills, expected_path)
+        BulkCSVWriter(actual_path, chunk_rows).write_csv(bills, actual_path)
+        assert _read(actual_path) == _read(expected_path)
+        # A streaming iterator gives the same file
+        BulkCSVWriter(actual_path, chunk_rows).write_csv(iter(bills), actual_path)
+        assert _read(actual_path) == _read(expected_path)
+    assert sorted(os.listdir(directory)) == ["actual.csv", "expected.csv"]
+
+
+def test_failed_write_keeps_the_previous_file():
+    directory = tempfile.mkdtemp()
+    output_path = os.path.join(directory, "output.csv")
+    BulkCSVWriter(output_path).write_csv([("user1", 2.5)], output_path)
+
+    def rows():
+        yield "user2", 5.0
+        raise RuntimeError("billing failed")
+
+    with pytest.raises(OSError, match="billing failed"):
+        BulkCSVWriter(output_path, chunk_rows=1).write_csv(rows(), output_path)
+
+    assert _read(output_path) == b"user_id,billing_amount\r\nuser1,2.50\r\n"
+    assert os.listdir(directory) == ["output.csv"]
+
+
+def test_failed_write_stops_the_run():
+    output_path = tempfile.mkdtemp()
+    billing = MassTransitBilling("journey_data.csv", "zone_map.csv", output_path)
+
+    assert not billing.run()
+    assert billing.error.startswith("An Error Occurred Writing File")
+    with pytest.raises(OSError):
+        BulkCSVWriter(output_path).write_csv([("user1", 2.5)], output_path)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+from src.billing_manager import BillingManager
+from src.closed_bills import ClosedBills
+from src.journey import JourneyManager
+from src.mass_transit_billing import MassTransitBilling
+from src.model.journey import Journey
+from src.synthetic_data import JourneyGenerator
+
+ZONE_COST = {"core": 0.8, "outer": 0.1}
+
+
+def _journeys(rows):
+    return [Journey(user_id, station, direction, time) for user_id, station, direction, time in rows]
+
+
+def test_evicts_users_idle_since_a_closed_month():
+    billing_manager = BillingManager()
+    billing_manager.enable_eviction()
+    journey_manager = JourneyManager(billing_manager, ZONE_COST)
+
+    journey_manager.calculate(_journeys([
+        ("user1", "core", "IN", "2022-04-04T9:00:00"),
+        ("user1", "outer", "OUT", "2022-04-04T9:30:00"),
+        # user2 is on a journey when the month turns, so they stay in memory
+        ("user2", "core", "IN", "2022-04-30T23:50:00"),
+        ("user3", "core", "IN", "2022-05-01T8:00:00"),
+    ]), finalize=False)
+
+    assert "user1" not in billing_manager.users
+    assert "user2" in billing_manager.users
+    assert billing_manager.closed_bills.evicted == 1
+
+    # user1 comes back and carries on with the bill kept at eviction
+    journey_manager.calculate(_journeys([("user1", "core", "IN", "2022-05-02T9:00:00"),
+                                         ("user1", "core", "OUT", "2022-05-02T9:10:00")]))
+    assert billing_manager.users.get("user1").bill == 2.9 + 3.6
+    assert dict(billing_manager.all_bills()) == {"user1": 6.5, "user2": 5.0, "user3": 5.0}
+
+
+def test_totals_add_up_spilled_parts_in_user_id_order():
+    closed_bills = ClosedBills(max_in_memory=1)
+    closed_bills.add("b", 1.5)
+    closed_bills.add("a", 2.0)
+    closed_bills.add("b", 0.5)
+    closed_bills.add("c", 4.0)
+    try:
+        assert closed_bills.spilled == 4
+        assert list(closed_bills.totals([("b", 1.0), ("d", 3.0)])) == [("a", 2.0), ("b", 3.0), ("c", 4.0),
+                                                                      ("d", 3.0)]
+    finally:
+        closed_bills.close()
+
+
+def test_eviction_does_not_change_the_output():
+    directory = tempfile.mkdtemp()
+    zone_path, journey_path = JourneyGenerator(users=200, stations=12, days=75, journeys_per_day=300,
+                                               seed=3).generate(directory)
+    expected_path = os.path.join(directory, "expected.csv")
+    actual_path = os.path.join(directory, "actual.csv")
+
+    MassTransitBilling(journey_path, zone_path, expected_path).run()
+    billing = MassTransitBilling(journey_path, zone_path, actual_path, evict_idle_users=True,
+                                 spill_dir=directory, closed_bills_in_memory=20)
+    billing.run()
+
+    assert billing.metrics.counters["evicted_users"] > 0
+    assert billing.metrics.counters["spilled_bills"] > 0
+    with open(expected_path, 'rb') as expected, open(actual_path, 'rb') as actual:
+        assert actual.read() == expected.read()
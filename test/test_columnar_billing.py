@@ -0,0 +1,52 @@
+import csv
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from src.billing_manager import BillingManager
+from src.columnar_billing import ColumnarBillingEngine
+from src.csv.data_processor import DataProcessor
+from src.journey import JourneyManager
+
+ZONE_COST = {"a": 0.80, "b": 0.50, "c": 0.30, "d": 0.10}
+
+
+def _write_random_journeys(seed: int, user_count: int, rows: int = 3000) -> str:
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(user_count)]
+    stations = list(ZONE_COST) + ["unknown_station"]
+    directions = ["IN", "OUT", "IN", "OUT", "IN", "OUT", "SIDEWAYS"]
+    time = datetime(2022, 1, 30, 6, 0, 0)
+
+    file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+    writer = csv.writer(file)
+    writer.writerow(['user_id', 'station', 'direction', 'time'])
+    for _ in range(rows):
+        # Mostly small steps with occasional jumps over days and months
+        time += timedelta(seconds=rng.choice([10, 60, 300, 900, 20000, 90000]))
+        writer.writerow([rng.choice(users), rng.choice(stations), rng.choice(directions),
+                         f"{time.year}-{time.month:02d}-{time.day:02d}T{time.hour}:{time.minute:02d}:{time.second:02d}"])
+    writer.writerow(['user0', 'a', 'IN', 'not-a-time'])
+    file.close()
+    return file.name
+
+
+def test_columnar_engine_matches_journey_manager_exactly():
+    # Few users hit the daily and monthly caps, many users mostly do not
+    for seed, user_count in enumerate([3, 3, 10, 40, 200]):
+        path = _write_random_journeys(seed, user_count)
+
+        expected = JourneyManager(BillingManager(), ZONE_COST).calculate(DataProcessor.read_transaction_from_csv(path))
+        columns = DataProcessor.read_transaction_columns_from_csv(path)
+        actual = ColumnarBillingEngine(ZONE_COST).calculate(columns)
+
+        assert list(actual.items()) == list(expected.items())
+
+
+def test_columnar_engine_sample_data():
+    zone_cost = DataProcessor.read_zone_map_from_csv("zone_map.csv")
+    columns = DataProcessor.read_transaction_columns_from_csv("journey_data.csv")
+
+    bills = ColumnarBillingEngine(zone_cost).calculate(columns)
+
+    assert {user: round(bill, 2) for user, bill in bills.items()} == {"user1": 3.30, "2user": 5.00, "user3": 18.30}
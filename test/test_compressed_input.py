@@ -0,0 +1,67 @@
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+
+import numpy as np
+
+from src.csv.compression import DecompressingReader, detect_compression, COMPRESSION_GZIP
+from src.csv.csv_reader import CSVReader
+from src.csv.parallel_csv_reader import ParallelCSVReader
+from src.synthetic_data import JourneyGenerator
+
+
+def _journey_file():
+    directory = tempfile.mkdtemp()
+    _, journey_path = JourneyGenerator(users=30, stations=6, days=5, journeys_per_day=400,
+                                       seed=2).generate(directory)
+    with open(journey_path, 'rb') as file:
+        return directory, journey_path, file.read()
+
+
+def test_compressed_files_read_like_the_plain_file():
+    directory, journey_path, data = _journey_file()
+    half = data.index(b"\n", len(data) // 2) + 1
+    compressed = {
+        # Two gzip members, as when daily archives are concatenated; no extension, so found by magic bytes
+        "journeys": gzip.compress(data[:half]) + gzip.compress(data[half:]),
+        "journeys.csv.bz2": bz2.compress(data),
+        "journeys.csv.xz": lzma.compress(data),
+    }
+
+    expected = CSVReader.read_csv(journey_path)
+    for name, content in compressed.items():
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        assert CSVReader.read_csv(path) == expected
+        assert list(CSVReader.stream_csv(path)) == expected
+    assert detect_compression(os.path.join(directory, "journeys")) == COMPRESSION_GZIP
+    assert detect_compression(journey_path) is None
+
+
+def test_parallel_reader_parses_decompressed_blocks():
+    directory, journey_path, data = _journey_file()
+    path = os.path.join(directory, "journeys.csv.gz")
+    with open(path, 'wb') as file:
+        file.write(gzip.compress(data))
+
+    expected = ParallelCSVReader(2).read_columns(journey_path)
+    columns = ParallelCSVReader(2).read_columns(path)
+
+    assert columns.users == expected.users
+    assert np.array_equal(columns.epoch, expected.epoch)
+    assert np.array_equal(columns.station_idx, expected.station_idx)
+
+
+def test_closing_early_stops_the_decompressing_thread():
+    directory, _, data = _journey_file()
+    path = os.path.join(directory, "journeys.csv.xz")
+    with open(path, 'wb') as file:
+        file.write(lzma.compress(data * 20))
+
+    reader = DecompressingReader(path, "xz")
+    assert reader.read(10) == data[:10]
+    reader.close()
+    assert not reader._thread.is_alive()
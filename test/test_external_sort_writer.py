@@ -0,0 +1,26 @@
+import os
+import random
+import tempfile
+
+from src.csv.csv_writer import CSVWriter
+from src.csv.external_sort_writer import ExternalSortWriter
+from src.mass_transit_billing import MassTransitBilling
+
+
+def test_external_sort_matches_in_memory_sort():
+    rng = random.Random(5)
+    # Mixed case ids so case-insensitive ties have to keep their input order
+    billing_data = {}
+    for _ in range(500):
+        user_id = rng.choice(["user", "User", "USER", "2user"]) + str(rng.randrange(200))
+        billing_data[user_id] = rng.randrange(0, 10000) / 100
+    directory = tempfile.mkdtemp()
+    expected_path = os.path.join(directory, "expected.csv")
+    actual_path = os.path.join(directory, "actual.csv")
+
+    sorted_data = MassTransitBilling("", "", "").sorted_data(billing_data)
+    CSVWriter(expected_path).write_csv(sorted_data, expected_path)
+    ExternalSortWriter(actual_path, max_rows_in_memory=17).write(billing_data.items())
+
+    with open(expected_path, 'rb') as expected, open(actual_path, 'rb') as actual:
+        assert actual.read() == expected.read()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+
+import numpy as np
+
+from src.billing_manager import BillingManager
+from src.csv.data_processor import DataProcessor
+from src.journey import JourneyManager
+from src.journey_log import JourneyLog
+from src.mass_transit_billing import MassTransitBilling, ENGINE_JOURNEY, ENGINE_COLUMNAR
+from src.tariff import FareTable
+
+
+def _converted_sample() -> str:
+    log_path = os.path.join(tempfile.mkdtemp(), "journeys.mtjl")
+    JourneyLog.convert("journey_data.csv", log_path)
+    return log_path
+
+
+def test_log_round_trips_the_parsed_columns():
+    expected = DataProcessor.read_transaction_columns_from_csv("journey_data.csv")
+    journey_log = JourneyLog(_converted_sample())
+    columns = journey_log.columns()
+
+    assert len(journey_log) == len(expected)
+    assert columns.users == expected.users and columns.stations == expected.stations
+    for name in ("user_idx", "station_idx", "direction", "epoch", "day", "month"):
+        assert np.array_equal(getattr(columns, name), getattr(expected, name)), name
+    # Tap columns are views into the mapped file, not copies
+    assert not columns.epoch.flags.owndata and not columns.user_idx.flags.owndata
+
+
+def test_batches_and_detection():
+    log_path = _converted_sample()
+    journey_log = JourneyLog(log_path)
+
+    batches = list(journey_log.batches(batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 4, 3]
+    assert np.array_equal(np.concatenate([batch.epoch for batch in batches]), journey_log.columns().epoch)
+    assert JourneyLog.is_log(log_path)
+    assert not JourneyLog.is_log("journey_data.csv")
+
+
+def test_journey_manager_bills_the_log_like_the_csv():
+    fare_table = FareTable.from_zone_map_csv("zone_map.csv")
+    expected = JourneyManager(BillingManager(), fare_table).calculate(
+        DataProcessor.read_transaction_from_csv("journey_data.csv", fare_table))
+    bills = JourneyManager(BillingManager(), fare_table).calculate(JourneyLog(_converted_sample()).iter_journeys(3))
+
+    assert dict(bills) == dict(expected)
+
+
+def test_run_rejects_log_taps_at_stations_missing_from_the_zone_map(capsys):
+    directory = tempfile.mkdtemp()
+    journey_path = os.path.join(directory, "journeys.csv")
+    with open(journey_path, 'w') as file:
+        file.write("user_id,station,direction,time\n"
+                   "user1,atlantis,IN,2022-04-04T9:40:00\n"
+                   "user1,core_cross,OUT,2022-04-04T9:50:00\n")
+    # Written without a zone map, so the tap at atlantis is kept in the log
+    log_path = os.path.join(directory, "journeys.mtjl")
+    JourneyLog.convert(journey_path, log_path)
+
+    for engine in (ENGINE_JOURNEY, ENGINE_COLUMNAR):
+        csv_output, log_output = os.path.join(directory, "csv.csv"), os.path.join(directory, "log.csv")
+        assert MassTransitBilling(journey_path, "zone_map.csv", csv_output, engine=engine).run()
+        assert MassTransitBilling(log_path, "zone_map.csv", log_output, engine=engine).run()
+        with open(csv_output) as expected, open(log_output) as actual:
+            assert actual.read() == expected.read()
+    assert capsys.readouterr().out.splitlines().count("Error processing row 2: Unknown station 'atlantis'") == 4
+
+
+def test_users_with_only_unknown_station_taps_get_no_bill():
+    directory = tempfile.mkdtemp()
+    journey_path = os.path.join(directory, "journeys.csv")
+    with open(journey_path, 'w') as file:
+        file.write("user_id,station,direction,time\n"
+                   "ghost,atlantis,IN,2022-04-04T9:30:00\n"
+                   "user1,think_tank_terminus,IN,2022-04-04T9:40:00\n"
+                   "user1,core_cross,OUT,2022-04-04T9:50:00\n")
+    log_path = os.path.join(directory, "journeys.mtjl")
+    JourneyLog.convert(journey_path, log_path)
+
+    csv_output, log_output = os.path.join(directory, "csv.csv"), os.path.join(directory, "log.csv")
+    assert MassTransitBilling(journey_path, "zone_map.csv", csv_output, engine=ENGINE_COLUMNAR).run()
+    assert MassTransitBilling(log_path, "zone_map.csv", log_output, engine=ENGINE_COLUMNAR).run()
+    with open(csv_output) as expected, open(log_output) as actual:
+        log_bills = actual.read()
+        assert log_bills == expected.read()
+    assert "ghost" not in log_bills
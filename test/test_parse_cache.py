@@ -0,0 +1,105 @@
+import os
+import tempfile
+
+from src.csv.data_processor import DataProcessor
+from src.csv.parse_cache import ParseCache
+from src.util.reject_sink import RejectSink, use_sink, BAD_TIMESTAMP, UNKNOWN_STATION
+
+JOURNEYS = """user_id,station,direction,time
+user1,core,IN,2022-04-04T9:00:00
+user1,outer,OUT,2022-04-04T9:30:00
+user2,core,IN,not-a-time
+user2,atlantis,IN,2022-04-04T10:00:00
+user2,core,SIDE,2022-04-04T10:05:00
+"""
+
+
+def _write(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as file:
+        file.write(text)
+    return path
+
+
+def _read(read, *args):
+    """Result of a DataProcessor read and the rejects it reported"""
+    sink = RejectSink(echo=False, collect=True)
+    previous = use_sink(sink)
+    try:
+        result = read(*args)
+        if not isinstance(result, (list, str)) and hasattr(result, "__next__"):
+            result = list(result)
+    finally:
+        use_sink(previous)
+    records, counts = sink.drain()
+    return result, [(reason, row) for reason, row, _, _ in records], counts
+
+
+def _journeys(journeys):
+    return [(j.userId, j.station, j.direction, j.epoch, j.day, j.month) for j in journeys]
+
+
+def test_cached_parse_matches_and_reports_the_same_rejects():
+    directory = tempfile.mkdtemp()
+    journey_path = _write(directory, "journeys.csv", JOURNEYS)
+    stations = {"core", "outer"}
+    cache = ParseCache(os.path.join(directory, "cache"))
+    previous = DataProcessor.use_cache(cache)
+    try:
+        parsed, rejects, counts = _read(DataProcessor.read_transaction_from_csv, journey_path, stations)
+        cached, cached_rejects, cached_counts = _read(DataProcessor.read_transaction_from_csv, journey_path, stations)
+        streamed, streamed_rejects, _ = _read(DataProcessor.stream_transaction_from_csv, journey_path, stations)
+        columns, _, _ = _read(DataProcessor.read_transaction_columns_from_csv, journey_path, stations)
+        cached_columns, _, _ = _read(DataProcessor.read_transaction_columns_from_csv, journey_path, stations)
+    finally:
+        DataProcessor.use_cache(previous)
+
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert _journeys(cached) == _journeys(streamed) == _journeys(parsed)
+    # The invalid direction is kept as text for JourneyManager to report
+    assert parsed[-1].direction == "SIDE"
+    assert rejects == cached_rejects == streamed_rejects == [(BAD_TIMESTAMP, 4), (UNKNOWN_STATION, 5)]
+    assert counts == cached_counts
+    assert cached_columns.users == columns.users
+    assert cached_columns.direction.tolist() == columns.direction.tolist()
+    assert cached_columns.epoch.tolist() == columns.epoch.tolist()
+
+
+def test_changed_file_or_stations_miss_the_cache():
+    directory = tempfile.mkdtemp()
+    journey_path = _write(directory, "journeys.csv", JOURNEYS)
+    cache = ParseCache(os.path.join(directory, "cache"))
+    previous = DataProcessor.use_cache(cache)
+    try:
+        _read(DataProcessor.read_transaction_from_csv, journey_path, {"core", "outer"})
+        _read(DataProcessor.read_transaction_from_csv, journey_path, {"core", "outer", "atlantis"})
+        _write(directory, "journeys.csv", JOURNEYS.replace("T9:30", "T09:45"))
+        journeys, _, _ = _read(DataProcessor.read_transaction_from_csv, journey_path, {"core", "outer"})
+    finally:
+        DataProcessor.use_cache(previous)
+
+    assert (cache.hits, cache.misses) == (0, 3)
+    assert journeys[1].epoch - journeys[0].epoch == 45 * 60
+
+
+def test_least_recently_used_entries_are_evicted():
+    directory = tempfile.mkdtemp()
+    cache_dir = os.path.join(directory, "cache")
+    paths = [_write(directory, f"zones{i}.csv", f"station,zone\ncore,{i + 1}\nouter,6\n") for i in range(3)]
+    previous = DataProcessor.use_cache(ParseCache(cache_dir))
+    try:
+        for path in paths:
+            DataProcessor.read_zone_numbers_from_csv(path)
+        entry_size = max(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)
+                         if name.endswith(".npz"))
+
+        cache = ParseCache(cache_dir, max_bytes=2 * entry_size)
+        DataProcessor.use_cache(cache)
+        # Use the first file again so the second one is the least recently used
+        assert DataProcessor.read_zone_numbers_from_csv(paths[0]) == {"core": 1, "outer": 6}
+        cache.evict()
+        cached = [os.path.exists(os.path.join(cache_dir, cache.key("zones", path, "-") + ".npz")) for path in paths]
+    finally:
+        DataProcessor.use_cache(previous)
+
+    assert cached == [True, False, True]
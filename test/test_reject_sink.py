@@ -0,0 +1,112 @@
+import csv
+import os
+import tempfile
+
+from src.billing_manager import BillingManager
+from src.csv.data_processor import DataProcessor
+from src.journey import JourneyManager
+from src.mass_transit_billing import MassTransitBilling
+from src.model.journey import Journey
+from src.tariff import FareTable
+from src.util import reject_sink
+from src.util.reject_sink import RejectSink, use_sink, BAD_FIELD_COUNT, BAD_TIMESTAMP, INVALID_DIRECTION, \
+    UNKNOWN_STATION
+
+
+def _write_journeys(rows):
+    file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+    writer = csv.writer(file)
+    writer.writerow(['user_id', 'station', 'direction', 'time'])
+    writer.writerows(rows)
+    file.close()
+    return file.name
+
+
+BAD_ROWS = [
+    ['user1', 'core_cross', 'IN', '2022-04-04T9:40:00'],
+    ['user1', 'bad-row'],
+    ['user1', 'core_cross', 'OUT', 'not-a-time'],
+    ['user1', 'atlantis', 'OUT', '2022-04-04T9:50:00'],
+    ['user1', 'core_cross', 'OUT', '2022-04-04T9:55:00'],
+]
+
+
+def test_default_sink_prints_the_historical_messages(capsys):
+    path = _write_journeys(BAD_ROWS)
+    DataProcessor.read_transaction_from_csv(path, FareTable.from_zone_map_csv("zone_map.csv"))
+
+    assert capsys.readouterr().out.splitlines() == [
+        "Error processing row 3: Row 3 has an incorrect number of fields: 2",
+        "Error processing row 4: Invalid format for journey",
+        "Error processing row 5: Unknown station 'atlantis'",
+    ]
+
+
+def test_quarantine_file_and_counters(capsys):
+    path = _write_journeys(BAD_ROWS)
+    quarantine_path = os.path.join(tempfile.mkdtemp(), "rejects.csv")
+    sink = RejectSink(quarantine_path=quarantine_path, buffer_records=2)
+    previous = use_sink(sink)
+    try:
+        journeys = DataProcessor.read_transaction_from_csv(path, FareTable.from_zone_map_csv("zone_map.csv"))
+        JourneyManager(BillingManager(), {}).calculate([Journey("user2", "a", "SIDEWAYS", "2022-04-04T10:00:00")])
+    finally:
+        use_sink(previous)
+        sink.close()
+
+    assert len(journeys) == 2
+    assert capsys.readouterr().out == ""
+    assert sink.counts == {BAD_FIELD_COUNT: 1, BAD_TIMESTAMP: 1, UNKNOWN_STATION: 1, INVALID_DIRECTION: 1}
+
+    with open(quarantine_path, newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ["row", "reason", "message", "fields"]
+    assert rows[1] == ["3", BAD_FIELD_COUNT, "Error processing row 3: Row 3 has an incorrect number of fields: 2",
+                       "user1|bad-row"]
+    assert [row[:2] for row in rows[2:4]] == [["4", BAD_TIMESTAMP], ["5", UNKNOWN_STATION]]
+    assert rows[4][1] == INVALID_DIRECTION and "Invalid direction 'SIDEWAYS'" in rows[4][2]
+    # An event rejected while billing has no row number but keeps the fields of the tap
+    assert rows[4][0] == "" and rows[4][3] == "user2|a|SIDEWAYS|2022-04-04T10:00:00"
+
+
+def test_count_only_never_formats_messages(monkeypatch):
+    def fail(*args):
+        raise AssertionError("message formatted in count-only mode")
+
+    monkeypatch.setattr(reject_sink, "format_reject", fail)
+    sink = RejectSink(count_only=True)
+    previous = use_sink(sink)
+    try:
+        DataProcessor.read_transaction_from_csv(_write_journeys(BAD_ROWS), FareTable.from_zone_map_csv("zone_map.csv"))
+    finally:
+        use_sink(previous)
+
+    assert sink.total == 3
+
+
+def test_run_prints_a_summary_when_counting(capsys):
+    output_path = os.path.join(tempfile.mkdtemp(), "output.csv")
+    billing = MassTransitBilling(_write_journeys(BAD_ROWS), "zone_map.csv", output_path, count_rejects_only=True)
+    billing.run()
+
+    assert capsys.readouterr().out.splitlines() == [
+        "Rejected 3 records: bad_field_count=1, bad_timestamp=1, unknown_station=1"]
+    assert billing.reject_sink.counts[UNKNOWN_STATION] == 1
+
+
+def test_each_run_rewrites_the_quarantine_file(capsys):
+    quarantine_path = os.path.join(tempfile.mkdtemp(), "rejects.csv")
+    with open(quarantine_path, 'w') as file:
+        file.write("left from an earlier day\n")
+    billing = MassTransitBilling(_write_journeys(BAD_ROWS), "zone_map.csv",
+                                 os.path.join(tempfile.mkdtemp(), "output.csv"), quarantine_path=quarantine_path)
+    with open(quarantine_path) as file:
+        assert file.read() == "left from an earlier day\n"
+
+    for _ in range(2):
+        assert billing.run()
+        with open(quarantine_path, newline='') as file:
+            rows = list(csv.reader(file))
+        assert [row[:2] for row in rows] == [["row", "reason"], ["3", BAD_FIELD_COUNT], ["4", BAD_TIMESTAMP],
+                                             ["5", UNKNOWN_STATION]]
+        assert billing.reject_sink.total == 3
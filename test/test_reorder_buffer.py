@@ -0,0 +1,73 @@
+import os
+import random
+import tempfile
+
+from src.csv.csv_reader import CSVReader
+from src.mass_transit_billing import MassTransitBilling
+from src.model.journey import Journey
+from src.reorder_buffer import ReorderBuffer
+from src.util.reject_sink import RejectSink, use_sink, LATE_EVENT
+
+
+def _journey(user_id, direction, time):
+    return Journey(user_id, "core_cross", direction, time)
+
+
+def test_releases_in_timestamp_order_within_the_window():
+    journeys = [
+        _journey("user1", "OUT", "2022-04-04T9:05:00"),
+        _journey("user1", "IN", "2022-04-04T9:00:00"),
+        _journey("user2", "IN", "2022-04-04T9:04:00"),
+        _journey("user2", "OUT", "2022-04-04T9:20:00"),
+    ]
+    buffer = ReorderBuffer(lateness_seconds=600)
+
+    released = list(buffer.reorder(journeys))
+
+    assert [journey.epoch for journey in released] == sorted(journey.epoch for journey in journeys)
+    assert buffer.late_events == 0
+    assert buffer.max_held == 4
+
+
+def test_holds_only_the_window_and_rejects_late_taps():
+    sink = RejectSink(echo=False, collect=True)
+    previous = use_sink(sink)
+    try:
+        buffer = ReorderBuffer(lateness_seconds=60)
+        assert buffer.push(_journey("user1", "IN", "2022-04-04T9:00:00")) == []
+        released = buffer.push(_journey("user1", "OUT", "2022-04-04T9:10:00"))
+        assert [journey.direction for journey in released] == ["IN"]
+        assert len(buffer) == 1
+
+        assert buffer.push(_journey("user2", "IN", "2022-04-04T8:59:00")) == []
+        assert [journey.direction for journey in buffer.drain()] == ["OUT"]
+    finally:
+        use_sink(previous)
+
+    assert buffer.late_events == 1
+    assert sink.counts == {LATE_EVENT: 1}
+    # The late tap keeps its fields, so its quarantine record can be replayed
+    records, _ = sink.drain()
+    assert [(reason, fields) for reason, _, fields, _ in records] == [
+        (LATE_EVENT, ("user2", "core_cross", "IN", "2022-04-04T08:59:00"))]
+
+
+def test_shuffled_feed_bills_like_the_sorted_file():
+    directory = tempfile.mkdtemp()
+    rows = CSVReader.read_csv("journey_data.csv")
+    # Move each tap by at most two places; the sample taps are at least minutes apart
+    rng = random.Random(3)
+    shuffled = sorted(enumerate(rows), key=lambda item: item[0] + rng.uniform(-2, 2))
+    journey_path = os.path.join(directory, "shuffled.csv")
+    with open(journey_path, 'w') as file:
+        file.write("user_id,station,direction,time\n")
+        file.writelines(",".join(row) + "\n" for _, row in shuffled)
+
+    sorted_output = os.path.join(directory, "sorted.csv")
+    reordered_output = os.path.join(directory, "reordered.csv")
+    MassTransitBilling("journey_data.csv", "zone_map.csv", sorted_output).run()
+    MassTransitBilling(journey_path, "zone_map.csv", reordered_output, reorder_window=7 * 24 * 3600).run(
+        streaming=True)
+
+    with open(sorted_output) as expected, open(reordered_output) as actual:
+        assert expected.read() == actual.read()
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+
+from src.billing_manager import BillingManager
+from src.journey import JourneyManager
+from src.mass_transit_billing import MassTransitBilling
+from src.model.journey import Journey
+from src.run_metrics import RunMetrics
+
+
+def test_billing_counters():
+    billing_manager = BillingManager()
+    JourneyManager(billing_manager, {"a": 0.8, "b": 0.5}).calculate([
+        Journey("user1", "a", "IN", "2022-04-04T9:00:00"),
+        Journey("user1", "b", "IN", "2022-04-04T9:10:00"),
+        Journey("user1", "b", "OUT", "2022-04-04T9:20:00"),
+        Journey("user1", "a", "OUT", "2022-04-05T9:00:00"),
+        Journey("user1", "a", "IN", "2022-04-05T9:05:00"),
+        Journey("user1", "b", "IN", "2022-04-05T9:10:00"),
+        Journey("user1", "b", "IN", "2022-04-05T9:20:00"),
+    ])
+
+    # IN after IN three times, OUT without IN, and the journey left open at the end; the second day reaches the daily
+    # cap with its third penalty, so the one for the journey left open is clamped
+    assert billing_manager.stats.as_dict() == {"events": 7, "penalties": 5, "cap_clamps": 1,
+                                               "daily_cap_resets": 1, "monthly_cap_resets": 0}
+
+
+def test_stages_are_timed():
+    metrics = RunMetrics()
+    with metrics.stage("work"):
+        sum(range(10000))
+    metrics.count(events=3)
+
+    summary = metrics.summary()
+    assert summary["stages"]["work"]["wall_seconds"] > 0
+    assert summary["stages"]["work"]["peak_rss_mb"] > 0
+    assert summary["counters"] == {"events": 3}
+
+
+def test_run_writes_json_summary():
+    directory = tempfile.mkdtemp()
+    metrics_path = os.path.join(directory, "metrics.json")
+    MassTransitBilling("journey_data.csv", "zone_map.csv", os.path.join(directory, "output.csv"),
+                       metrics_path=metrics_path).run()
+
+    with open(metrics_path) as file:
+        summary = json.load(file)
+    assert list(summary["stages"]) == ["load_data", "process_billing", "sort", "write"]
+    assert summary["counters"]["events"] == 15
+    assert summary["counters"]["rejected_rows"] == 0
@@ -0,0 +1,77 @@
+import csv
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src.billing_manager import BillingManager
+from src.csv.data_processor import DataProcessor
+from src.csv.parallel_csv_reader import ParallelCSVReader, split_ranges
+from src.journey import JourneyManager
+from src.sharded_billing import ShardedBilling, partition_columns, shard_of
+
+ZONE_COST = {"a": 0.80, "b": 0.50, "c": 0.30}
+
+
+def _write_random_journeys(seed: int, rows: int = 2000) -> str:
+    rng = random.Random(seed)
+    time = datetime(2022, 4, 1, 6, 0, 0)
+    file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+    writer = csv.writer(file)
+    writer.writerow(['user_id', 'station', 'direction', 'time'])
+    for row in range(rows):
+        time += timedelta(seconds=rng.choice([30, 600, 3600, 40000]))
+        writer.writerow([f"user{rng.randrange(25)}", rng.choice(list(ZONE_COST)), rng.choice(["IN", "OUT"]),
+                         time.strftime("%Y-%m-%dT%H:%M:%S")])
+        if row in (7, 1500):
+            writer.writerow(["broken-row"])
+    file.close()
+    return file.name
+
+
+def test_partition_keeps_order_within_shards():
+    columns = DataProcessor.read_transaction_columns_from_csv(_write_random_journeys(1))
+    shards = partition_columns(columns, 4)
+
+    assert sum(len(shard) for _, shard in shards) == len(columns)
+    for number, (positions, shard) in enumerate(shards):
+        assert np.all(np.diff(positions) > 0)
+        assert np.array_equal(shard.epoch, columns.epoch[positions])
+        assert all(shard_of(user_id, 4) == number for user_id in shard.users)
+
+
+def test_sharded_billing_matches_single_process():
+    path = _write_random_journeys(2)
+    expected = JourneyManager(BillingManager(), ZONE_COST).calculate(DataProcessor.read_transaction_from_csv(path))
+
+    actual = ShardedBilling(ZONE_COST, workers=3).calculate(DataProcessor.read_transaction_columns_from_csv(path))
+
+    assert list(actual.items()) == list(expected.items())
+
+
+def test_split_ranges_align_to_lines():
+    path = _write_random_journeys(3)
+    with open(path, 'rb') as file:
+        content = file.read()
+
+    ranges = split_ranges(path, 7)
+
+    assert ranges[0][0] == content.index(b"\n") + 1
+    assert ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and content[start - 1:start] == b"\n"
+
+
+def test_parallel_reader_matches_data_processor(capsys):
+    path = _write_random_journeys(4)
+    expected = DataProcessor.read_transaction_columns_from_csv(path)
+    expected_errors = capsys.readouterr().out
+
+    actual = ParallelCSVReader(workers=3).read_columns(path)
+
+    assert capsys.readouterr().out == expected_errors
+    assert "row 10:" in expected_errors and "row 1504:" in expected_errors
+    assert actual.users == expected.users and actual.stations == expected.stations
+    for name in ("user_idx", "station_idx", "direction", "epoch", "day", "month"):
+        assert np.array_equal(getattr(actual, name), getattr(expected, name))
@@ -0,0 +1,63 @@
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from src.billing_manager import BillingManager
+from src.journey import JourneyManager
+from src.model.journey import Journey
+from src.state_checkpoint import StateCheckpoint
+
+ZONE_COST = {"a": 0.80, "b": 0.50, "c": 0.10}
+
+
+def _random_days(seed: int, days: int = 6):
+    rng = random.Random(seed)
+    schedule = []
+    for day in range(days):
+        time = datetime(2022, 4, 28, 5, 0, 0) + timedelta(days=day)
+        journeys = []
+        for _ in range(rng.randrange(50, 150)):
+            time += timedelta(seconds=rng.choice([20, 200, 600]))
+            journeys.append(Journey(f"user{rng.randrange(12)}", rng.choice(list(ZONE_COST)),
+                                    rng.choice(["IN", "OUT"]), time.strftime("%Y-%m-%dT%H:%M:%S")))
+        schedule.append(journeys)
+    return schedule
+
+
+def test_daily_runs_with_checkpoints_match_a_full_run():
+    schedule = _random_days(3)
+    expected = dict(JourneyManager(BillingManager(), ZONE_COST).calculate(
+        [journey for day in schedule for journey in day]))
+
+    state_path = os.path.join(tempfile.mkdtemp(), "state.bin")
+    checkpoint = StateCheckpoint(block_size=5)
+    billing_manager = BillingManager()
+    for day in schedule:
+        JourneyManager(billing_manager, ZONE_COST).calculate(day, finalize=False)
+        checkpoint.save(billing_manager, state_path)
+        billing_manager = checkpoint.load(state_path)
+
+    actual = dict(JourneyManager(billing_manager, ZONE_COST).calculate([]))
+    assert actual == expected
+
+
+def test_checkpoint_round_trip_keeps_caps_and_open_journeys():
+    billing_manager = BillingManager()
+    JourneyManager(billing_manager, ZONE_COST).calculate([
+        Journey("user1", "a", "IN", "2022-04-04T9:40:00"),
+        Journey("user1", "b", "OUT", "2022-04-04T10:00:00"),
+        Journey("user2", "c", "IN", "2022-04-04T11:00:00"),
+    ], finalize=False)
+    billing_manager.initialize_user("user3", datetime(2022, 4, 4, 12, 30))
+
+    path = os.path.join(tempfile.mkdtemp(), "state.bin")
+    StateCheckpoint().save(billing_manager, path)
+    restored = StateCheckpoint().load(path)
+
+    for user_id in ("user1", "user2", "user3"):
+        before, after = billing_manager.users.get(user_id), restored.users.get(user_id)
+        for field in ("bill", "day_cost", "day_key", "month_cost", "month_key", "in_station"):
+            assert getattr(after, field) == getattr(before, field)
+    assert restored.users.get("user2").in_day == billing_manager.users.get("user2").in_day
+    assert list(restored.track_active_journey) == ["user2"]
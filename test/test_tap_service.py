@@ -0,0 +1,88 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from src.csv.csv_reader import CSVReader
+from src.mass_transit_billing import MassTransitBilling
+from src.tap_service import TapClient, TapService
+from src.tariff import FareTable
+from src.util.reject_sink import BAD_EVENT, LATE_EVENT, UNKNOWN_STATION
+
+
+def _events(rows):
+    return [{"user_id": user_id, "station": station, "direction": direction, "time": time}
+            for user_id, station, direction, time in rows]
+
+
+def test_service_bills_like_a_batch_run():
+    directory = tempfile.mkdtemp()
+    batch_output = os.path.join(directory, "batch.csv")
+    service_output = os.path.join(directory, "service.csv")
+    MassTransitBilling("journey_data.csv", "zone_map.csv", batch_output).run()
+    rows = CSVReader.read_csv("journey_data.csv")
+
+    async def scenario():
+        service = await TapService(FareTable.from_zone_map_csv("zone_map.csv"), service_output, batch_size=4).start()
+        client = await TapClient.connect(*service.address)
+
+        assert (await client.tap(*rows[0]))["ok"]
+        response = await client.taps(_events(rows[1:]) + _events([["user1", "atlantis", "IN", rows[1][3]]]) +
+                                     [{"user_id": "user1", "station": "core_cross"}])
+        assert response["accepted"] == len(rows) - 1
+        assert [rejected["reason"] for rejected in response["rejected"]] == [UNKNOWN_STATION, BAD_EVENT]
+        bill = await client.bill("user1")
+        assert (await client.close_day())["ok"]
+        assert await client.bill("nobody") is None
+
+        await client.close()
+        await service.stop()
+        return bill
+
+    assert asyncio.run(scenario()) > 0
+    with open(batch_output) as batch, open(service_output) as service:
+        assert batch.read() == service.read()
+
+
+def test_bill_query_sees_the_clients_own_taps():
+    async def scenario():
+        service = await TapService(FareTable.from_zone_map_csv("zone_map.csv")).start()
+        client = await TapClient.connect(*service.address)
+        await client.tap("user1", "think_tank_terminus", "IN", "2022-04-04T9:40:00")
+        await client.tap("user1", "core_cross", "OUT", "2022-04-04T9:50:00")
+        bill = await client.bill("user1")
+        await client.close()
+        await service.stop()
+        return bill
+
+    assert asyncio.run(scenario()) == pytest.approx(2.0 + 0.8 + 0.5)
+
+
+def test_full_queue_pushes_back():
+    async def scenario():
+        service = TapService(FareTable.from_zone_map_csv("zone_map.csv"), max_queued_batches=1)
+        service.start_billing()
+        service._biller.cancel()
+        event = _events([["user1", "core_cross", "IN", "2022-04-04T9:40:00"]])
+
+        await service.submit(event)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(service.submit(event), timeout=0.05)
+
+    asyncio.run(scenario())
+
+
+def test_late_taps_are_counted_by_the_service_sink(capsys):
+    async def scenario():
+        service = TapService(FareTable.from_zone_map_csv("zone_map.csv"), reorder_window=60)
+        service.start_billing()
+        await service.submit(_events([["user1", "core_cross", "IN", "2022-04-04T9:40:00"],
+                                      ["user1", "core_cross", "OUT", "2022-04-04T9:50:00"],
+                                      ["user2", "core_cross", "IN", "2022-04-04T9:30:00"]]))
+        await service.stop()
+        return service
+
+    service = asyncio.run(scenario())
+    assert service.reject_sink.counts == {LATE_EVENT: 1}
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,53 @@
+import csv
+import os
+import tempfile
+
+import numpy as np
+
+from src.billing_manager import BillingManager
+from src.csv.data_processor import DataProcessor
+from src.journey import JourneyManager
+from src.tariff import FareTable
+from src.util.constans import TRIP_CHARGES
+from src.zone_index import ZoneIndex
+
+
+def test_fare_table_matches_journey_cost_formula():
+    zone_map = DataProcessor.read_zone_map_from_csv("zone_map.csv")
+    fare_table = FareTable.from_zone_map_csv("zone_map.csv")
+
+    for start, start_fee in zone_map.items():
+        for end, end_fee in zone_map.items():
+            assert fare_table.trip_cost(start, end) == TRIP_CHARGES + start_fee + end_fee
+    assert dict(fare_table) == zone_map
+
+
+def test_batch_costs_and_index_backed_table():
+    index_path = os.path.join(tempfile.mkdtemp(), "zone_map.idx")
+    ZoneIndex.compile("zone_map.csv", index_path)
+    fare_table = FareTable.from_zone_index(ZoneIndex(index_path))
+    stations = ["think_tank_terminus", "core_cross", "cloud_lane", "think_tank_terminus"]
+
+    zone_ids = fare_table.zone_ids(stations)
+    costs = fare_table.batch_costs(zone_ids[:-1], zone_ids[1:])
+
+    assert np.array_equal(costs, [fare_table.trip_cost(a, b) for a, b in zip(stations[:-1], stations[1:])])
+    assert "unknown_station" not in fare_table
+
+
+def test_unknown_stations_are_rejected_at_load(capsys):
+    file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+    writer = csv.writer(file)
+    writer.writerow(['user_id', 'station', 'direction', 'time'])
+    writer.writerow(['user1', 'core_cross', 'IN', '2022-04-04T9:40:00'])
+    writer.writerow(['user1', 'atlantis', 'OUT', '2022-04-04T9:50:00'])
+    file.close()
+    fare_table = FareTable.from_zone_map_csv("zone_map.csv")
+
+    journeys = DataProcessor.read_transaction_from_csv(file.name, fare_table)
+    bills = JourneyManager(BillingManager(), fare_table).calculate(journeys)
+
+    assert "Error processing row 3: Unknown station 'atlantis'" in capsys.readouterr().out
+    assert [journey.station for journey in journeys] == ["core_cross"]
+    # The dangling IN is penalised instead of billing a 0.00 journey
+    assert dict(bills) == {"user1": 5.0}
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+
+import src.billing_manager
+import src.journey
+from src.billing_manager import BillingManager
+from src.csv.data_processor import DataProcessor
+from src.journey import JourneyManager
+from src.mass_transit_billing import MassTransitBilling, ENGINE_COLUMNAR
+from src.synthetic_data import JourneyGenerator
+from src.tariff import FareTable, Tariff
+from src.tariff_simulation import TariffSimulation
+
+TARIFFS = [
+    Tariff("current"),
+    Tariff("dearer_trips", trip_charge=2.4, zone_fees={1: 1.0}),
+    Tariff("lower_caps", penalty_charge=4.0, daily_cap=11.0, monthly_cap=60.0),
+]
+
+
+def _journey_data():
+    directory = tempfile.mkdtemp()
+    zone_path, journey_path = JourneyGenerator(users=60, stations=10, days=40, journeys_per_day=120,
+                                               seed=11).generate(directory)
+    zone_numbers = DataProcessor.read_zone_numbers_from_csv(zone_path)
+    fare_table = FareTable.from_zone_numbers(zone_numbers)
+    return zone_numbers, fare_table, DataProcessor.read_transaction_columns_from_csv(journey_path, fare_table)
+
+
+def _journey_manager_bills(monkeypatch, tariff, zone_numbers, columns):
+    """Bills of a JourneyManager run with the module constants set to the tariff"""
+    monkeypatch.setattr(src.journey, "TRIP_CHARGES", tariff.trip_charge)
+    monkeypatch.setattr(src.billing_manager, "PENALTY_CHARGES", tariff.penalty_charge)
+    monkeypatch.setattr(src.billing_manager, "DAILY_CAP", tariff.daily_cap)
+    monkeypatch.setattr(src.billing_manager, "MONTHLY_CAP", tariff.monthly_cap)
+    zone_cost = {station: tariff.zone_fee(zone) for station, zone in zone_numbers.items()}
+    return dict(JourneyManager(BillingManager(), zone_cost).calculate(columns.iter_journeys()))
+
+
+def test_every_tariff_matches_a_journey_manager_run(monkeypatch):
+    zone_numbers, fare_table, columns = _journey_data()
+
+    result = TariffSimulation(fare_table, TARIFFS).calculate(columns)
+
+    for tariff in TARIFFS:
+        with monkeypatch.context() as patch:
+            assert result.bills_of(tariff.name) == _journey_manager_bills(patch, tariff, zone_numbers, columns)
+    summary = {line["tariff"]: line for line in result.summary()}
+    assert summary["lower_caps"]["revenue"] < summary["current"]["revenue"] < summary["dearer_trips"]["revenue"]
+    assert summary["current"]["trips"] + summary["current"]["penalties"] > 0
+
+
+def test_bill_columns_and_tariff_file():
+    _, fare_table, columns = _journey_data()
+    directory = tempfile.mkdtemp()
+    tariff_path = os.path.join(directory, "tariffs.json")
+    with open(tariff_path, 'w') as file:
+        json.dump([{"name": "current"}, {"name": "dearer_trips", "trip_charge": 2.4, "zone_fees": {"1": 1.0}}], file)
+
+    tariffs = Tariff.load(tariff_path)
+    output_path = os.path.join(directory, "bills.csv")
+    TariffSimulation(fare_table, tariffs).calculate(columns).write_bills(output_path)
+
+    assert tariffs[1].zone_fees == {1: 1.0}
+    with open(output_path) as file:
+        lines = file.read().splitlines()
+    assert lines[0] == "user_id,current,dearer_trips"
+    assert len(lines) == len(columns.users) + 1
+    # A chunk at a time gives the same file
+    TariffSimulation(fare_table, tariffs).calculate(columns).write_bills(output_path, chunk_rows=7)
+    with open(output_path) as file:
+        assert file.read().splitlines() == lines
+    assert sorted(os.listdir(directory)) == ["bills.csv", "tariffs.json"]
+
+
+def test_simulation_writes_csv_only():
+    output_path = os.path.join(tempfile.mkdtemp(), "bills.parquet")
+    billing = MassTransitBilling("journey_data.csv", "zone_map.csv", output_path, engine=ENGINE_COLUMNAR)
+
+    assert billing.simulate(TARIFFS) is None
+    assert billing.error == "Tariff simulation writes CSV bills, not parquet"
+    assert not os.path.exists(output_path)
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+
+from src.model.journey import Journey
+from src.util.timestamp_parser import TimestampParser, as_datetime, day_key, month_key
+
+
+def test_parse_matches_strptime_for_unpadded_hours():
+    parser = TimestampParser()
+    for text in ["2022-04-04T9:40:00", "2022-04-04T13:55:00", "2022-12-31T23:59:59", "2024-02-29T0:00:00"]:
+        expected = datetime.strptime(text, "%Y-%m-%dT%H:%M:%S")
+        epoch, day, month = parser.parse(text)
+
+        assert as_datetime(epoch) == expected
+        assert day == expected.toordinal()
+        assert month == expected.year * 12 + expected.month - 1
+
+
+def test_parse_rejects_malformed_timestamps():
+    parser = TimestampParser()
+    for text in ["2022-04-04 9:40:00", "2022-04-04T24:00:00", "2022-04-04T9:40", "2022-13-01T9:40:00", "garbage"]:
+        with pytest.raises(ValueError):
+            parser.parse(text)
+
+
+def test_date_cache_is_bounded():
+    parser = TimestampParser(max_cached_dates=2)
+    for day in range(1, 6):
+        parser.parse(f"2022-04-0{day}T10:00:00")
+    assert len(parser._dates) <= 2
+
+
+def test_keys_agree_for_epoch_and_datetime():
+    journey = Journey("user1", "a", "IN", "2022-04-04T9:40:00")
+
+    assert day_key(journey.epoch) == day_key(journey.time) == journey.day
+    assert month_key(journey.epoch) == month_key(journey.time) == journey.month
@@ -10,3 +10,33 @@ def test_additional_zone_fee():
     assert additional_zone_fee(1) == 0.80
     assert additional_zone_fee(4) == 0.30
     assert additional_zone_fee(7) == 0.10
+
+
+def _write_journeys(rows):
+    file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+    writer = csv.writer(file)
+    writer.writerow(['user_id', 'station', 'direction', 'time'])
+    writer.writerows(rows)
+    file.close()
+    return file.name
+
+
+def test_stream_transaction_from_csv_matches_list():
+    path = _write_journeys([
+        ['user1', 'a', 'IN', '2022-04-04T9:40:00'],
+        ['user1', 'bad-row'],
+        ['user1', 'b', 'OUT', '2022-04-04T10:05:00'],
+    ])
+
+    streamed = DataProcessor.stream_transaction_from_csv(path)
+    loaded = DataProcessor.read_transaction_from_csv(path)
+
+    assert not isinstance(streamed, list)
+    streamed = list(streamed)
+    assert all(isinstance(journey, Journey) for journey in streamed)
+    assert [(j.userId, j.station, j.direction, j.time) for j in streamed] == \
+           [(j.userId, j.station, j.direction, j.time) for j in loaded]
+
+
+def test_stream_transaction_from_csv_missing_file():
+    assert DataProcessor.stream_transaction_from_csv("does_not_exist.csv") == "File Not Found: does_not_exist.csv"
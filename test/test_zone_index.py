@@ -0,0 +1,47 @@
+import os
+import pickle
+import struct
+import tempfile
+
+import pytest
+
+from src.csv.data_processor import DataProcessor
+from src.zone_index import ZoneIndex
+
+
+def _compiled_sample() -> str:
+    index_path = os.path.join(tempfile.mkdtemp(), "zone_map.idx")
+    ZoneIndex.compile("zone_map.csv", index_path)
+    return index_path
+
+
+def test_index_matches_csv_zone_map():
+    zone_map = DataProcessor.read_zone_map_from_csv("zone_map.csv")
+    index = ZoneIndex(_compiled_sample())
+
+    assert len(index) == len(zone_map)
+    assert dict(index) == zone_map
+    for station, fee in zone_map.items():
+        assert index.get(station) == fee
+        assert index.station_name(index.station_id(station)) == station
+    assert index.get("unknown_station") is None
+    assert "unknown_station" not in index
+    assert index.zone(index.station_id("core_cross")) == 3
+    assert index.distinct_zones() == set(DataProcessor.read_zone_numbers_from_csv("zone_map.csv").values())
+
+
+def test_index_detection_and_pickling():
+    index_path = _compiled_sample()
+
+    assert ZoneIndex.is_index(index_path)
+    assert not ZoneIndex.is_index("zone_map.csv")
+    assert dict(pickle.loads(pickle.dumps(ZoneIndex(index_path)))) == dict(ZoneIndex(index_path))
+
+
+def test_index_of_another_version_is_refused():
+    index_path = _compiled_sample()
+    with open(index_path, 'r+b') as file:
+        file.seek(4)
+        file.write(struct.pack("<H", 1))
+    with pytest.raises(ValueError, match="compile it again"):
+        ZoneIndex(index_path)
@@ -0,0 +1,119 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from src.csv.data_processor import DataProcessor
+from src.mass_transit_billing import MassTransitBilling
+from src.synthetic_data import JourneyGenerator
+from src.zone_rebill import RebillIndex, patch_output, main
+
+
+def _read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def _write_zone_map(path, zone_numbers):
+    with open(path, 'w') as file:
+        file.write("station,zone\n")
+        file.writelines(f"{station},{zone}\n" for station, zone in zone_numbers.items())
+
+
+def test_rebill_patches_the_output_of_a_full_run():
+    directory = tempfile.mkdtemp()
+    zone_path, journey_path = JourneyGenerator(users=80, stations=30, days=40, journeys_per_day=100,
+                                               seed=5).generate(directory)
+    output_path = os.path.join(directory, "output.csv")
+    index_path = os.path.join(directory, "rebill.npz")
+    assert MassTransitBilling(journey_path, zone_path, output_path, count_rejects_only=True,
+                              rebill_index_path=index_path).run()
+
+    # Rezone two stations, one of them to a zone with the same fee, and drop a third from the map
+    zone_numbers = DataProcessor.read_zone_numbers_from_csv(zone_path)
+    stations = list(zone_numbers)
+    zone_numbers[stations[0]] = zone_numbers[stations[0]] % 4 + 1
+    zone_numbers[stations[1]] = {2: 3, 3: 2}.get(zone_numbers[stations[1]], zone_numbers[stations[1]])
+    del zone_numbers[stations[2]]
+    new_zone_path = os.path.join(directory, "new_zone_map.csv")
+    _write_zone_map(new_zone_path, zone_numbers)
+
+    index = RebillIndex.load(index_path)
+    assert {index.stations[s] for s in index.changed_stations(zone_numbers)} == {stations[0], stations[2]}
+    bills, removed = index.rebill(zone_numbers)
+    patch_output(output_path, index, bills, removed)
+
+    expected_path = os.path.join(directory, "expected.csv")
+    assert MassTransitBilling(journey_path, new_zone_path, expected_path, count_rejects_only=True).run()
+    assert _read(output_path) == _read(expected_path)
+    assert 0 < len(bills) + len(removed) <= len(index.users)
+
+
+def test_contributions_add_up_to_the_bills():
+    directory = tempfile.mkdtemp()
+    zone_path, journey_path = JourneyGenerator(users=40, stations=10, days=30, journeys_per_day=80,
+                                               seed=8).generate(directory)
+    index = RebillIndex.from_journey_file(journey_path, DataProcessor.read_zone_numbers_from_csv(zone_path))
+    index.save(os.path.join(directory, "rebill.npz"))
+    index = RebillIndex.load(os.path.join(directory, "rebill.npz"))
+
+    charges = index.charges
+    totals = np.zeros(len(index.users))
+    np.add.at(totals, charges["user"], charges["charged"])
+    assert np.allclose(totals, index.bills)
+    assert np.all(charges["charged"] <= charges["base"])
+    # Capped journeys show up as charges reduced below their base cost
+    assert np.any(charges["charged"] < charges["base"])
+
+
+def test_unreadable_zone_map_leaves_the_output_alone(monkeypatch, capsys):
+    directory = tempfile.mkdtemp()
+    output_path = os.path.join(directory, "output.csv")
+    index_path = os.path.join(directory, "rebill.npz")
+    assert MassTransitBilling("journey_data.csv", "zone_map.csv", output_path, rebill_index_path=index_path).run()
+    before = _read(output_path), _read(index_path)
+
+    missing_path = os.path.join(directory, "missing.csv")
+    monkeypatch.setattr("sys.argv", ["zone_rebill", index_path, missing_path, output_path])
+    with pytest.raises(SystemExit):
+        main()
+
+    assert capsys.readouterr().out.splitlines()[-1] == f"Error reading zone data: {missing_path}"
+    assert (_read(output_path), _read(index_path)) == before
+
+
+@pytest.mark.parametrize("engine", ["journey", "columnar"])
+def test_run_indexes_the_taps_its_parse_left_out(engine):
+    directory = tempfile.mkdtemp()
+    zone_path, journey_path = JourneyGenerator(users=30, stations=12, days=5, journeys_per_day=40,
+                                               seed=3).generate(directory)
+    # Malformed rows between the taps, and a zone map without two of the stations
+    with open(journey_path) as file:
+        lines = file.readlines()
+    for position in (len(lines) - 5, len(lines) // 2, 7):
+        lines.insert(position, "user,station,IN\n")
+    with open(journey_path, 'w') as file:
+        file.writelines(lines)
+    zone_numbers = DataProcessor.read_zone_numbers_from_csv(zone_path)
+    for station in list(zone_numbers)[:2]:
+        del zone_numbers[station]
+    _write_zone_map(zone_path, zone_numbers)
+
+    index_path = os.path.join(directory, "rebill.npz")
+    billing = MassTransitBilling(journey_path, zone_path, os.path.join(directory, "output.csv"), engine=engine,
+                                 count_rejects_only=True, rebill_index_path=index_path)
+    assert billing.run()
+    assert billing.reject_sink.counts["bad_field_count"] == 3 and billing.reject_sink.counts["unknown_station"] > 0
+
+    index = RebillIndex.load(index_path)
+    parsed_again = RebillIndex.from_journey_file(journey_path, zone_numbers)
+    assert index.users == parsed_again.users and index.stations == parsed_again.stations
+    for name in ("tap_order", "station_idx", "direction", "epoch", "user_offsets", "bills"):
+        assert np.array_equal(getattr(index, name), getattr(parsed_again, name))
+
+
+def test_reordering_runs_do_not_save_an_index():
+    with pytest.raises(ValueError, match="reorders taps"):
+        MassTransitBilling("journey_data.csv", "zone_map.csv", "output.csv", reorder_window=600,
+                           rebill_index_path="rebill.npz")